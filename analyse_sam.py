@@ -1,10 +1,27 @@
 import sys  # Library to access command-line arguments.
+import argparse  # Parses the command-line options.
 import os  # Library to manage files and directories.
-import matplotlib.pyplot as plt  # Library to create plots and graphs.
 from collections import defaultdict  # Simplifies the handling of dictionaries.
-from tabulate import tabulate  # For displaying summary tables.
-import re  # For working with regular expressions.
-from fpdf import FPDF # For generating the final PDF document.
+from sam_cigar import parse_cigar  # Memoized CIGAR parser.
+from functools import partial  # Binds the header references to the accumulator factory.
+from sam_io import (iter_sam_records, parse_sam_lines, is_compressed, is_snapshot,  # Streaming SAM/BAM reader.
+                    read_references, parse_references)
+from sam_parallel import parallel_stats  # Multi-process parsing by byte ranges.
+from sam_index import write_index, iter_region_records  # Sidecar index for region queries.
+from sam_cache import StatsCache, cached_stats, DEFAULT_CACHE_DIR, DEFAULT_CACHE_BYTES  # Persistent result cache.
+from sam_stats import SamStats, summarize_chromosome, group_quality_by_intervals  # Single-pass statistics engine.
+from sam_report import report_accumulators, report_tables, OUTPUT_FORMATS, PDF_SECTIONS  # Report tables.
+from sam_pdf import PdfReport, PlotCache, plot_digest, report_figure, save_figure  # PDF report assembly.
+from sam_profile import Profiler, NULL_PROFILER, load_hook, timed_accumulators, untime_stats  # --profile.
+from sam_sample import SAMPLE_METHODS  # --sample (no NumPy at import: the stride reader is loaded on use).
+from sam_filter import (ReadFilter, FilteredStats, add_filter_arguments, parse_filter_set,  # Filter push-down.
+                        filter_lines, filtered_stats, filtered_tables, format_filter_sets, MAIN_SET)
+from sam_stream import (open_stdin, read_stream_header, LiveReport,  # Live statistics of standard input.
+                        DEFAULT_REFRESH_RECORDS, DEFAULT_REFRESH_SECONDS)
+
+# Plain SAM files smaller than this are parsed record by record: below it, the column parser saves less time
+# than importing sam_mmap (and NumPy) costs.
+MMAP_MIN_BYTES = 256 * 1024
 
 # KEYS: List defining SAM file columns to convert them into dictionary keys.
 KEYS = ['QNAME', 'FLAG', 'RNAME', 'POS', 'MAPQ', 'CIGAR', 'RNEXT', 'PNEXT', 'TLEN', 'SEQ', 'QUAL']
@@ -16,11 +33,13 @@ def create_dict(keys, values):
     # Creates a dictionary by associating each key with a corresponding value.
     return {keys[i]: values[i] for i in range(len(keys))}
 
-def read_sam_file(path):
+def read_sam_file(path, read_filter=None):
     # Reads the SAM file and extracts its data line by line.
+    # read_filter: sam_filter.ReadFilter; rejected lines are dropped before they are split.
     data = []  # List to store all parsed sequences.
     with open(path, "r") as file:  # Open the file in read mode.
-        for line in file:  # Loop through each line in the file.
+        lines = filter_lines(file, [read_filter]) if read_filter else file
+        for line in lines:  # Loop through each line in the file.
             if line.startswith("@"):  # Ignore header lines starting with "@".
                 continue
             infos = line.split("\t")  # Split the line into columns using tabs.
@@ -34,6 +53,8 @@ def read_sam_file(path):
 # ==========================================================================
 def count_reads(data):
     # Counts the number of mapped and unmapped reads based on the FLAG column.
+    if hasattr(data, "count_reads"):  # Columnar SamTable: vectorized computation.
+        return data.count_reads()
     mapped_reads = sum(1 for seq in data if not (int(seq['FLAG']) & 4))  # Reads are mapped if FLAG bit 4 is not set.
     unmapped_reads = len(data) - mapped_reads  # Unmapped reads are the remaining ones.
     return mapped_reads, unmapped_reads  # Return counts of mapped and unmapped reads.
@@ -43,6 +64,8 @@ def count_reads(data):
 # ==========================================================================
 def count_mapped_first_and_second(data):
     # Counts the number of first and second mapped reads using FLAG bits.
+    if hasattr(data, "count_mapped_first_and_second"):  # Columnar SamTable: vectorized computation.
+        return data.count_mapped_first_and_second()
     stats = {"first_reads_mapped": 0, "second_reads_mapped": 0}  # Initialize statistics.
     for seq in data:
         flag = int(seq['FLAG'])  # Extract FLAG as an integer.
@@ -59,6 +82,8 @@ def count_mapped_first_and_second(data):
 # ==========================================================================
 def analyze_chromosome_coverage(data):
     # Analyzes read positions by chromosome to determine coverage and mean read count.
+    if hasattr(data, "analyze_chromosome_coverage"):  # Columnar SamTable: vectorized computation.
+        return data.analyze_chromosome_coverage()
     chromosome_positions = defaultdict(list)  # Dictionary to store read positions for each chromosome.
 
     for seq in data:
@@ -70,22 +95,7 @@ def analyze_chromosome_coverage(data):
     # Calculate statistics for each chromosome.
     chromosome_stats = {}
     for chrom, positions in chromosome_positions.items():
-        min_pos = min(positions)  # Minimum position covered on the chromosome.
-        max_pos = max(positions)  # Maximum position covered on the chromosome.
-        coverage_length = max_pos - min_pos + 1  # Total covered region length.
-        read_count = len(positions)  # Total number of reads for this chromosome.
-        coverage = read_count / coverage_length  # Average coverage of reads.
-        coverage_percentage = (coverage_length / max_pos) * 100  # Coverage percentage.
-
-        # Store statistics in a dictionary for the current chromosome.
-        chromosome_stats[chrom] = {
-            "min_position": min_pos,  # Minimum position.
-            "max_position": max_pos,  # Maximum position.
-            "coverage_length": coverage_length,  # Total region length covered.
-            "read_count": read_count,  # Total number of reads.
-            "coverage": round(coverage, 2),  # Average read coverage.
-            "coverage_percentage": round(coverage_percentage, 2)  # Coverage percentage.
-        }
+        chromosome_stats[chrom] = summarize_chromosome(min(positions), max(positions), len(positions))
     return chromosome_stats  # Return the statistics.
 
 # ==========================================================================
@@ -93,21 +103,16 @@ def analyze_chromosome_coverage(data):
 # ==========================================================================
 def count_reads_by_quality(data):
     # Counts the number of reads for each MAPQ quality score.
+    if hasattr(data, "count_reads_by_quality"):  # Columnar SamTable: vectorized computation.
+        return data.count_reads_by_quality()
     quality_counts = defaultdict(int)  # Initialize a dictionary to count qualities.
     for seq in data:
         quality_counts[int(seq['MAPQ'])] += 1  # Increment count for each MAPQ score.
     return quality_counts  # Return the quality counts.
 
-def group_quality_by_intervals(quality_counts, interval_size=10):
-    # Groups quality scores into intervals for better visualization.
-    grouped_counts = defaultdict(int)
-    for quality, count in quality_counts.items():
-        interval = (quality // interval_size) * interval_size  # Group by interval.
-        grouped_counts[interval] += count  # Increment the interval count.
-    return dict(sorted(grouped_counts.items()))  # Return sorted grouped counts.
-
 def count_partially_mapped_reads(data):
-    partial_mapping_pattern = re.compile(r"[SHIND]")
+    if hasattr(data, "count_partially_mapped_reads"):  # Columnar SamTable: vectorized computation.
+        return data.count_partially_mapped_reads()
     # Counts partially mapped reads by checking the CIGAR column.
     # A read is considered partially mapped if it does not contain only an integer followed by 'M'.
     partial_reads = 0  # Initialize the counter for partially mapped reads
@@ -118,7 +123,7 @@ def count_partially_mapped_reads(data):
             continue
         
         # Check if the CIGAR contains anything other than an integer followed by 'M'
-        if partial_mapping_pattern.search(cigar):  
+        if parse_cigar(cigar).partial:  # Parsed once per distinct CIGAR (memo cache).
             partial_reads += 1  # Increment if the read is partially mapped
     return partial_reads  # Return the number of partially mapped reads
 
@@ -130,11 +135,11 @@ def count_partially_mapped_reads(data):
 # ========================================================================
 def plot_mapped_and_unmapped_proportion(infos, name):
     labels = ["Mapped", "Unmapped"]
-    plt.figure(figsize=(8, 8))
-    plt.pie(infos_maps, labels=labels, autopct='%1.1f%%', colors=['skyblue', 'orange'])
-    plt.title(f"Proportion of Mapped vs Unmapped Reads for {sam_file}")  # Add a title.
-    plt.savefig(f"{name}_mapped_vs_unmapped.png")  
-    plt.clf()
+    fig = report_figure("mapped_vs_unmapped", (8, 8))
+    ax = fig.subplots()
+    ax.pie(infos, labels=labels, autopct='%1.1f%%', colors=['skyblue', 'orange'])
+    ax.set_title(f"Proportion of Mapped vs Unmapped Reads for {os.path.basename(name)}")  # Add a title.
+    save_figure(fig, f"{name}_mapped_vs_unmapped.png")
 
 
 # ========================================================================
@@ -143,11 +148,11 @@ def plot_mapped_and_unmapped_proportion(infos, name):
 def plot_mapping_order(order_maps, name):
     labels = ["First Reads", "Second Reads", "Unmapped"]  # Labels for the pie chart.
     # Create a pie chart for first, second, and unmapped reads.
-    plt.figure(figsize=(8, 8))
-    plt.pie(order_maps, labels=labels, autopct='%1.1f%%', colors=['green', 'blue', 'red'])
-    plt.title(f"Mapping Order for Reads in {sam_file}")  # Add a title.
-    plt.savefig(f"{name}_mapping_order.png")
-    plt.clf()  # Clear the figure.
+    fig = report_figure("mapping_order", (8, 8))
+    ax = fig.subplots()
+    ax.pie(order_maps, labels=labels, autopct='%1.1f%%', colors=['green', 'blue', 'red'])
+    ax.set_title(f"Mapping Order for Reads in {os.path.basename(name)}")  # Add a title.
+    save_figure(fig, f"{name}_mapping_order.png")
 
 
 # ========================================================================
@@ -164,27 +169,35 @@ def plot_quality_mapping(quality_counts, name):
     mean_quality = sum(interval * count for interval, count in grouped_counts.items()) / total_reads
 
     # Create a bar chart for MAPQ scores.
-    plt.figure(figsize=(10, 6))
-    plt.bar(intervals, counts, width=8, color='skyblue', edgecolor='black', label='Number of Reads')
-    plt.axhline(mean_quality, color='red', linestyle='--', label=f'Average MAPQ: {mean_quality:.2f}')  # Add average line.
-    plt.xlabel('MAPQ Quality Intervals')  # X-axis label.
-    plt.ylabel('Number of Reads')  # Y-axis label.
-    plt.title('Distribution of MAPQ Quality Scores')  # Title for the graph.
-    plt.legend()
-    plt.savefig(f'{name}_quality_count.png')
-    plt.clf()  # Clear the figure.
+    fig = report_figure("quality_count", (10, 6))
+    ax = fig.subplots()
+    ax.bar(intervals, counts, width=8, color='skyblue', edgecolor='black', label='Number of Reads')
+    ax.axhline(mean_quality, color='red', linestyle='--', label=f'Average MAPQ: {mean_quality:.2f}')  # Add average line.
+    ax.set_xlabel('MAPQ Quality Intervals')  # X-axis label.
+    ax.set_ylabel('Number of Reads')  # Y-axis label.
+    ax.set_title('Distribution of MAPQ Quality Scores')  # Title for the graph.
+    ax.legend()
+    save_figure(fig, f'{name}_quality_count.png')
 
 # ========================================================================
 # Graph: Chromosome read coverage
 # ========================================================================
 def plot_chromosome_coverage(chromosome_stats, name):
+    from sam_bins import top_contigs
     # Displays a combined bar and line chart for chromosome coverage statistics.
+    # Only the chromosomes with the most reads get a bar; the others are pooled into "other".
+    chromosome_stats = dict(top_contigs(chromosome_stats.items(), key=lambda item: item[1]["read_count"],
+                                        combine=lambda pooled: {
+                                            "read_count": sum(stats["read_count"] for stats in pooled),
+                                            "coverage_percentage": sum(stats["coverage_percentage"]
+                                                                       for stats in pooled) / len(pooled)}))
     chromosomes = list(chromosome_stats.keys())  # Chromosome names.
     read_counts = [stats["read_count"] for stats in chromosome_stats.values()]  # Read counts for each chromosome.
     coverage_percentages = [stats["coverage_percentage"] for stats in chromosome_stats.values()]  # Coverage percentages.
 
     # Create a combined bar and line chart.
-    fig, ax1 = plt.subplots(figsize=(12, 8))
+    fig = report_figure("chromosome_coverage", (12, 8))
+    ax1 = fig.subplots()
 
     # Horizontal bars for read counts.
     ax1.barh(chromosomes, read_counts, color='lightblue', edgecolor='black', label='Read Counts')
@@ -198,11 +211,80 @@ def plot_chromosome_coverage(chromosome_stats, name):
     ax2.tick_params(axis='x', labelcolor='red')
 
     # Title and legend.
-    plt.title('Chromosome Read Counts and Coverage Percentage')  # Add a title.
+    ax2.set_title('Chromosome Read Counts and Coverage Percentage')  # Add a title.
     fig.tight_layout()  # Adjust layout to prevent overlap.
-    plt.legend()
-    plt.savefig(f"{name}_chromosome_coverage.png")  # Save the chart as PNG.
-    plt.clf()  # Clear the figure.
+    ax2.legend()
+    save_figure(fig, f"{name}_chromosome_coverage.png")  # Save the chart as PNG.
+
+# ========================================================================
+# Graph: Genome-wide depth track
+# ========================================================================
+def plot_genome_depth(binned_stats, name):
+    import numpy as np
+    from sam_bins import depth_track
+    # Displays the mean depth along the concatenated references, one point per plot bin.
+    bin_size, segments = depth_track(binned_stats)
+
+    fig = report_figure("genome_depth", (14, 5))
+    ax = fig.subplots()
+    ticks, labels = [], []
+    for index, (chrom, start, depth) in enumerate(segments):
+        positions = start + bin_size * np.arange(len(depth))
+        ax.fill_between(positions, depth, step='post', color='steelblue' if index % 2 == 0 else 'darkorange')
+        ticks.append(start + bin_size * len(depth) / 2)
+        labels.append(chrom)
+    ax.set_xticks(ticks)
+    ax.set_xticklabels(labels, rotation=90, fontsize=8)
+    ax.set_xlim(0, segments[-1][1] + bin_size * len(segments[-1][2]) if segments else 1)
+    ax.set_ylabel('Mean Depth')  # Y-axis label.
+    ax.set_title(f'Genome-wide Depth ({bin_size / 1000:g} kb bins)')  # Title for the graph.
+    fig.tight_layout()  # Adjust layout to prevent overlap.
+    save_figure(fig, f"{name}_genome_depth.png")
+
+# ========================================================================
+# Graph: Base quality per sequencing cycle
+# ========================================================================
+def plot_cycle_quality(sequence_stats, name):
+    from sam_sequence import histogram_mean, histogram_quantiles
+    # Displays the mean quality of each cycle with its interquartile and 10-90% ranges.
+    cycle_quality = sequence_stats["cycle_quality"]
+    cycles = range(1, len(cycle_quality) + 1)
+    quantiles = histogram_quantiles(cycle_quality)  # 10%, 25%, 50%, 75% and 90% of each cycle.
+
+    fig = report_figure("cycle_quality", (12, 6))
+    ax = fig.subplots()
+    ax.fill_between(cycles, quantiles[:, 0], quantiles[:, 4], color='lightblue', alpha=0.5, label='10-90%')
+    ax.fill_between(cycles, quantiles[:, 1], quantiles[:, 3], color='skyblue', label='Interquartile Range')
+    ax.plot(cycles, quantiles[:, 2], color='blue', label='Median')
+    ax.plot(cycles, histogram_mean(cycle_quality), color='red', linestyle='--', label='Mean')
+    ax.set_xlabel('Cycle')  # X-axis label.
+    ax.set_ylabel('Phred Quality')  # Y-axis label.
+    ax.set_title('Base Quality per Cycle')  # Title for the graph.
+    ax.legend()
+    save_figure(fig, f"{name}_cycle_quality.png")
+
+# ========================================================================
+# Graph: GC content and mean quality of the reads
+# ========================================================================
+def plot_sequence_content(sequence_stats, name):
+    # Displays the GC% distribution and the per-read mean quality distribution side by side.
+    fig = report_figure("sequence_content", (12, 5))
+    ax1, ax2 = fig.subplots(1, 2)
+    ax1.bar(range(101), sequence_stats["gc_content"], width=1, color='seagreen')
+    ax1.axvline(sequence_stats["gc_percent"], color='red', linestyle='--',
+                label=f'Mean GC: {sequence_stats["gc_percent"]:.2f}%')
+    ax1.set_xlabel('GC Content (%)')
+    ax1.set_ylabel('Number of Reads')
+    ax1.set_title('GC Content Distribution')
+    ax1.legend()
+    read_quality = sequence_stats["read_quality"]
+    ax2.bar(range(len(read_quality)), read_quality, width=1, color='orange')
+    ax2.set_xlim(0, max(int(read_quality.nonzero()[0].max()) + 2, 10) if read_quality.any() else 42)
+    ax2.set_xlabel('Mean Phred Quality of the Read')
+    ax2.set_ylabel('Number of Reads')
+    ax2.set_title('Read Quality Distribution')
+    fig.tight_layout()  # Adjust layout to prevent overlap.
+    save_figure(fig, f"{name}_sequence_content.png")
 
 
 
@@ -213,145 +295,416 @@ def plot_chromosome_coverage(chromosome_stats, name):
 def generate_pdf(report_data, output_file, images):
     """
     Generates a PDF report containing:
-    - Summary tables with analysis statistics.
+    - Summary tables with analysis statistics ({title: (headers, rows)}), paginated by blocks of rows.
     - Plots included as images.
     """
-    print(report_data)
-    pdf = FPDF()
-    pdf.add_page()
-    pdf.set_font("Arial", size=12)
-
-    # Title for the PDF
-    pdf.cell(200, 10, txt="SAM File Analysis Report", ln=True, align='C')
-    pdf.ln(10)
+    report = PdfReport("SAM File Analysis Report")
 
     # Add summary tables
-    for title, table_data in report_data.items():
-        pdf.set_font("Arial", 'B', size=12)
-        pdf.cell(200, 10, txt=title, ln=True, align='L')
-        pdf.ln(5)
-        pdf.set_font("Arial", size=10)
-        for row in table_data:
-            pdf.cell(0, 10, txt=" | ".join(str(x) for x in row), ln=True)
-        pdf.ln(5)
+    for title, (headers, rows) in report_data.items():
+        report.table(title, headers, rows)
     # Add plots
-    pdf.set_font("Arial", 'B', size=12)
-    pdf.cell(200, 10, txt="Generated Plots", ln=True, align='L')
-    pdf.ln(10)
+    report.heading("Generated Plots" if images else "No reads: no plots generated")
     for image in images:
-        pdf.image(image, x=10, w=190)
-        pdf.ln(5)
+        report.image(image)
 
     # Save the PDF
-    pdf.output(output_file)
+    report.output(output_file)
 
 
 
 
 
-# ==========================================================================
-#                                  Main program execution
-# ==========================================================================
-if __name__ == "__main__":
-    sam_file = sys.argv[1]  # Get the SAM file path from the command line.
-    if not os.path.exists(sam_file):  # Check if the file exists.
-        print(f"Error: The file '{sam_file}' does not exist.")
-        sys.exit(1)
-
-    name = os.path.basename(sam_file).split('.')[0]
-
-    # Step 1: Read the SAM file and extract data.
-    data = read_sam_file(sam_file)
-
-    # Step 2: Calculate basic statistics for the file.
-    mapped_reads, unmapped_reads = count_reads(data)  # Count mapped and unmapped reads.
-    read_pairs_stats = count_mapped_first_and_second(data)  # Count first and second mapped reads.
-    chromosome_stats = analyze_chromosome_coverage(data)  # Analyze chromosome coverage.
-    quality_counts = count_reads_by_quality(data)  # Count reads by MAPQ quality.
-    total_mapping = read_pairs_stats['first_reads_mapped'] + read_pairs_stats['second_reads_mapped']
-    partially_mapped_reads = count_partially_mapped_reads(data)
-
-
-    # Step 3: Print summary statistics
-    # Print summary statistics for mapped and unmapped reads with percentages.
-    print("\n===== Summary Statistics =====")
-    total_reads = len(data)  # Total number of reads in the file.
-    table = [
-        ["Total Reads", total_reads, "100.00%"],
-        ["Mapped Reads", mapped_reads, f"{(mapped_reads / total_reads) * 100:.2f}%"],  # Mapped reads with percentage.
-        ["Unmapped Reads", unmapped_reads, f"{(unmapped_reads / total_reads) * 100:.2f}%"],  # Unmapped reads with percentage.
-        ["First Reads Mapped", read_pairs_stats['first_reads_mapped'], 
-        f"{(read_pairs_stats['first_reads_mapped'] / total_reads) * 100:.2f}%"],  # Percentage of first mapped reads.
-        ["Second Reads Mapped", read_pairs_stats['second_reads_mapped'], 
-        f"{(read_pairs_stats['second_reads_mapped'] / total_reads) * 100:.2f}%"],  # Percentage of second mapped reads.
-        ["Partially Mapped Reads", partially_mapped_reads, f"{(partially_mapped_reads / total_reads) * 100:.2f}%"],  # Percentage of partially mapped reads.
-    ]
-
-   
-    # Display the summary table using tabulate for formatting.
-    print(tabulate(table, headers=["Statistic", "Value", "Percentage"], tablefmt="grid"))
-
-
-    # Step 4: Print chromosome statistics
-    # Print detailed coverage statistics for each chromosome.
-    print("\n===== Chromosome Coverage Statistics =====")
-    chrom_table = [
-        [chrom, stats["min_position"], stats["max_position"], stats["coverage_length"],
-        mapped_reads, stats["coverage"], stats["coverage_percentage"]]  # Chromosome-level statistics.
-        for chrom, stats in chromosome_stats.items()
-    ]
-    # Display the chromosome statistics using tabulate for formatting.
-    print(tabulate(chrom_table, headers=["Chromosome", "Min Position", "Max Position", "Region Length",
-                                        "Read Count", "Average Coverage", "% Coverage"], tablefmt="grid"))
-
-    
-
-    # Print grouped quality count
-    print("\n===== Quality Count Statistics =====")
-    grouped_quality_count =  group_quality_by_intervals(quality_counts)
-    quality_list = []
-    for key, val in grouped_quality_count.items():
-        quality_list.append([str(key), val])
-    
-    print(tabulate(quality_list, headers=["Interval", "Number", ], tablefmt="grid"))
-
-
+# ========================================================================
+# Function: Render the plots and the PDF report of accumulated statistics
+# ========================================================================
+def use_agg_backend():
+    # Initializer of the plotting processes: render to files, never to a window.
+    import matplotlib
+    matplotlib.use("Agg")
 
 
+def plot_tasks(stats):
+    # (plot function, statistics it draws) of every plot of the report, in display order.
+    if not stats["reads"].total:  # Nothing to draw (e.g. a filter set that keeps no reads): tables only.
+        return []
+    mapped_reads, unmapped_reads = stats["reads"].result()
+    read_pairs_stats = stats["pair_order"].result()
 
     # Data for the pie chart: mapped and unmapped reads.
     infos_maps = [mapped_reads, unmapped_reads]
-    plot_mapped_and_unmapped_proportion(infos_maps, name)
-
     order_maps = [read_pairs_stats["first_reads_mapped"], read_pairs_stats["second_reads_mapped"], unmapped_reads]
-    labels = ["First Reads", "Second Reads", "Unmapped"]  # Labels for the pie chart.
-
-    plot_mapping_order(order_maps, name)
-   
-    plot_chromosome_coverage(chromosome_stats, name)
-    plot_quality_mapping(quality_counts, name)
-
+    tasks = [
+        (plot_mapped_and_unmapped_proportion, infos_maps, "mapped_vs_unmapped"),
+        (plot_mapping_order, order_maps, "mapping_order"),
+        (plot_quality_mapping, stats["quality"].result(), "quality_count"),
+        (plot_chromosome_coverage, stats["chromosomes"].result(), "chromosome_coverage"),
+    ]
+    if "bins" in stats:  # Binned coverage (absent from older caches).
+        tasks.append((plot_genome_depth, stats["bins"].result(), "genome_depth"))
+    if "sequence" in stats and stats["sequence"].reads:  # SEQ/QUAL statistics (absent from older caches).
+        sequence_stats = stats["sequence"].result()
+        tasks += [(plot_cycle_quality, sequence_stats, "cycle_quality"),
+                  (plot_sequence_content, sequence_stats, "sequence_content")]
+    return tasks
+
+
+def plot_report(stats, name, profiler=NULL_PROFILER, jobs=None):
+    # Draws every plot of the report; name is the output prefix. Returns the image paths.
+    # A plot whose statistics are unchanged since the last report on this prefix is not drawn
+    # again (sam_pdf.PlotCache). The others only read aggregated statistics, so they are drawn by
+    # `jobs` processes at once (default: one per plot, up to the number of CPUs); jobs=1 draws
+    # them here, one stage each.
+    cache = PlotCache(name)
+    all_tasks, tasks = plot_tasks(stats), []
+    for plot, data, suffix in all_tasks:
+        digest = plot_digest(plot, data, name)
+        if not cache.fresh(f"{name}_{suffix}.png", suffix, digest):
+            tasks.append((plot, data, suffix, digest))
+    jobs = jobs or min(len(tasks), os.cpu_count() or 1)
+    if jobs > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        with profiler.stage("plots", jobs=jobs, cached=len(all_tasks) - len(tasks)), \
+                ProcessPoolExecutor(jobs, initializer=use_agg_backend) as pool:
+            futures = [(pool.submit(plot, data, name), suffix, digest) for plot, data, suffix, digest in tasks]
+            for future, suffix, digest in futures:
+                future.result()  # Re-raises the errors of the plotting processes.
+                cache.record(suffix, digest)
+    else:
+        for plot, data, suffix, digest in tasks:
+            with profiler.stage(plot.__name__):
+                plot(data, name)
+            cache.record(suffix, digest)
+    if tasks:
+        cache.save()
 
     # List of generated images to include in the PDF
-    images = [
-        f"{name}_mapped_vs_unmapped.png",
-        f"{name}_mapping_order.png",
-        f"{name}_quality_count.png",
-        f"{name}_chromosome_coverage.png"
-    ]
+    return [f"{name}_{suffix}.png" for _, _, suffix in all_tasks]
 
 
-    # Step 6: Generate the PDF report
-    report_data = {
-        "Summary Statistics": table,
-        "Chromosome Coverage Statistics": chrom_table,
-    }
+def write_pdf_report(stats, name, tables=None, profiler=NULL_PROFILER, plot_jobs=None):
+    # Plots the statistics and compiles them with the tables into {name}_analysis_report.pdf.
+    tables = tables if tables is not None else report_tables(stats)
+    images = plot_report(stats, name, profiler, plot_jobs)
+    report_data = {title: tables[title] for title in PDF_SECTIONS if title in tables}
+    with profiler.stage("generate_pdf"):
+        generate_pdf(report_data, f"{name}_analysis_report.pdf", images)
+    return f"{name}_analysis_report.pdf"
 
-    #Generate the final PDF
-    
-    generate_pdf(report_data, f"{name}_analysis_report.pdf", images)
-    print("\nPDF report generated successfully: 'analysis_report.pdf'")
 
+# ==========================================================================
+#                                  Main program execution
+# ==========================================================================
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["index"]:  # Subcommand: build the sidecar positional index.
+        index_parser = argparse.ArgumentParser(prog=f"{os.path.basename(sys.argv[0])} index",
+                                               description="Index a coordinate-sorted SAM file for --region queries.")
+        index_parser.add_argument("sam_file", help="Coordinate-sorted SAM file to index.")
+        index_args = index_parser.parse_args(sys.argv[2:])
+        try:
+            print(f"Index written: '{write_index(index_args.sam_file)}'")
+        except (OSError, ValueError) as error:
+            print(f"Error: {error}")
+            sys.exit(1)
+        sys.exit(0)
+
+    if sys.argv[1:2] == ["export"]:  # Subcommand: write the parsed columns to a binary snapshot.
+        export_parser = argparse.ArgumentParser(prog=f"{os.path.basename(sys.argv[0])} export",
+                                                description="Parse a SAM file once and write its columns to a "
+                                                            ".samcol snapshot, analysed without re-reading the text.")
+        export_parser.add_argument("sam_file", help="SAM file to export (plain SAM, .sam.gz or BAM).")
+        export_parser.add_argument("output", nargs="?", help="Snapshot to write (default: <sam_file>.samcol).")
+        export_parser.add_argument("--sequences", action="store_true",
+                                   help="Also store QNAME, SEQ and QUAL (needed by the sequence statistics "
+                                        "and --duplicate-qnames).")
+        export_args = export_parser.parse_args(sys.argv[2:])
+        from sam_snapshot import export_snapshot, SNAPSHOT_SUFFIX  # Loads NumPy: only imported to export.
+        output = export_args.output or export_args.sam_file + SNAPSHOT_SUFFIX
+        try:
+            print(f"Snapshot written: '{export_snapshot(export_args.sam_file, output, export_args.sequences)}'")
+        except (OSError, ValueError) as error:
+            print(f"Error: {error}")
+            sys.exit(1)
+        sys.exit(0)
+
+    parser = argparse.ArgumentParser(description="Analyse the alignments of a SAM file.")
+    parser.add_argument("sam_file", help="SAM file to analyse (plain SAM, .sam.gz, BAM or a .samcol snapshot "
+                                         "written by 'analyse_sam.py export'), "
+                                         "or - to read plain SAM from standard input.")
+    parser.add_argument("--jobs", "-j", type=int, default=1,
+                        help="Number of processes parsing byte ranges of the file in parallel, "
+                             "or of BGZF decompression threads for compressed input (default: 1).")
+    parser.add_argument("--depth", action="store_true",
+                        help="Also compute the per-base depth (Depth Coverage Statistics table); it needs about "
+                             "4 bytes per covered reference base.")
+    parser.add_argument("--sequence-stats", action="store_true",
+                        help="Also compute the SEQ/QUAL statistics (per-cycle quality, GC content, read lengths); "
+                             "they about double the parsing time.")
+    parser.add_argument("--bedgraph", metavar="FILE",
+                        help="Also write the per-base depth as a bedGraph file (implies --depth).")
+    parser.add_argument("--region", metavar="CHROM:START-END",
+                        help="Only analyse the records overlapping this region "
+                             "(needs an index built with 'analyse_sam.py index', or a .samcol snapshot).")
+    parser.add_argument("--cache", action="store_true",
+                        help="Reuse the statistics cached by a previous run; if the file only grew, "
+                             "parse just the new tail.")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR,
+                        help=f"Directory of the statistics cache (default: {DEFAULT_CACHE_DIR}).")
+    parser.add_argument("--cache-size", type=int, default=DEFAULT_CACHE_BYTES // (1024 * 1024), metavar="MB",
+                        help="Maximum size of the cache before least recently used entries are evicted.")
+    parser.add_argument("--stats-only", action="store_true",
+                        help="Only compute and print the statistics: no plots and no PDF report.")
+    parser.add_argument("--format", choices=sorted(OUTPUT_FORMATS), default="text",
+                        help="Output format of the tables; json and tsv imply --stats-only (default: text).")
+    parser.add_argument("--output", "-o", metavar="FILE",
+                        help="Write the tables to FILE instead of the terminal.")
+    parser.add_argument("--profile", nargs="?", const="", metavar="FILE",
+                        help="Time each stage (wall/CPU time, peak memory), show the parsing throughput "
+                             "and write a JSON timing report (default: <name>_profile.json).")
+    parser.add_argument("--profile-memory", action="store_true",
+                        help="With --profile, also trace the peak of Python allocations per stage (slower).")
+    parser.add_argument("--profile-hook", action="append", default=[], metavar="MODULE:NAME",
+                        help="With --profile, forward the metrics to this hook (see sam_profile.ProfileHook).")
+    parser.add_argument("--refresh-records", type=int, default=DEFAULT_REFRESH_RECORDS, metavar="N",
+                        help="With -, refresh the live summary and MAPQ tables every N records "
+                             f"(0: never, default: {DEFAULT_REFRESH_RECORDS}).")
+    parser.add_argument("--refresh-seconds", type=float, default=DEFAULT_REFRESH_SECONDS, metavar="T",
+                        help="With -, also refresh them every T seconds (0: never, default: %(default)s).")
+    parser.add_argument("--snapshot", metavar="FILE",
+                        help="With -, write the live tables to this JSON file instead of the terminal; "
+                             "the full report is written to it at end of input.")
+    parser.add_argument("--sample", metavar="FRACTION|COUNT",
+                        help="Approximate analysis of a sample of the reads: a fraction (0.01 or 1%%) or a number "
+                             "of reads; percentages are given with 95%% confidence intervals.")
+    parser.add_argument("--sample-method", choices=SAMPLE_METHODS, default="auto",
+                        help="stride: windows spread over a plain SAM file (only they are read); hash: reads "
+                             "kept by QNAME hash (mates together); reservoir: uniform sample of COUNT reads "
+                             "(default: auto, stride for plain SAM).")
+    parser.add_argument("--sample-seed", type=int, default=0, help="Seed of the stride and reservoir samples.")
+    parser.add_argument("--duplicates", choices=["exact", "bloom", "off"], default="exact",
+                        help="Duplicate detection: exact (8 bytes per distinct read), bloom (fixed memory, "
+                             "approximate) or off (default: exact).")
+    parser.add_argument("--bloom-mb", type=int, default=64, metavar="MB",
+                        help="Size of the Bloom filter of --duplicates bloom (default: %(default)s).")
+    parser.add_argument("--duplicate-qnames", metavar="FILE",
+                        help="Write the QNAME of every duplicate read to FILE, one per line.")
+    add_filter_arguments(parser)
+    parser.add_argument("--filter", action="append", default=[], metavar="NAME:OPTIONS",
+                        help="Also report the reads kept by these filter options, in the same scan "
+                             "(e.g. 'q20:--min-mapq 20 --exclude-flags 0x900'; may be repeated).")
+    parser.add_argument("--plot-jobs", type=int, metavar="N",
+                        help="Number of processes drawing the plots of the PDF report "
+                             "(default: one per plot, up to the number of CPUs).")
+    args = parser.parse_args()
+    stats_only = args.stats_only or args.format != "text"
+
+    sam_file = args.sam_file  # Get the SAM file path from the command line.
+    from_stdin = sam_file == "-"
+    if from_stdin:  # A pipe can only be read once, front to back.
+        unsupported = [option for option, used in (("--region", args.region), ("--cache", args.cache),
+                                                   ("--jobs", args.jobs > 1), ("--sample", args.sample)) if used]
+        if unsupported:
+            print(f"Error: {', '.join(unsupported)} cannot be used with standard input.")
+            sys.exit(1)
+    elif not os.path.exists(sam_file):  # Check if the file exists.
+        print(f"Error: The file '{sam_file}' does not exist.")
+        sys.exit(1)
+
+    snapshot = None
+    if not from_stdin and os.path.isfile(sam_file) and is_snapshot(sam_file):
+        # Columns exported by 'analyse_sam.py export': mapped, not parsed.
+        from sam_snapshot import Snapshot, snapshot_accumulators  # Loads NumPy: only imported for snapshots.
+        try:
+            snapshot = Snapshot(sam_file)
+        except (OSError, ValueError) as error:
+            print(f"Error: {error}")
+            sys.exit(1)
+        unsupported = [option for option, used in (("--cache", args.cache), ("--jobs", args.jobs > 1),
+                                                   ("--sample", args.sample)) if used]
+        if unsupported:
+            print(f"Error: {', '.join(unsupported)} cannot be used with a .samcol snapshot.")
+            sys.exit(1)
+        if args.duplicate_qnames and not snapshot.sequences:
+            print("Error: --duplicate-qnames needs a snapshot exported with --sequences.")
+            sys.exit(1)
+
+    if args.region and (args.cache or args.jobs > 1):  # The indexed region is read by a single process, uncached.
+        print("Error: --region cannot be used with --cache or --jobs.")
+        sys.exit(1)
+    if args.sample and (args.region or args.cache):
+        print("Error: --sample cannot be used with --region or --cache.")
+        sys.exit(1)
 
+    try:  # Filter sets: the main options, then every --filter NAME:OPTIONS.
+        filter_sets = {MAIN_SET: ReadFilter.from_args(args)}
+        filter_sets.update(parse_filter_set(spec) for spec in args.filter)
+    except ValueError as error:
+        print(f"Error: {error}")
+        sys.exit(1)
+    filtering = len(filter_sets) > 1 or bool(filter_sets[MAIN_SET])
+    if filtering and (args.sample or args.cache):
+        print("Error: read filters cannot be used with --sample or --cache.")
+        sys.exit(1)
 
+    if args.duplicate_qnames and (args.cache or args.duplicates == "off" or args.filter or
+                                  (args.jobs > 1 and not from_stdin and not is_compressed(sam_file))):
+        # The QNAMEs are written while parsing: not by cached runs or by several processes or sets at once.
+        print("Error: --duplicate-qnames cannot be used with --cache, --duplicates off, --filter "
+              "or --jobs on plain SAM.")
+        sys.exit(1)
 
+    name = "stdin" if from_stdin else os.path.basename(sam_file).split('.')[0]
+
+    profiler = NULL_PROFILER
+    if args.profile is not None:
+        try:
+            profiler = Profiler([load_hook(spec) for spec in args.profile_hook], trace_memory=args.profile_memory)
+        except (ImportError, AttributeError, ValueError) as error:
+            print(f"Error: cannot load the profile hook: {error}")
+            sys.exit(1)
+
+    def write_profile():
+        if profiler.enabled:
+            profile_path = args.profile or f"{name}_profile.json"
+            profiler.write(profile_path)
+            print(f"Profile written: '{profile_path}'", file=sys.stderr)
+
+    # Step 1: Stream the SAM file once, feeding every statistic in a single pass.
+    with profiler.stage("read_header"):
+        if from_stdin:
+            try:
+                header, stdin_lines = read_stream_header(open_stdin())
+            except ValueError as error:
+                print(f"Error: {error}")
+                sys.exit(1)
+            references = parse_references(header)
+        elif snapshot is not None:
+            references = snapshot.references
+        else:
+            references = read_references(sam_file)  # @SQ names and lengths for the coverage.
+    accumulator_factory = partial(report_accumulators, references, args.duplicates, args.bloom_mb,
+                                  args.duplicate_qnames, depth=args.depth or bool(args.bedgraph),
+                                  sequences=args.sequence_stats)
+    if snapshot is not None:  # Without SEQ/QUAL columns, the sequence statistics are left out.
+        accumulator_factory = partial(snapshot_accumulators, snapshot, accumulator_factory)
+    if profiler.enabled and not args.cache:  # Also measure the time spent in each statistic.
+        accumulator_factory = partial(timed_accumulators, accumulator_factory)
+    live = sampling = filter_results = None
+
+    def filter_set_stats(stats):
+        # One SamStats per filter set, stats being the one of the main set.
+        return FilteredStats({set_name: (read_filter, stats if set_name == MAIN_SET else
+                                         SamStats(accumulator_factory()))
+                              for set_name, read_filter in filter_sets.items()})
+
+    with profiler.stage("parse") as parse_stage:
+        if snapshot is not None:
+            # Column blocks mapped from the snapshot: --region and --ref only read the chunks holding their reads.
+            filter_references = [read_filter.references for read_filter in filter_sets.values()]
+            try:
+                blocks = snapshot.iter_blocks(args.region, set().union(*filter_references)
+                                              if all(filter_references) else None)
+                stats = SamStats(accumulator_factory())
+                if filtering:
+                    filter_results = filter_set_stats(stats).update_columns(blocks).results()
+                else:
+                    stats.update_columns(blocks)
+            except ValueError as error:
+                print(f"Error: {error}")
+                sys.exit(1)
+        elif filtering and not from_stdin and not args.region:
+            # Every filter set in one scan, the filters evaluated inside the parser.
+            filter_results = filtered_stats(sam_file, filter_sets, accumulator_factory, args.jobs,
+                                            threads=args.jobs if args.jobs > 1 else None)
+            stats = filter_results[MAIN_SET][1]
+        elif from_stdin:
+            # Live tables refreshed while the records stream in, full report at end of input.
+            stats = SamStats(accumulator_factory())
+            live = LiveReport(stats, args.snapshot, args.refresh_records, args.refresh_seconds)
+            if filtering:
+                sets = filter_set_stats(stats)
+                sets.update(profiler.track(live.track(parse_sam_lines(filter_lines(stdin_lines, sets.filters)))))
+                filter_results = sets.results()
+            else:
+                stats.update(profiler.track(live.track(parse_sam_lines(stdin_lines))))
+        elif args.sample:
+            # Approximate statistics of a sample of the reads.
+            from sam_sample import parse_sample, sampled_stats  # Only imported with --sample.
+            try:
+                fraction, count = parse_sample(args.sample)
+                stats, sampling = sampled_stats(sam_file, accumulator_factory(), fraction, count, args.sample_method,
+                                                args.sample_seed, threads=args.jobs if args.jobs > 1 else None)
+            except ValueError as error:
+                print(f"Error: {error}")
+                sys.exit(1)
+            parse_stage["sample"] = sampling.method
+        elif args.region:
+            # Seek straight to the region through the sidecar index.
+            try:
+                records = iter_region_records(sam_file, args.region)
+                stats = SamStats(accumulator_factory())
+                if filtering:
+                    filter_results = filter_set_stats(stats).update(profiler.track(records)).results()
+                else:
+                    stats.update(profiler.track(records))
+            except (OSError, ValueError) as error:
+                print(f"Error: {error}")
+                sys.exit(1)
+        elif args.cache:
+            cache = StatsCache(args.cache_dir, args.cache_size * 1024 * 1024)
+            stats, cache_status = cached_stats(sam_file, accumulator_factory, cache, args.jobs,
+                                               threads=args.jobs if args.jobs > 1 else None)
+            parse_stage["cache"] = cache_status
+            print(f"Statistics cache: {cache_status}", file=sys.stderr if stats_only else sys.stdout)
+        elif args.jobs > 1 and not is_compressed(sam_file):
+            # Byte ranges parsed by a process pool, then merged.
+            stats = parallel_stats(sam_file, args.jobs, accumulator_factory)
+        elif not is_compressed(sam_file) and os.path.getsize(sam_file) < MMAP_MIN_BYTES:
+            stats = SamStats(accumulator_factory()).update(profiler.track(iter_sam_records(sam_file)))
+        else:
+            # Memory-mapped column parser for plain SAM (only the columns the statistics read are converted),
+            # with the timed add_columns() of each statistic under --profile.
+            from sam_mmap import file_stats  # Only loaded for files large enough to pay for it.
+            stats = file_stats(sam_file, accumulator_factory(), threads=args.jobs if args.jobs > 1 else None,
+                               profiler=profiler)
+        parse_stage["records"] = stats["reads"].total
+    untime_stats(stats, profiler, "parse")
+
+    # Step 2: Print the summary, chromosome, depth and quality tables.
+    with profiler.stage("report_tables"):
+        tables = report_tables(stats)
+        if sampling is not None:
+            from sam_sample import sampled_tables
+            tables = sampled_tables(tables, stats, sampling)
+        if filtering:  # One report per filter set, each headed by its filter.
+            reports = {set_name: filtered_tables(tables if set_name == MAIN_SET else report_tables(set_stats),
+                                                 read_filter)
+                       for set_name, (read_filter, set_stats) in filter_results.items()}
+            tables = reports[MAIN_SET]
+    if live is not None:
+        live.finish(tables)
+    with profiler.stage("format_output", format=args.format):
+        if filtering and len(reports) > 1:
+            output = format_filter_sets(reports, args.format)
+        else:
+            output = OUTPUT_FORMATS[args.format](tables)
+        if args.output:
+            with open(args.output, "w") as file:
+                file.write(output + "\n")
+        else:
+            print(output)
+    if args.bedgraph:
+        with profiler.stage("write_bedgraph"):
+            stats["depth"].write_bedgraph(args.bedgraph)
+        print(f"bedGraph written: '{args.bedgraph}'", file=sys.stderr if not args.output else sys.stdout)
+    if stats_only:
+        write_profile()
+        sys.exit(0)
+
+    # Step 3: Generate the plots and the PDF report
+    write_pdf_report(stats, name, tables, profiler, args.plot_jobs)
+    for set_name, (_, set_stats) in (filter_results or {}).items():
+        if set_name != MAIN_SET:
+            write_pdf_report(set_stats, f"{name}_{set_name}", reports[set_name], profiler, args.plot_jobs)
+    print("\nPDF report generated successfully: 'analysis_report.pdf'")
+    write_profile()
@@ -1,8 +1,14 @@
-import sys  # Library for accessing command-line arguments and handling system interactions.
 import os  # Library for manipulating files and directories.
 import matplotlib.pyplot as plt  # Library for creating graphs (ignore type errors if flagged by the editor).
 import re  # For working with regular expressions.
-
+import argparse  # Parses the command-line options.
+from sam_io import iter_sam_records, read_header_lines, parse_references  # Streaming SAM/BAM reader.
+from sam_stats import SamStats, ReadCounter, PairOrderCounter, ChromosomeCoverage, QualityCounter, \
+    PartialMappingCounter  # Single-pass statistics engine.
+from sam_pairs import (PairStats, is_coordinate_sorted, pair_table, insert_size_summary, insert_size_table,
+                       PAIR_HEADERS, INSERT_SIZE_HEADERS, DEFAULT_MAX_PENDING, DEFAULT_PARTITIONS)  # Mate pairing.
+
+SECONDARY_OR_SUPPLEMENTARY = 256 | 2048  # FLAG bits of the extra alignments of a read.
 KEYS = ['QNAME', 'FLAG', 'RNAME', 'POS', 'MAPQ', 'CIGAR', 'RNEXT', 'PNEXT', 'TLEN', 'SEQ', 'QUAL']
 # KEYS: List that defines and maps SAM columns into dictionary keys.
 
@@ -37,93 +43,113 @@ def count_reads(data):  # Counts the number of mapped and unmapped reads.
 
 # Question 2: Number of reads for each flag
 def count_mapped_first_and_second(data):
-    # Analyzes mapped reads to determine the percentage of first and second reads mapped.
-    read_pairs = dict()  # Dictionary to store read pairs.
-    total_reads = 0  # Total number of mapped reads.
+    # Counts the mapped first and second reads of the pairs.
+    # Records are not kept: the mates themselves are paired by sam_pairs.PairStats.
     first_reads_mapped = 0  # Number of first reads mapped.
     second_reads_mapped = 0  # Number of second reads mapped.
 
     for sequence in data:
-        qname = sequence['QNAME']  # Unique name of each read.
         flag = int(sequence['FLAG'])  # Convert FLAG to integer.
 
         if flag & 4 > 0:  # Ignore unmapped reads / verification.
             continue
 
-        total_reads += 1  # Increment total mapped reads.
-
-        # Check if the read is the first or second in a pair.
-        is_first_in_pair = flag & 64 > 0
-        is_second_in_pair = flag & 128 > 0
-
-        if qname not in read_pairs.keys():  # Initialize a pair if necessary.
-            read_pairs[qname] = {"first_read": None, "second_read": None}
-
-        if is_first_in_pair:  # Store first read information.
-            read_pairs[qname]["first_read"] = sequence
+        if flag & 64 > 0:  # First read of a pair.
             first_reads_mapped += 1
 
-        elif is_second_in_pair:  # Store second read information.
-            read_pairs[qname]["second_read"] = sequence
+        elif flag & 128 > 0:  # Second read of a pair.
             second_reads_mapped += 1
 
     return {
-        "read_pairs": read_pairs,
         "first_reads_mapped": first_reads_mapped,
         "second_reads_mapped": second_reads_mapped,
     }
 
 
-# Question 3: Number of reads per chromosome
-def analyze_chromosome_positions(read_pairs):
-    # Analyzes the distribution of read positions on each chromosome.
-    chromosome_positions = {}  # Dictionary to store positions per chromosome.
-
-    for qname, reads in read_pairs.items():
-        for read in ['first_read', 'second_read']:  # Iterate through individual reads.
-            if reads[read] and reads[read]['RNAME'] and reads[read]['POS']:
-                # Check that the read is mapped and has a chromosome and position.
-                chrom = reads[read]['RNAME']  # Chromosome associated with the read.
-                pos = int(reads[read]['POS'])  # Position on the chromosome.
+def is_primary_mate(flag):
+    # Mapped primary alignment of a read flagged as first or second of a pair: one record per (QNAME, mate),
+    # the reads the analysis is made on. Secondary and supplementary alignments are left out.
+    return not flag & 4 and not flag & SECONDARY_OR_SUPPLEMENTARY and flag & 192 > 0
 
-                if chrom not in chromosome_positions:  # Add chromosome if absent.
-                    chromosome_positions[chrom] = []
 
-                chromosome_positions[chrom].append(pos)  # Add position to the chromosome list.
+def is_mapped_mate(sequence):
+    return is_primary_mate(int(sequence['FLAG']))
 
-    alignment_homogeneity = {}  # Dictionary summarizing alignment homogeneity.
 
-    for chrom, positions in chromosome_positions.items():  # Iterate through each chromosome.
-        min_pos = min(positions)  # Minimum position.
-        max_pos = max(positions)  # Maximum position.
-        distrib_read = max_pos - min_pos  # Range of positions.
-
-        alignment_homogeneity[chrom] = {
-            "min_position": min_pos,
-            "max_position": max_pos,
-            "distrib_read": distrib_read,
-            "read_count": len(positions)  # Total number of reads.
-        }
+# Question 3: Number of reads per chromosome
+def analyze_chromosome_positions(data):
+    # Analyzes the distribution of read positions on each chromosome.
+    extents = {}  # Chromosome -> [min position, max position, read count].
 
-    return alignment_homogeneity  # Return alignment homogeneity information.
+    for sequence in data:
+        if is_mapped_mate(sequence) and sequence['RNAME'] and sequence['POS']:
+            # Check that the read is mapped and has a chromosome and position.
+            chrom = sequence['RNAME']  # Chromosome associated with the read.
+            pos = int(sequence['POS'])  # Position on the chromosome.
+            if chrom not in extents:  # Add chromosome if absent.
+                extents[chrom] = [pos, pos, 0]
+            extent = extents[chrom]
+            extent[0] = min(extent[0], pos)
+            extent[1] = max(extent[1], pos)
+            extent[2] += 1
+
+    return {chrom: summarize_positions(*extent) for chrom, extent in extents.items()}
+
+
+def summarize_positions(min_pos, max_pos, read_count):
+    # Summary of the alignment homogeneity of one chromosome.
+    return {
+        "min_position": min_pos,
+        "max_position": max_pos,
+        "distrib_read": max_pos - min_pos,  # Range of positions.
+        "read_count": read_count  # Total number of reads.
+    }
 
 
 # Question 4: Number of reads per quality score or interval
-def count_reads_by_quality(read_pairs):
+def count_reads_by_quality(data):
     # Counts the reads based on mapping quality.
     quality_counts = {}
 
-    for qname, reads in read_pairs.items():
-        for read in ['first_read', 'second_read']:
-            if reads[read] and reads[read]['MAPQ']:
-                # Verify that MAPQ is defined.
-                mapq = int(reads[read]['MAPQ'])  # Convert quality to integer.
-                if mapq not in quality_counts:
-                    quality_counts[mapq] = 0
-                quality_counts[mapq] += 1
+    for sequence in data:
+        if is_mapped_mate(sequence) and sequence['MAPQ']:
+            # Verify that MAPQ is defined.
+            mapq = int(sequence['MAPQ'])  # Convert quality to integer.
+            if mapq not in quality_counts:
+                quality_counts[mapq] = 0
+            quality_counts[mapq] += 1
 
     return quality_counts
 
+
+# ==========================================================================
+# Streaming analysis: one pass, memory bounded by the mate pairing window
+# ==========================================================================
+class MappedMates:
+    # Feeds an accumulator with the mapped primary first/second reads only.
+    def __init__(self, accumulator):
+        self.accumulator = accumulator
+        self.name = accumulator.name
+
+    def add(self, record):
+        if is_primary_mate(record.flag):
+            self.accumulator.add(record)
+
+    def merge(self, other):
+        self.accumulator.merge(other.accumulator)
+
+    def result(self):
+        return self.accumulator.result()
+
+
+def analyse_stream(path, max_pending=DEFAULT_MAX_PENDING, partitions=DEFAULT_PARTITIONS, spill_dir=None):
+    # Computes every statistic of the script in a single pass over the file.
+    header = read_header_lines(path)
+    pairs = PairStats(is_coordinate_sorted(header), parse_references(header), max_pending, partitions, spill_dir)
+    return SamStats([ReadCounter(), PairOrderCounter(), MappedMates(ChromosomeCoverage()),
+                     MappedMates(QualityCounter()), PartialMappingCounter(), pairs]).update(iter_sam_records(path))
+
+
 def count_partially_mapped_reads(data):
     # Counts partially mapped reads by checking the CIGAR column.
     partial_mapping_pattern = re.compile(r"[SHIND]")
@@ -142,23 +168,31 @@ def count_partially_mapped_reads(data):
 ##############################################"Main"#############################################################
 if __name__ == "__main__":
     # Main execution block
-    sam_file = sys.argv[1]
+    parser = argparse.ArgumentParser(description="Analyse a SAM file and its read pairs.")
+    parser.add_argument("sam_file", help="SAM, .sam.gz or BAM file to analyse.")
+    parser.add_argument("--max-pending", type=int, default=DEFAULT_MAX_PENDING,
+                        help="Reads waiting for their mate kept in memory before spilling to disk "
+                             "(unsorted input, default: %(default)s).")
+    parser.add_argument("--partitions", type=int, default=DEFAULT_PARTITIONS,
+                        help="Number of spill files (default: %(default)s).")
+    parser.add_argument("--spill-dir", default=None,
+                        help="Directory for the spill files (default: system temporary directory).")
+    args = parser.parse_args()
+    sam_file = args.sam_file
     if not os.path.exists(sam_file):
         print(f"Error: The file '{sam_file}' does not exist.")
         exit(1)
 
-    # Reads the SAM file
-    data = read_sam_file(sam_file)
-
-    # Compute statistics
-    nb_reads = len(data)
-    mapped_reads, unmapped_reads = count_reads(data)
-    read_pairs_stats = count_mapped_first_and_second(data)
-    read_pairs = read_pairs_stats["read_pairs"]
-    alignment_homogeneity = analyze_chromosome_positions(read_pairs)
-    quality_counts = count_reads_by_quality(read_pairs)
-    partial_reads = count_partially_mapped_reads(data)
-
+    # Reads the SAM file and compute statistics in one pass
+    results = analyse_stream(sam_file, args.max_pending, args.partitions, args.spill_dir)
+    nb_reads = results["reads"].total
+    mapped_reads, unmapped_reads = results["reads"].result()
+    read_pairs_stats = results["pair_order"].result()
+    alignment_homogeneity = {chrom: summarize_positions(*extent)
+                             for chrom, extent in results["chromosomes"].accumulator.extents.items()}
+    quality_counts = dict(results["quality"].result())
+    partial_reads = results["partial"].result()
+    pair_stats = results["pairs"].result()
     # Compilation of final statistics
     stats = {
         "total_reads": nb_reads,
@@ -177,91 +211,107 @@ if __name__ == "__main__":
     for key, value in stats.items():
         print(f"{key}: {value}")
 
-################################ Statistical summary ##########################
-
-from tabulate import tabulate
-
-# Calculating percentages
-mapped_percentage = (mapped_reads / nb_reads) * 100
-unmapped_percentage = (unmapped_reads / nb_reads) * 100
-first_reads_percentage = (read_pairs_stats["first_reads_mapped"] / nb_reads) * 100
-second_reads_percentage = (read_pairs_stats["second_reads_mapped"] / nb_reads) * 100
+    ################################ Statistical summary ##########################
 
-# Creating a table with percentages
-table = [
-    ["Total Reads", nb_reads, "-"],
-    ["Mapped Reads", mapped_reads, f"{mapped_percentage:.2f}%"],
-    ["Unmapped Reads", unmapped_reads, f"{unmapped_percentage:.2f}%"],
-    ["First Reads Mapped", read_pairs_stats["first_reads_mapped"], f"{first_reads_percentage:.2f}%"],
-    ["Second Reads Mapped", read_pairs_stats["second_reads_mapped"], f"{second_reads_percentage:.2f}%"],
-    ["Partially Matched Reads", partial_reads, f"{(partial_reads / nb_reads) * 100:.2f}%"],
-]
+    from tabulate import tabulate
 
-# Display the table in the console
-print("\n===== Tableau Récapitulatif =====\n")
-print(tabulate(table, headers=["Statistique", "Valeur Brute", "Pourcentage"], tablefmt="grid"))
+    # Calculating percentages
+    mapped_percentage = (mapped_reads / nb_reads) * 100
+    unmapped_percentage = (unmapped_reads / nb_reads) * 100
+    first_reads_percentage = (read_pairs_stats["first_reads_mapped"] / nb_reads) * 100
+    second_reads_percentage = (read_pairs_stats["second_reads_mapped"] / nb_reads) * 100
 
-# Chromosome_mapping
-chromosome_table = [
-    [chrom, stats["min_position"], stats["max_position"], stats["distrib_read"], stats["read_count"]]
-    for chrom, stats in alignment_homogeneity.items()
-]
+    # Creating a table with percentages
+    table = [
+        ["Total Reads", nb_reads, "-"],
+        ["Mapped Reads", mapped_reads, f"{mapped_percentage:.2f}%"],
+        ["Unmapped Reads", unmapped_reads, f"{unmapped_percentage:.2f}%"],
+        ["First Reads Mapped", read_pairs_stats["first_reads_mapped"], f"{first_reads_percentage:.2f}%"],
+        ["Second Reads Mapped", read_pairs_stats["second_reads_mapped"], f"{second_reads_percentage:.2f}%"],
+        ["Partially Matched Reads", partial_reads, f"{(partial_reads / nb_reads) * 100:.2f}%"],
+    ]
 
-# Display the chromosome table
-print("\n===== Chromosome Mapping =====\n")
-print(tabulate(chromosome_table, headers=["Chromosome", "Min Position", "Max Position", "Distribution", "Read Count"], tablefmt="grid"))
+    # Display the table in the console
+    print("\n===== Tableau Récapitulatif =====\n")
+    print(tabulate(table, headers=["Statistique", "Valeur Brute", "Pourcentage"], tablefmt="grid"))
 
+    # Chromosome_mapping
+    chromosome_table = [
+        [chrom, stats["min_position"], stats["max_position"], stats["distrib_read"], stats["read_count"]]
+        for chrom, stats in alignment_homogeneity.items()
+    ]
 
+    # Display the chromosome table
+    print("\n===== Chromosome Mapping =====\n")
+    print(tabulate(chromosome_table, headers=["Chromosome", "Min Position", "Max Position", "Distribution", "Read Count"], tablefmt="grid"))
 
-##############################Graph#########################################
+    # Pair statistics
+    print("\n===== Pair Statistics =====\n")
+    print(tabulate(pair_table(pair_stats), headers=PAIR_HEADERS, tablefmt="grid"))
+    mean_insert, median_insert = insert_size_summary(pair_stats["insert_sizes"])
+    print(f"Properly paired rate: {pair_stats['properly_paired_rate'] * 100:.2f}% - "
+          f"insert size mean: {mean_insert}, median: {median_insert} - "
+          f"peak reads waiting for their mate: {pair_stats['peak_pending']}")
+    print("\n===== Insert Size Distribution =====\n")
+    print(tabulate(insert_size_table(pair_stats["insert_sizes"]), headers=INSERT_SIZE_HEADERS, tablefmt="grid"))
 
 
-#Circular graph to display the proportion of mapped and unmapped reads.
 
-infos_maps = [mapped_reads, unmapped_reads] # Data for the graph (mapped and unmapped).
-labels = ["Mapped", "Unmapped"]# Category labels.
-plt.figure(figsize=(8, 8)) # Creates a figure of size 8x8.
-plt.pie(infos_maps, labels=labels, autopct='%1.1f%%', colors=['skyblue', 'orange']) 
-# Generates the pie chart with the percentages
-plt.title(f"Mapped repartition for {sam_file}") # Adds a title.
-plt.savefig("mapped_vs_unmapped.png", dpi=600, bbox_inches="tight")  # Saves the graph as a PNG file.
-plt.clf() # Cleans up the figure to avoid overlaps.
+    ##############################Graph#########################################
 
-#Circular graph to visualise the proportion of 1st mapped vs 2nd mapped and unmapped reads
 
+    #Circular graph to display the proportion of mapped and unmapped reads.
 
-ordre_mappes = [read_pairs_stats["first_reads_mapped"], read_pairs_stats["first_reads_mapped"],  unmapped_reads]
-# Data for the graph (1st mapped, 2nd mapped and unmapped)
-labels = ["First reads", "Second reads", "Unmapped"]  # Category labels.
+    infos_maps = [mapped_reads, unmapped_reads] # Data for the graph (mapped and unmapped).
+    labels = ["Mapped", "Unmapped"]# Category labels.
+    plt.figure(figsize=(8, 8)) # Creates a figure of size 8x8.
+    plt.pie(infos_maps, labels=labels, autopct='%1.1f%%', colors=['skyblue', 'orange']) 
+    # Generates the pie chart with the percentages
+    plt.title(f"Mapped repartition for {sam_file}") # Adds a title.
+    plt.savefig("mapped_vs_unmapped.png", dpi=600, bbox_inches="tight")  # Saves the graph as a PNG file.
+    plt.clf() # Cleans up the figure to avoid overlaps.
 
-plt.figure(figsize=(8, 8))
-plt.pie(ordre_mappes, labels=labels, autopct='%1.1f%%', colors=['green', 'blue', 'red'])
-plt.title(f"Ordre de mapping pour {sam_file}") 
-plt.savefig("mapping_order.png", dpi=600, bbox_inches="tight") 
-plt.clf()
+    #Circular graph to visualise the proportion of 1st mapped vs 2nd mapped and unmapped reads
 
 
+    ordre_mappes = [read_pairs_stats["first_reads_mapped"], read_pairs_stats["first_reads_mapped"],  unmapped_reads]
+    # Data for the graph (1st mapped, 2nd mapped and unmapped)
+    labels = ["First reads", "Second reads", "Unmapped"]  # Category labels.
 
-#Bar graph to represent the quality distribution (MAPQ).
+    plt.figure(figsize=(8, 8))
+    plt.pie(ordre_mappes, labels=labels, autopct='%1.1f%%', colors=['green', 'blue', 'red'])
+    plt.title(f"Ordre de mapping pour {sam_file}") 
+    plt.savefig("mapping_order.png", dpi=600, bbox_inches="tight") 
+    plt.clf()
 
-x_quality = []  # List of quality values (MAPQ).
-y_quality = []  # List for the number of reads for each quality.
 
-for x, y in quality_counts.items():   # Scans the quality/number pairs.
-    x_quality.append(x)  # Adds the quality to the X list.
-    y_quality.append(y)   # Adds the number of reads to the Y list.
 
-plt.bar(x_quality, y_quality, color='skyblue', edgecolor='black')  # Creates the bar graph.
-plt.xlabel('Qualité')  # Adds a label for the X axis.
-plt.ylabel('Nombre de reads')  # Adds a label for the Y axis.
-plt.yscale("log") # Sets the scale of the Y axis to logarithmic to better visualise large differences.
-plt.title(f'Bar Plot Pour qualité de mappage dans {sam_file}')  # Adds a title.
-plt.savefig("mapping_quality.png", dpi=600, bbox_inches="tight") # Saves the plot.
-plt.clf()  # Cleans up the figure.
+    #Bar graph to represent the quality distribution (MAPQ).
 
+    x_quality = []  # List of quality values (MAPQ).
+    y_quality = []  # List for the number of reads for each quality.
 
+    for x, y in quality_counts.items():   # Scans the quality/number pairs.
+        x_quality.append(x)  # Adds the quality to the X list.
+        y_quality.append(y)   # Adds the number of reads to the Y list.
 
+    plt.bar(x_quality, y_quality, color='skyblue', edgecolor='black')  # Creates the bar graph.
+    plt.xlabel('Qualité')  # Adds a label for the X axis.
+    plt.ylabel('Nombre de reads')  # Adds a label for the Y axis.
+    plt.yscale("log") # Sets the scale of the Y axis to logarithmic to better visualise large differences.
+    plt.title(f'Bar Plot Pour qualité de mappage dans {sam_file}')  # Adds a title.
+    plt.savefig("mapping_quality.png", dpi=600, bbox_inches="tight") # Saves the plot.
+    plt.clf()  # Cleans up the figure.
 
 
 
+    #Bar graph to represent the insert size (|TLEN|) distribution of the pairs mapped on one chromosome.
 
+    if pair_stats["insert_sizes"]:
+        plt.bar(list(pair_stats["insert_sizes"]), list(pair_stats["insert_sizes"].values()),
+                color='skyblue', edgecolor='skyblue')
+        plt.xlabel('Insert size (|TLEN|)')
+        plt.ylabel('Number of pairs')
+        plt.title(f'Insert size distribution in {sam_file}')
+        plt.savefig("insert_size.png", dpi=600, bbox_inches="tight")
+        plt.clf()
@@ -1,8 +1,8 @@
 #!/bin/bash
 
 # Check if a file has been provided as an argument
-if [ "$#" -ne 1 ]; then
-    echo "Usage: $0 <sam_file>"
+if [ "$#" -lt 1 ]; then
+    echo "Usage: $0 <sam_file> [--fail-fast] [--sample LINES] [--jobs N]"
     exit 1
 fi
 
@@ -20,14 +20,5 @@ if [ ! -s "$sam_file" ]; then
     exit 1
 fi
 
-# Check if the file contains a SAM header
-if ! grep -q "^@" "$sam_file"; then
-    echo "Error: The file '$sam_file' does not appear to contain a SAM header."
-    exit 1
-fi
-
-# If all checks pass
-echo "The file '$sam_file' is valid and ready for analysis."
-nt
-echo "Le fichier '$fichier_sam' est un fichier SAM valide."
-exit 0
+# Full check of the header and of every alignment line (see sam_validate.py)
+exec python3 "$(dirname "$0")/sam_validate.py" "$@"
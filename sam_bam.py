@@ -0,0 +1,317 @@
+import gzip  # Plain gzip-compressed SAM files.
+import os  # Library to manage files and directories.
+import struct  # Decodes the binary BAM layout.
+import zlib  # Raw DEFLATE (de)compression of BGZF blocks.
+from collections import deque  # Window of blocks being decompressed.
+from concurrent.futures import ThreadPoolExecutor  # zlib releases the GIL, so threads inflate in parallel.
+from sam_cigar import CIGAR_OPS, parse_cigar  # Operation codes and memoized CIGAR parser.
+from sam_io import SamRecord, parse_sam_lines  # Same record model as the text reader.
+
+# ==========================================================================
+# Readers for compressed alignment files
+#
+# - .sam.gz compressed with plain gzip is read with the gzip module.
+# - BGZF files (bgzip'd SAM and BAM) are a series of independent gzip blocks
+#   of at most 64 KB; the blocks are inflated by a pool of threads while the
+#   main thread decodes the records.
+# - BAM records are decoded from their binary layout directly into SamRecord
+#   objects, so every statistic works unchanged on BAM input.
+# ==========================================================================
+
+BAM_MAGIC = b"BAM\x01"
+BGZF_EOF = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+BGZF_MAX_DATA = 0xff00  # Uncompressed bytes stored per BGZF block.
+
+BAM_CORE = struct.Struct("<iiBBHHHiiii")  # refID, pos, l_read_name, mapq, bin, n_cigar_op, flag, l_seq, next_refID, next_pos, tlen.
+SEQ_CODES = "=ACMGRSVTWYHKDBN"
+SEQ_PAIRS = [a + b for a in SEQ_CODES for b in SEQ_CODES]  # One packed byte -> two bases.
+QUAL_TO_TEXT = bytes((q + 33) & 0xff for q in range(256))  # Phred -> ASCII (Phred+33).
+QUAL_FROM_TEXT = bytes((c - 33) & 0xff for c in range(256))  # ASCII (Phred+33) -> Phred.
+
+
+def default_threads():
+    # Number of decompression threads used when none is given.
+    return min(4, os.cpu_count() or 1)
+
+
+# ==========================================================================
+# BGZF block reading and parallel decompression
+# ==========================================================================
+def is_bgzf(path):
+    # Checks for the "BC" extra subfield that marks a BGZF block.
+    with open(path, "rb") as file:
+        header = file.read(18)
+    return len(header) == 18 and header[:4] == b"\x1f\x8b\x08\x04" and header[12:14] == b"BC"
+
+
+def read_bgzf_block(file):
+    # Reads one compressed block. Returns (cdata, crc32, isize) or None at end of file.
+    header = file.read(12)
+    if not header:
+        return None
+    if len(header) < 12 or header[:4] != b"\x1f\x8b\x08\x04":
+        raise ValueError("Invalid BGZF block header.")
+    xlen = struct.unpack_from("<H", header, 10)[0]
+    extra = file.read(xlen)
+    bsize = None
+    i = 0
+    while i + 4 <= xlen:  # Look for the BC subfield giving the block size.
+        slen = struct.unpack_from("<H", extra, i + 2)[0]
+        if extra[i:i + 2] == b"BC" and slen == 2:
+            bsize = struct.unpack_from("<H", extra, i + 4)[0]
+        i += 4 + slen
+    if bsize is None:
+        raise ValueError("BGZF block without a BC size field.")
+    body = file.read(bsize + 1 - 12 - xlen)  # Compressed data + CRC32 + ISIZE.
+    if len(body) < 8:
+        raise ValueError("Truncated BGZF block.")
+    crc, isize = struct.unpack_from("<II", body, len(body) - 8)
+    return body[:-8], crc, isize
+
+
+def inflate_block(block):
+    # Decompresses one BGZF block and checks its CRC32 and size.
+    cdata, crc, isize = block
+    data = zlib.decompress(cdata, -15)
+    if len(data) != isize or zlib.crc32(data) != crc:
+        raise ValueError("Corrupted BGZF block.")
+    return data
+
+
+def iter_bgzf_data(path, threads=None):
+    # Yields the decompressed content of each block, in order.
+    threads = threads or default_threads()
+    with open(path, "rb") as file:
+        blocks = iter(lambda: read_bgzf_block(file), None)
+        if threads <= 1:
+            for block in blocks:
+                yield inflate_block(block)
+            return
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            pending = deque()  # Bounded look-ahead keeps memory flat.
+            for block in blocks:
+                pending.append(pool.submit(inflate_block, block))
+                if len(pending) >= threads * 4:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+
+def iter_text_lines(chunks):
+    # Reassembles text lines split across decompressed chunks.
+    pending = b""
+    for chunk in chunks:
+        lines = (pending + chunk).split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line.decode()
+    if pending:
+        yield pending.decode()
+
+
+class ByteStream:
+    # Minimal sequential reader over an iterator of byte chunks.
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = b""
+        self.offset = 0
+
+    def read(self, size):
+        end = self.offset + size
+        while end > len(self.buffer):
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                break
+            self.buffer = self.buffer[self.offset:] + chunk
+            end -= self.offset
+            self.offset = 0
+        data = self.buffer[self.offset:end]
+        self.offset = min(end, len(self.buffer))
+        return data
+
+
+# ==========================================================================
+# BAM decoding
+# ==========================================================================
+def read_bam_header(stream):
+    # Returns (header text, [(reference name, length), ...]).
+    if stream.read(4) != BAM_MAGIC:
+        raise ValueError("Not a BAM file.")
+    l_text = struct.unpack("<i", stream.read(4))[0]
+    text = stream.read(l_text).rstrip(b"\0").decode()
+    n_ref = struct.unpack("<i", stream.read(4))[0]
+    references = []
+    for _ in range(n_ref):
+        l_name = struct.unpack("<i", stream.read(4))[0]
+        name = stream.read(l_name).rstrip(b"\0").decode()
+        l_ref = struct.unpack("<i", stream.read(4))[0]
+        references.append((name, l_ref))
+    return text, references
+
+
+def decode_bam_record(data, names):
+    # Decodes one BAM alignment (without its block_size prefix) into a SamRecord.
+    (ref_id, pos, l_read_name, mapq, _, n_cigar_op, flag, l_seq,
+     next_ref_id, next_pos, tlen) = BAM_CORE.unpack_from(data)
+    offset = BAM_CORE.size
+    qname = data[offset:offset + l_read_name - 1].decode()
+    offset += l_read_name
+    if n_cigar_op:
+        ops = struct.unpack_from(f"<{n_cigar_op}I", data, offset)
+        cigar = "".join(f"{op >> 4}{CIGAR_OPS[op & 0xf]}" for op in ops)
+    else:
+        cigar = "*"
+    offset += 4 * n_cigar_op
+    packed_length = (l_seq + 1) // 2
+    if l_seq:
+        seq = "".join(map(SEQ_PAIRS.__getitem__, data[offset:offset + packed_length]))[:l_seq]
+        qual_bytes = data[offset + packed_length:offset + packed_length + l_seq]
+        qual = "*" if qual_bytes[0] == 0xff else qual_bytes.translate(QUAL_TO_TEXT).decode()
+    else:
+        seq = qual = "*"
+    rname = names[ref_id] if ref_id >= 0 else "*"
+    if next_ref_id < 0:
+        rnext = "*"
+    elif next_ref_id == ref_id:
+        rnext = "="
+    else:
+        rnext = names[next_ref_id]
+    return SamRecord(qname, flag, rname, pos + 1, mapq, cigar, rnext, next_pos + 1, tlen, seq, qual)
+
+
+def iter_bam_records(path, threads=None):
+    # Streams the alignments of a BAM file as SamRecord objects.
+    return decode_bam_stream(iter_bgzf_data(path, threads))
+
+
+def decode_bam_stream(chunks):
+    # Decodes the records of a decompressed BAM byte stream.
+    stream = ByteStream(chunks)
+    _, references = read_bam_header(stream)
+    names = [name for name, _ in references]
+    while True:
+        size = stream.read(4)
+        if len(size) < 4:
+            return
+        block_size = struct.unpack("<i", size)[0]
+        yield decode_bam_record(stream.read(block_size), names)
+
+
+def iter_compressed_records(path, threads=None):
+    # Dispatches a gzip-compressed file to the BAM, BGZF SAM or plain gzip reader.
+    if is_bgzf(path):
+        chunks = iter_bgzf_data(path, threads)
+        first = next(chunks, b"")
+        if first.startswith(BAM_MAGIC):
+            yield from decode_bam_stream(_prepend(first, chunks))
+        else:
+            yield from parse_sam_lines(iter_text_lines(_prepend(first, chunks)))
+        return
+    with gzip.open(path, "rt") as file:
+        yield from parse_sam_lines(file)
+
+
+def read_compressed_header(path):
+    # Returns the "@" header lines of a BAM, BGZF SAM or gzip SAM file.
+    if is_bgzf(path):
+        chunks = iter_bgzf_data(path, threads=1)
+        first = next(chunks, b"")
+        if first.startswith(BAM_MAGIC):
+            text, references = read_bam_header(ByteStream(_prepend(first, chunks)))
+            lines = [line for line in text.split("\n") if line]
+            if not any(line.startswith("@SQ") for line in lines):  # Fall back to the binary reference list.
+                lines += [f"@SQ\tSN:{name}\tLN:{length}" for name, length in references]
+            return lines
+        return _leading_header(iter_text_lines(_prepend(first, chunks)))
+    with gzip.open(path, "rt") as file:
+        return _leading_header(file)
+
+
+def _leading_header(lines):
+    # Collects the "@" lines at the start of a text stream.
+    header = []
+    for line in lines:
+        if not line.startswith("@"):
+            break
+        header.append(line.rstrip("\r\n"))
+    return header
+
+
+def _prepend(first, chunks):
+    # Puts back the chunk read to sniff the format.
+    yield first
+    yield from chunks
+
+
+# ==========================================================================
+# Small BGZF/BAM writer, used to build fixtures without samtools
+# ==========================================================================
+def bgzf_block(data, level=6):
+    # Compresses up to BGZF_MAX_DATA bytes into one BGZF block.
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    cdata = compressor.compress(data) + compressor.flush()
+    header = struct.pack("<4BI2BH2BHH", 0x1f, 0x8b, 8, 4, 0, 0, 0xff, 6, 66, 67, 2, len(cdata) + 25)
+    return header + cdata + struct.pack("<II", zlib.crc32(data), len(data))
+
+
+def write_bgzf(path, data, level=6):
+    # Writes bytes as a BGZF file (readable by gzip, bgzip and the readers above).
+    with open(path, "wb") as file:
+        for start in range(0, len(data), BGZF_MAX_DATA):
+            file.write(bgzf_block(data[start:start + BGZF_MAX_DATA], level))
+        file.write(BGZF_EOF)
+
+
+def reg2bin(beg, end):
+    # UCSC binning scheme index of a 0-based, half-open interval (SAM spec 5.3).
+    end -= 1
+    if beg >> 14 == end >> 14:
+        return ((1 << 15) - 1) // 7 + (beg >> 14)
+    if beg >> 17 == end >> 17:
+        return ((1 << 12) - 1) // 7 + (beg >> 17)
+    if beg >> 20 == end >> 20:
+        return ((1 << 9) - 1) // 7 + (beg >> 20)
+    if beg >> 23 == end >> 23:
+        return ((1 << 6) - 1) // 7 + (beg >> 23)
+    if beg >> 26 == end >> 26:
+        return ((1 << 3) - 1) // 7 + (beg >> 26)
+    return 0
+
+
+def encode_bam_record(record, ref_ids):
+    # Encodes a SamRecord into its BAM binary layout (block_size included).
+    ref_id = ref_ids.get(record.rname, -1)
+    if record.rnext == "=":
+        next_ref_id = ref_id
+    else:
+        next_ref_id = ref_ids.get(record.rnext, -1)
+    cigar = parse_cigar(record.cigar)
+    ops = [length << 4 | CIGAR_OPS.index(op) for length, op in cigar.ops]
+    ref_span = cigar.ref_span
+    beg = record.pos - 1
+    seq = "" if record.seq == "*" else record.seq
+    packed = bytes(SEQ_CODES.index(seq[i]) << 4 | (SEQ_CODES.index(seq[i + 1]) if i + 1 < len(seq) else 0)
+                   for i in range(0, len(seq), 2))
+    if record.qual == "*":
+        qual = b"\xff" * len(seq)
+    else:
+        qual = record.qual.encode().translate(QUAL_FROM_TEXT)
+    qname = record.qname.encode() + b"\0"
+    body = (BAM_CORE.pack(ref_id, beg, len(qname), record.mapq, reg2bin(max(beg, 0), max(beg, 0) + max(ref_span, 1)),
+                          len(ops), record.flag, len(seq), next_ref_id, record.pnext - 1, record.tlen)
+            + qname + struct.pack(f"<{len(ops)}I", *ops) + packed + qual)
+    return struct.pack("<i", len(body)) + body
+
+
+def write_bam(path, records, references, header_text="", level=6):
+    # Writes records (SamRecord objects) to a BAM file.
+    # references: [(name, length), ...] in @SQ order.
+    ref_ids = {name: i for i, (name, _) in enumerate(references)}
+    text = header_text.encode()
+    data = bytearray(BAM_MAGIC + struct.pack("<i", len(text)) + text + struct.pack("<i", len(references)))
+    for name, length in references:
+        encoded = name.encode() + b"\0"
+        data += struct.pack("<i", len(encoded)) + encoded + struct.pack("<i", length)
+    for record in records:
+        data += encode_bam_record(record, ref_ids)
+    write_bgzf(path, bytes(data), level)
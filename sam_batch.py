@@ -0,0 +1,148 @@
+import sys  # Library to access command-line arguments.
+import argparse  # Parses the command-line options.
+import glob  # Expands glob patterns given as input.
+import os  # Library to manage files and directories.
+from collections import deque  # Files submitted and not collected yet, in input order.
+from concurrent.futures import ProcessPoolExecutor  # Warm worker processes shared by all files.
+from sam_io import read_references  # @SQ header lines.
+from sam_stats import merge_stats, save_stats, load_stats  # Mergeable partial statistics.
+from sam_report import report_accumulators, report_tables, format_report
+
+# ==========================================================================
+# Batch analysis of many SAM files
+#
+# Inputs are files, directories, glob patterns or manifests (one path per
+# line). Each file is analysed by a worker of a process pool, which pays the
+# interpreter start-up once for the whole batch, and produces:
+#   <name>_report.txt   the tables printed by analyse_sam.py,
+#   <name>_stats.json   its partial statistics (SamStats.to_dict()),
+#   <name>_analysis_report.pdf  with --pdf.
+# The combined report is built by merging the partial statistics returned by
+# the workers as they arrive (only the errors are kept), never by re-reading
+# records. Saved *_stats.json files from other runs or nodes can be merged
+# the same way with --merge.
+# ==========================================================================
+
+SAM_EXTENSIONS = (".sam", ".sam.gz", ".bam")
+PENDING_PER_JOB = 2  # Submitted files per worker whose result is not merged yet.
+
+
+def is_alignment_file(path):
+    return path.endswith(SAM_EXTENSIONS)
+
+
+def expand_inputs(inputs, manifests=()):
+    # Resolves files, directories, glob patterns and manifests into a list of files (input order, no duplicates).
+    paths = []
+    for manifest in manifests:
+        with open(manifest) as file:
+            base = os.path.dirname(manifest)
+            for line in file:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    paths.append(line if os.path.isabs(line) else os.path.join(base, line))
+    for item in inputs:
+        if os.path.isdir(item):
+            paths.extend(sorted(os.path.join(item, name) for name in os.listdir(item)
+                                if is_alignment_file(name)))
+        elif glob.has_magic(item):
+            paths.extend(sorted(glob.glob(item)))
+        else:
+            paths.append(item)
+    seen = set()
+    return [path for path in paths if not (path in seen or seen.add(path))]
+
+
+def report_names(paths):
+    # Output prefix of each file: its base name, made unique within the batch.
+    names, used = [], {}
+    for path in paths:
+        name = os.path.basename(path).split('.')[0]
+        used[name] = used.get(name, 0) + 1
+        names.append(name if used[name] == 1 else f"{name}_{used[name]}")
+    return names
+
+
+def write_reports(stats, prefix, pdf=False, plot_jobs=None):
+    # Writes the text report, the partial statistics and optionally the PDF of one result.
+    tables = report_tables(stats)
+    with open(f"{prefix}_report.txt", "w") as file:
+        file.write(format_report(tables) + "\n")
+    save_stats(stats, f"{prefix}_stats.json")
+    if pdf:
+        from analyse_sam import write_pdf_report  # Plotting libraries are only loaded when needed.
+        write_pdf_report(stats, prefix, tables, plot_jobs=plot_jobs)
+
+
+def analyse_file(path, prefix, pdf=False):
+    # Worker: analyses one file in a single pass and writes its reports.
+    from sam_mmap import file_stats  # Memory-mapped column parser (streaming reader for compressed input).
+    stats = file_stats(path, report_accumulators(read_references(path)))
+    write_reports(stats, prefix, pdf, plot_jobs=1)  # The batch pool already runs one file per worker.
+    return stats
+
+
+def run_batch(paths, output_dir, jobs=1, pdf=False):
+    # Analyses the files concurrently and merges each result into the combined statistics as soon as it is
+    # collected, so only the errors are kept. Results are collected in input order (the combined report is
+    # deterministic) with at most PENDING_PER_JOB results per worker waiting.
+    # Returns (combined SamStats, or None when every file failed, {path: error message}).
+    os.makedirs(output_dir, exist_ok=True)
+    prefixes = [os.path.join(output_dir, name) for name in report_names(paths)]
+    combined, errors = None, {}
+
+    def collect(path, future):
+        nonlocal combined
+        try:
+            stats = future.result()
+        except Exception as error:  # One bad file must not stop the batch.
+            errors[path] = str(error)
+            print(f"Error: {path}: {error}")
+            return
+        combined = stats if combined is None else combined.merge(stats)
+        print(f"Analysed: {path}")
+
+    with ProcessPoolExecutor(max_workers=max(jobs, 1)) as pool:
+        pending = deque()
+        for path, prefix in zip(paths, prefixes):
+            pending.append((path, pool.submit(analyse_file, path, prefix, pdf)))
+            if len(pending) >= max(jobs, 1) * PENDING_PER_JOB:
+                collect(*pending.popleft())
+        while pending:
+            collect(*pending.popleft())
+    return combined, errors
+
+
+# ==========================================================================
+#                                  Main program execution
+# ==========================================================================
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Analyse many SAM files and build a combined report.")
+    parser.add_argument("inputs", nargs="*",
+                        help="SAM/BAM files, directories or glob patterns (e.g. 'runs/*.sam').")
+    parser.add_argument("--manifest", action="append", default=[],
+                        help="Text file listing one SAM/BAM path per line (may be repeated).")
+    parser.add_argument("--merge", nargs="+", metavar="STATS_JSON",
+                        help="Only merge saved *_stats.json files into a combined report.")
+    parser.add_argument("--output-dir", "-o", default="batch_reports", help="Directory of the reports.")
+    parser.add_argument("--jobs", "-j", type=int, default=os.cpu_count() or 1,
+                        help="Number of worker processes (default: number of CPUs).")
+    parser.add_argument("--pdf", action="store_true", help="Also render a PDF report per file and combined.")
+    args = parser.parse_args()
+
+    if args.merge:
+        combined = merge_stats(load_stats(path) for path in args.merge)  # One saved file loaded at a time.
+        analysed, failed = len(args.merge), 0
+    else:
+        paths = expand_inputs(args.inputs, args.manifest)
+        if not paths:
+            parser.error("no input SAM files")
+        combined, errors = run_batch(paths, args.output_dir, args.jobs, args.pdf)
+        combined = combined if combined is not None else merge_stats([])
+        analysed, failed = len(paths) - len(errors), len(errors)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    write_reports(combined, os.path.join(args.output_dir, "combined"), args.pdf)
+    print(format_report(report_tables(combined)))
+    print(f"\nCombined report of {analysed} file(s) written to '{args.output_dir}'.")
+    sys.exit(1 if failed else 0)
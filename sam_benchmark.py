@@ -0,0 +1,282 @@
+import sys  # Library to access command-line arguments.
+import argparse  # Parses the command-line options.
+import json  # Results and baselines are JSON files.
+import os  # Library to manage files and directories.
+import subprocess  # Each benchmark runs in its own interpreter.
+import time  # Wall-clock timers.
+
+# ==========================================================================
+# Benchmark harness
+#
+# Generates synthetic SAM files of increasing size with sam_generate.py
+# (cached in --data-dir) and times, at each size:
+#   - read_sam_file and every analysis function of analyse_sam.py (on the
+#     list of dictionaries, only up to --max-legacy records: it holds the
+#     whole file in memory),
+#   - the streaming engines (SamStats, full report, parallel, columnar
+#     SamTable, mate pairing),
+#   - the memory-mapped column parser (sam_mmap.py): parsing alone (the
+#     columns of the default statistics), the default statistics and the
+#     full report,
+#   - the per-cycle quality and composition statistics (sam_sequence.py).
+# Every benchmark runs in a fresh interpreter so that its peak RSS is its own.
+# Results can be saved as a baseline; a later run compared to it fails when
+# a throughput drops by more than --threshold.
+# ==========================================================================
+
+DEFAULT_SIZES = "1e4,1e5,1e6"  # 1e7 and 1e8 are opt-in: they take minutes and gigabytes of disk.
+DEFAULT_MAX_LEGACY = 1_000_000
+DEFAULT_THRESHOLD = 0.2  # Allowed throughput drop (20%).
+LEGACY_FUNCTIONS = ["count_reads", "count_mapped_first_and_second", "analyze_chromosome_coverage",
+                    "count_reads_by_quality", "count_partially_mapped_reads"]
+
+
+# ==========================================================================
+# Benchmarks (run inside the child interpreter)
+# ==========================================================================
+def bench_read_sam_file(path, jobs):
+    from analyse_sam import read_sam_file
+    started = time.perf_counter()
+    read_sam_file(path)
+    return time.perf_counter() - started
+
+
+def legacy_benchmark(name):
+    # Times one analysis function of analyse_sam.py on the list of dictionaries (loading excluded).
+    def bench(path, jobs):
+        import analyse_sam
+        data = analyse_sam.read_sam_file(path)
+        started = time.perf_counter()
+        getattr(analyse_sam, name)(data)
+        return time.perf_counter() - started
+    return bench
+
+
+def bench_stream_stats(path, jobs):
+    from sam_io import iter_sam_records
+    from sam_stats import SamStats
+    started = time.perf_counter()
+    SamStats().update(iter_sam_records(path))
+    return time.perf_counter() - started
+
+
+def bench_report_stats(path, jobs):
+    from sam_io import iter_sam_records, read_references
+    from sam_stats import SamStats
+    from sam_report import report_accumulators, report_tables
+    started = time.perf_counter()
+    report_tables(SamStats(report_accumulators(read_references(path))).update(iter_sam_records(path)))
+    return time.perf_counter() - started
+
+
+def bench_parallel_stats(path, jobs):
+    from sam_parallel import parallel_stats
+    started = time.perf_counter()
+    parallel_stats(path, jobs)
+    return time.perf_counter() - started
+
+
+def bench_sam_table(path, jobs):
+    from sam_table import load_sam_table
+    started = time.perf_counter()
+    load_sam_table(path).to_stats()
+    return time.perf_counter() - started
+
+
+def bench_pairs(path, jobs):
+    from sam_io import iter_sam_records
+    from sam_pairs import PairStats
+    started = time.perf_counter()
+    pairs = PairStats()
+    for record in iter_sam_records(path):
+        pairs.add(record)
+    pairs.result()
+    return time.perf_counter() - started
+
+
+def bench_mmap_parse(path, jobs):
+    # Parsing alone, as read_sam_file, converting the columns of the default statistics only.
+    from sam_mmap import iter_column_blocks
+    started = time.perf_counter()
+    for columns in iter_column_blocks(path):
+        columns["flag"], columns["pos"], columns["mapq"], columns.codes("rname"), columns.codes("cigar")
+    return time.perf_counter() - started
+
+
+def bench_mmap_stats(path, jobs):
+    from sam_mmap import mmap_stats
+    started = time.perf_counter()
+    mmap_stats(path)
+    return time.perf_counter() - started
+
+
+def bench_mmap_report_stats(path, jobs):
+    from sam_io import read_references
+    from sam_mmap import mmap_stats
+    from sam_report import report_accumulators, report_tables
+    started = time.perf_counter()
+    report_tables(mmap_stats(path, report_accumulators(read_references(path))))
+    return time.perf_counter() - started
+
+
+def bench_sequence_stats(path, jobs):
+    # Per-cycle quality and composition (SEQ/QUAL) alone, on the memory-mapped column blocks.
+    from sam_mmap import mmap_stats
+    from sam_sequence import SequenceStats
+    started = time.perf_counter()
+    mmap_stats(path, [SequenceStats()])["sequence"].result()
+    return time.perf_counter() - started
+
+
+LEGACY_BENCHMARKS = {"read_sam_file": bench_read_sam_file}
+LEGACY_BENCHMARKS.update({name: legacy_benchmark(name) for name in LEGACY_FUNCTIONS})
+BENCHMARKS = dict(LEGACY_BENCHMARKS)
+BENCHMARKS.update({
+    "stream_stats": bench_stream_stats,
+    "report_stats": bench_report_stats,
+    "parallel_stats": bench_parallel_stats,
+    "sam_table": bench_sam_table,
+    "pairs": bench_pairs,
+    "mmap_parse": bench_mmap_parse,
+    "mmap_stats": bench_mmap_stats,
+    "mmap_report_stats": bench_mmap_report_stats,
+    "sequence_stats": bench_sequence_stats,
+})
+
+
+def peak_rss_bytes():
+    # Peak resident memory of this process (ru_maxrss is in kilobytes on Linux, bytes on macOS).
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def run_child(name, path, jobs):
+    # Entry point of the child interpreter: prints {"seconds", "peak_rss"} as JSON.
+    seconds = BENCHMARKS[name](path, jobs)
+    print(json.dumps({"seconds": seconds, "peak_rss": peak_rss_bytes()}))
+
+
+# ==========================================================================
+# Harness
+# ==========================================================================
+def dataset_path(data_dir, records, seed):
+    return os.path.join(data_dir, f"synthetic_{records}_seed{seed}.sam")
+
+
+def ensure_dataset(data_dir, records, seed):
+    # Generates the synthetic file once; later runs reuse it.
+    path = dataset_path(data_dir, records, seed)
+    if not os.path.exists(path):
+        from sam_generate import generate_sam
+        os.makedirs(data_dir, exist_ok=True)
+        temporary = path + ".tmp"
+        generate_sam(temporary, records, seed=seed)
+        os.replace(temporary, path)
+    return path
+
+
+def run_benchmark(name, path, jobs, repeat):
+    # Runs one benchmark `repeat` times in fresh interpreters and keeps the fastest run.
+    best = None
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", name, path,
+                                 "--jobs", str(jobs)], capture_output=True, text=True, check=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        if best is None or result["seconds"] < best["seconds"]:
+            best = result
+    return best
+
+
+def run_suite(sizes, names, data_dir, seed=1, jobs=2, repeat=1, max_legacy=DEFAULT_MAX_LEGACY):
+    # Returns {"results": [{"benchmark", "records", "seconds", "records_per_sec", "peak_rss"}, ...]}.
+    results = []
+    for records in sizes:
+        path = ensure_dataset(data_dir, records, seed)
+        for name in names:
+            if name in LEGACY_BENCHMARKS and records > max_legacy:
+                continue
+            result = run_benchmark(name, path, jobs, repeat)
+            results.append({"benchmark": name, "records": records, "seconds": round(result["seconds"], 4),
+                            "records_per_sec": round(records / result["seconds"]) if result["seconds"] else None,
+                            "peak_rss": result["peak_rss"]})
+            print(f"{name:32} {records:>11,} records  {result['seconds']:9.3f} s  "
+                  f"{results[-1]['records_per_sec'] or 0:>12,} rec/s  {result['peak_rss'] / 2**20:8.1f} MB",
+                  file=sys.stderr)
+    return {"python": sys.version.split()[0], "seed": seed, "jobs": jobs, "results": results}
+
+
+def compare_to_baseline(report, baseline, threshold):
+    # Returns the regressions: benchmarks whose throughput dropped by more than `threshold`.
+    reference = {(item["benchmark"], item["records"]): item for item in baseline["results"]}
+    regressions = []
+    for item in report["results"]:
+        base = reference.get((item["benchmark"], item["records"]))
+        if not base or not base["records_per_sec"] or not item["records_per_sec"]:
+            continue
+        change = item["records_per_sec"] / base["records_per_sec"] - 1
+        item["change"] = round(change, 4)
+        if change < -threshold:
+            regressions.append(item)
+    return regressions
+
+
+def format_results(report):
+    from tabulate import tabulate
+    rows = [[item["benchmark"], item["records"], item["seconds"], item["records_per_sec"],
+             round(item["peak_rss"] / 2**20, 1), f"{item['change'] * 100:+.1f}%" if "change" in item else "-"]
+            for item in report["results"]]
+    return tabulate(rows, headers=["Benchmark", "Records", "Seconds", "Records/s", "Peak RSS (MB)", "vs Baseline"],
+                    tablefmt="grid")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":  # Internal: one benchmark in this interpreter.
+        child = argparse.ArgumentParser()
+        child.add_argument("--child", dest="name")
+        child.add_argument("path")
+        child.add_argument("--jobs", type=int, default=2)
+        child_args = child.parse_args()
+        run_child(child_args.name, child_args.path, child_args.jobs)
+        sys.exit(0)
+
+    parser = argparse.ArgumentParser(description="Benchmark the SAM analysis on synthetic files.")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES,
+                        help="Comma-separated record counts, up to 1e8 (default: %(default)s).")
+    parser.add_argument("--benchmarks", default=",".join(BENCHMARKS),
+                        help="Comma-separated benchmarks to run (default: all).")
+    parser.add_argument("--data-dir", default="bench_data", help="Cache of generated files (default: %(default)s).")
+    parser.add_argument("--seed", type=int, default=1, help="Seed of the generated files (default: %(default)s).")
+    parser.add_argument("--jobs", "-j", type=int, default=2, help="Processes of parallel_stats (default: %(default)s).")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per benchmark, the fastest is kept.")
+    parser.add_argument("--max-legacy", type=float, default=DEFAULT_MAX_LEGACY,
+                        help="Largest size for the list-of-dictionaries functions (default: %(default)s).")
+    parser.add_argument("--output", "-o", metavar="FILE", help="Write the results as JSON.")
+    parser.add_argument("--save-baseline", metavar="FILE", help="Save the results as the new baseline.")
+    parser.add_argument("--baseline", metavar="FILE", help="Compare to a baseline and fail on regressions.")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Allowed throughput drop against the baseline (default: %(default)s).")
+    args = parser.parse_args()
+
+    names = [name.strip() for name in args.benchmarks.split(",") if name.strip()]
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        print(f"Error: unknown benchmarks {', '.join(unknown)} (available: {', '.join(BENCHMARKS)}).")
+        sys.exit(1)
+    sizes = [int(float(size)) for size in args.sizes.split(",")]
+    report = run_suite(sizes, names, args.data_dir, args.seed, args.jobs, args.repeat, int(args.max_legacy))
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare_to_baseline(report, json.load(file), args.threshold)
+    print(format_results(report))
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w") as file:
+                json.dump(report, file, indent=2)
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) beyond {args.threshold * 100:.0f}%:")
+        for item in regressions:
+            print(f"  {item['benchmark']} at {item['records']:,} records: {item['change'] * 100:+.1f}%")
+        sys.exit(1)
@@ -0,0 +1,260 @@
+from array import array  # Compact buffers of pending reads.
+import base64  # Bin arrays are stored as text in saved statistics.
+import zlib  # Compresses the (mostly zero) bin arrays.
+from sam_cigar import parse_cigar  # Memoized CIGAR parser.
+
+# ==========================================================================
+# Binned coverage
+#
+# The stats pass counts, for every reference, the reads starting in each
+# fixed-size genomic bin of BIN_SIZE bases and the bases they align (M, = and
+# X, attributed to the bin of the leftmost aligned position: reads are much
+# shorter than a bin). A 3 Gb genome is about 300k bins per array, whatever
+# the number of reads, so plotting costs O(bins) instead of O(reads).
+#
+# Plots never draw the bins as stored: plot_bin_size() picks a round multiple
+# of BIN_SIZE giving at most MAX_PLOT_BINS bins over the plotted references,
+# and rebin() sums the stored bins into it. With thousands of contigs, only
+# the TOP_CONTIGS largest are drawn and the rest is pooled into "other".
+#
+# Reads given one at a time wait in compact arrays and are binned with NumPy
+# by blocks of FLUSH_SIZE, or when the bins are read: a small file analysed
+# record by record for its tables only never loads NumPy.
+# ==========================================================================
+
+BIN_SIZE = 10000  # Bases per stored bin.
+FLUSH_SIZE = 1 << 16  # Pending reads of a reference binned at once.
+MAX_PLOT_BINS = 2000  # Bins drawn on the genome-wide track.
+TOP_CONTIGS = 25  # References drawn individually; the others are pooled into "other".
+OTHER = "other"
+
+
+def encode_array(values):
+    return base64.b64encode(zlib.compress(values.tobytes(), 1)).decode()
+
+
+def decode_array(text):
+    import numpy as np  # Only loaded when saved bins are read back.
+    return np.frombuffer(zlib.decompress(base64.b64decode(text)), dtype=np.int64).copy()
+
+
+class BinTrack:
+    # Reads and aligned bases per bin of one reference.
+    def __init__(self, length=None, bin_size=BIN_SIZE):
+        self.length = length  # @SQ LN, or None when the reference is not declared.
+        self.bin_size = bin_size
+        self.reads = self.bases = None  # Per-bin arrays, allocated by counts() when the first reads are binned.
+        self.max_end = 0  # Furthest base covered by a read.
+        self._positions = array('q')  # 0-based leftmost positions not binned yet.
+        self._aligned = array('q')
+
+    def add_read(self, position, aligned, end):
+        self._positions.append(position)
+        self._aligned.append(aligned)
+        if end > self.max_end:
+            self.max_end = end
+        if len(self._positions) >= FLUSH_SIZE:
+            self.flush()
+
+    def add_reads(self, positions, aligned, ends):
+        # Array version of add_read().
+        if len(positions):
+            self.max_end = max(self.max_end, int(ends.max()))
+            self.add_bins(positions // self.bin_size, aligned)
+
+    def add_bins(self, bins, aligned):
+        import numpy as np  # Bins are counted as whole arrays.
+        size = int(bins.max()) + 1
+        self.add_counts(np.bincount(bins, minlength=size),
+                        np.bincount(bins, weights=aligned, minlength=size).astype(np.int64))
+
+    def allocate(self):
+        if self.reads is None:
+            import numpy as np  # First reads binned on this reference.
+            size = (self.length + self.bin_size - 1) // self.bin_size if self.length else 0
+            self.reads = np.zeros(size, dtype=np.int64)
+            self.bases = np.zeros(size, dtype=np.int64)
+
+    def add_counts(self, reads, bases):
+        # Adds per-bin arrays starting at bin 0.
+        self.allocate()
+        size = len(reads)
+        if size > len(self.reads):  # Reads beyond @SQ LN, or reference missing from the header.
+            import numpy as np  # Arrays are grown with np.pad.
+            self.reads = np.pad(self.reads, (0, size - len(self.reads)))
+            self.bases = np.pad(self.bases, (0, size - len(self.bases)))
+        self.reads[:size] += reads
+        self.bases[:size] += bases
+
+    def flush(self):
+        if not self._positions:
+            return
+        import numpy as np  # Loaded with the first block of reads binned.
+        positions = np.frombuffer(self._positions, dtype=np.int64)
+        self.add_bins(positions // self.bin_size, np.frombuffer(self._aligned, dtype=np.int64))
+        self._positions = array('q')
+        self._aligned = array('q')
+
+    def counts(self):
+        # (reads, bases) per bin, the waiting reads included.
+        self.flush()
+        self.allocate()
+        return self.reads, self.bases
+
+    def merge(self, other):
+        if other.reads is not None:
+            self.add_counts(other.reads, other.bases)
+        self._positions.extend(other._positions)
+        self._aligned.extend(other._aligned)
+        if len(self._positions) >= FLUSH_SIZE:
+            self.flush()
+        self.max_end = max(self.max_end, other.max_end)
+        if self.length is None:
+            self.length = other.length
+
+    def total_length(self):
+        return self.length if self.length is not None else self.max_end
+
+    def to_dict(self):
+        reads, bases = self.counts()
+        return {"length": self.length, "max_end": self.max_end,
+                "reads": encode_array(reads), "bases": encode_array(bases)}
+
+    @classmethod
+    def from_dict(cls, state, bin_size):
+        track = cls(None, bin_size)
+        track.length, track.max_end = state["length"], state["max_end"]
+        track.reads, track.bases = decode_array(state["reads"]), decode_array(state["bases"])
+        return track
+
+
+class BinnedCoverage:
+    name = "bins"
+
+    def __init__(self, references=None, bin_size=BIN_SIZE):
+        # references: [(name, length), ...] from the @SQ header lines.
+        self.bin_size = bin_size
+        self.tracks = {name: BinTrack(length, bin_size) for name, length in (references or [])}
+
+    def track(self, chrom):
+        track = self.tracks.get(chrom)
+        if track is None:  # Reference missing from the header: bins added as reads arrive.
+            track = self.tracks[chrom] = BinTrack(None, self.bin_size)
+        return track
+
+    def add(self, record):
+        if record.flag & 4 or record.rname == "*" or record.cigar == "*":
+            return
+        info = parse_cigar(record.cigar)
+        self.track(record.rname).add_read(record.pos - 1, info.aligned, record.pos - 1 + info.ref_span)
+
+    def add_columns(self, columns):
+        import numpy as np  # The columns of sam_mmap.py are NumPy arrays already.
+        names, name_codes = columns.codes("rname")
+        cigars, cigar_codes = columns.codes("cigar")
+        infos = [parse_cigar(cigar.decode()) for cigar in cigars]
+        aligned = np.array([info.aligned for info in infos], dtype=np.int64)[cigar_codes]
+        spans = np.array([info.ref_span for info in infos], dtype=np.int64)[cigar_codes]
+        keep = (columns["flag"] & 4) == 0
+        if b"*" in cigars:
+            keep &= cigar_codes != cigars.index(b"*")
+        positions = columns["pos"] - 1
+        order = np.argsort(name_codes, kind="stable")  # Group the reads of each reference together.
+        order = order[keep[order]]
+        codes = name_codes[order]
+        starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]]) if len(codes) else []
+        for start, end in zip(list(starts), list(starts[1:]) + [len(codes)]):
+            name = names[int(codes[start])]
+            if name == b"*":
+                continue
+            indexes = order[start:end]
+            self.track(name.decode()).add_reads(positions[indexes], aligned[indexes],
+                                                positions[indexes] + spans[indexes])
+
+    def config(self):
+        # Settings that change the result (part of the cache key of sam_cache.py).
+        return f"{self.bin_size}"
+
+    def merge(self, other):
+        for chrom, track in other.tracks.items():
+            if chrom in self.tracks:
+                self.tracks[chrom].merge(track)
+            else:
+                self.tracks[chrom] = track
+
+    def result(self):
+        # {reference: {"length", "bin_size", "reads", "bases"}}: reads and aligned bases per bin.
+        result = {}
+        for chrom, track in self.tracks.items():
+            reads, bases = track.counts()
+            result[chrom] = {"length": track.total_length(), "bin_size": track.bin_size,
+                             "reads": reads, "bases": bases}
+        return result
+
+    def to_dict(self):
+        return {"bin_size": self.bin_size,
+                "tracks": {chrom: track.to_dict() for chrom, track in self.tracks.items()}}
+
+    @classmethod
+    def from_dict(cls, state):
+        acc = cls(bin_size=state["bin_size"])
+        acc.tracks = {chrom: BinTrack.from_dict(track, state["bin_size"]) for chrom, track in state["tracks"].items()}
+        return acc
+
+
+# ==========================================================================
+# Plot data: bin size selection, re-aggregation, top contigs
+# ==========================================================================
+def plot_bin_size(total_length, bin_size, max_bins=MAX_PLOT_BINS):
+    # Smallest 1/2/5 x 10^k multiple of bin_size giving at most max_bins bins over total_length.
+    factor = 1
+    while total_length > factor * bin_size * max_bins:
+        for step in (2, 5 / 2, 2):  # 1 -> 2 -> 5 -> 10 -> 20 ...
+            factor = round(factor * step)
+            if total_length <= factor * bin_size * max_bins:
+                break
+    return factor * bin_size
+
+
+def rebin(values, factor):
+    # Sums every `factor` consecutive bins.
+    if factor == 1:
+        return values
+    import numpy as np  # Plot data: NumPy is loaded with the plotting libraries.
+    padded = np.pad(values, (0, -len(values) % factor))
+    return padded.reshape(-1, factor).sum(axis=1)
+
+
+def top_contigs(items, count=TOP_CONTIGS, key=None, combine=None):
+    # Keeps the `count` largest (key, value) items in their original order and pools the
+    # others with combine(values) under OTHER.
+    items = list(items)
+    if len(items) <= count:
+        return items
+    ranked = sorted(range(len(items)), key=lambda index: key(items[index]), reverse=True)
+    kept = set(ranked[:count])
+    pooled = [items[index][1] for index in ranked[count:]]
+    return [item for index, item in enumerate(items) if index in kept] + [(OTHER, combine(pooled))]
+
+
+def depth_track(binned, max_bins=MAX_PLOT_BINS, count=TOP_CONTIGS):
+    # Genome-wide mean depth per plot bin of BinnedCoverage.result():
+    # (plot bin size, [(reference, start, mean depths), ...]), start being the offset of the
+    # reference on the concatenated genome.
+    import numpy as np  # Only the plots read the genome-wide track.
+
+    def pool(tracks):  # Small references laid end to end.
+        return {"length": sum(track["length"] for track in tracks), "bin_size": tracks[0]["bin_size"],
+                "bases": np.concatenate([track["bases"] for track in tracks])}
+    references = top_contigs(((chrom, track) for chrom, track in binned.items() if track["length"]),
+                             count, key=lambda item: item[1]["length"], combine=pool)
+    if not references:
+        return BIN_SIZE, []
+    bin_size = references[0][1]["bin_size"]
+    size = plot_bin_size(sum(track["length"] for _, track in references), bin_size, max_bins)
+    segments, start = [], 0
+    for chrom, track in references:
+        bases = rebin(track["bases"], size // bin_size)
+        segments.append((chrom, start, bases / size))
+        start += len(bases) * size
+    return size, segments
@@ -0,0 +1,143 @@
+import hashlib  # Fingerprints of the file content and cache keys.
+import os  # Library to manage files and directories.
+import pickle  # Serialization of the accumulated statistics.
+import zlib  # Entries are compressed: depth arrays are mostly zeros.
+from sam_io import is_compressed, iter_sam_records  # Streaming SAM/BAM reader.
+from sam_parallel import complete_lines_end, find_body_offset, parallel_stats
+from sam_stats import SamStats  # Single-pass statistics engine.
+
+# ==========================================================================
+# Persistent cache of aggregated statistics
+#
+# A cache entry holds the SamStats of a file together with its fingerprint:
+# size, mtime, the offset up to which complete lines were parsed, and a hash
+# of sampled blocks of that parsed prefix. On the next run:
+#   - same fingerprint            -> the cached statistics are reused as is;
+#   - file grew, prefix unchanged -> only the new tail is parsed and merged;
+#   - anything else               -> the file is analysed again.
+# Entries are evicted least-recently-used first once the cache exceeds its
+# size limit.
+# ==========================================================================
+
+CACHE_VERSION = 1  # Bump when the pickled statistics change shape.
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "sam_analysis")
+DEFAULT_CACHE_BYTES = 512 * 1024 * 1024
+SAMPLE_SIZE = 64 * 1024  # Bytes hashed at each sampled position.
+SAMPLE_COUNT = 16  # Positions sampled between the head and the tail of the prefix.
+
+
+def sampled_hash(path, length):
+    # Hashes the first `length` bytes of the file at a fixed set of sampled positions.
+    digest = hashlib.sha1(str(length).encode())
+    if length <= 0:
+        return digest.hexdigest()
+    positions = {0, max(length - SAMPLE_SIZE, 0)}
+    positions.update(length * i // (SAMPLE_COUNT + 1) for i in range(1, SAMPLE_COUNT + 1))
+    with open(path, "rb") as file:
+        for position in sorted(positions):
+            file.seek(position)
+            digest.update(file.read(min(SAMPLE_SIZE, length - position)))
+    return digest.hexdigest()
+
+
+class StatsCache:
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def entry_path(self, path, config):
+        # One entry per (absolute path, accumulator configuration).
+        key = f"{CACHE_VERSION}|{os.path.abspath(path)}|{config}"
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest() + ".pkl")
+
+    def load(self, path, config):
+        entry_path = self.entry_path(path, config)
+        try:
+            with open(entry_path, "rb") as file:
+                entry = pickle.loads(zlib.decompress(file.read()))
+        except Exception:  # Missing, corrupt, or written before a class or module was renamed: a miss.
+            return None
+        try:
+            os.utime(entry_path)  # Mark as recently used.
+        except FileNotFoundError:  # Evicted by another process since it was read.
+            pass
+        return entry
+
+    def store(self, path, config, entry):
+        os.makedirs(self.directory, exist_ok=True)
+        entry_path = self.entry_path(path, config)
+        temporary = entry_path + ".tmp"
+        with open(temporary, "wb") as file:
+            file.write(zlib.compress(pickle.dumps(entry, protocol=pickle.HIGHEST_PROTOCOL), 1))
+        os.replace(temporary, entry_path)  # Atomic: readers never see a partial entry.
+        self.evict()
+
+    def evict(self):
+        # Removes the least recently used entries until the cache fits in max_bytes.
+        # Another process sharing the directory may remove an entry in the meantime: it is skipped.
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".pkl"):
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+# ==========================================================================
+# Function to get the statistics of a file, through the cache
+# ==========================================================================
+def stats_config(stats):
+    # Cache key part of a SamStats: the accumulator names, with the settings of those that have a config()
+    # (duplicate mode and Bloom filter size, bin size), so a run with other settings never reuses an entry.
+    parts = []
+    for name, acc in sorted(stats.accumulators.items()):
+        config = getattr(acc, "config", None)  # Accumulators without settings have none.
+        parts.append(f"{name}={config()}" if config is not None else name)
+    return ",".join(parts)
+
+
+def cached_stats(path, accumulator_factory=None, cache=None, jobs=1, threads=None):
+    # Returns (SamStats, status) with status in "hit", "append" or "miss".
+    cache = cache or StatsCache()
+    make = accumulator_factory or (lambda: None)
+    config = stats_config(SamStats(make()))
+    stat = os.stat(path)
+    entry = cache.load(path, config)
+
+    if is_compressed(path):
+        # Compressed files are fingerprinted as a whole: no incremental append.
+        fingerprint = sampled_hash(path, stat.st_size)
+        if entry and entry["size"] == stat.st_size and entry["hash"] == fingerprint:
+            return entry["stats"], "hit"
+        stats = SamStats(make()).update(iter_sam_records(path, threads))
+        cache.store(path, config, {"size": stat.st_size, "mtime": stat.st_mtime, "parsed": stat.st_size,
+                                   "hash": fingerprint, "stats": stats})
+        return stats, "miss"
+
+    if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime \
+            and entry["hash"] == sampled_hash(path, entry["parsed"]):
+        return entry["stats"], "hit"
+
+    end = complete_lines_end(path)  # Never parse a line the writer has not finished.
+    if entry and end >= entry["parsed"] and stat.st_size > entry["size"] \
+            and entry["hash"] == sampled_hash(path, entry["parsed"]):
+        # The file only grew: parse the new tail and merge it into the cached state.
+        stats = entry["stats"].merge(parallel_stats(path, jobs, accumulator_factory, entry["parsed"], end))
+        status = "append"
+    else:
+        stats = parallel_stats(path, jobs, accumulator_factory, find_body_offset(path), end)
+        status = "miss"
+    cache.store(path, config, {"size": stat.st_size, "mtime": stat.st_mtime, "parsed": end,
+                               "hash": sampled_hash(path, end), "stats": stats})
+    return stats, status
@@ -0,0 +1,213 @@
+import re  # For working with regular expressions.
+from collections import defaultdict  # Simplifies the handling of dictionaries.
+from functools import lru_cache  # Bounded memo cache of parsed CIGAR strings.
+
+# ==========================================================================
+# Memoized CIGAR parsing
+#
+# A file holds few distinct CIGAR strings compared to its number of reads, so
+# each distinct string is parsed once and the resulting CigarInfo is shared by
+# every read carrying it. The memo cache is bounded (least recently used
+# strings are dropped) so long-read data with unique CIGARs cannot grow it
+# without limit.
+# ==========================================================================
+
+CIGAR_PATTERN = re.compile(r"(\d+)([MIDNSHP=X])")  # One (length, operation) pair of a CIGAR.
+CIGAR_OPS = "MIDNSHP=X"  # All operations, in BAM code order.
+CIGAR_CACHE_SIZE = 1 << 16  # Distinct CIGAR strings kept in the memo cache.
+REFERENCE_OPS = "MDN=X"  # Operations consuming the reference.
+QUERY_OPS = "MIS=X"  # Operations consuming the read sequence.
+ALIGNED_OPS = "M=X"  # Operations aligning a read base to a reference base.
+PARTIAL_OPS = "SHIND"  # Operations marking a partial alignment.
+
+
+class CigarInfo:
+    # Parsed view of one CIGAR string; instances are shared, never modify them.
+    __slots__ = ('ops', 'ref_span', 'query_length', 'aligned', 'soft_clip', 'hard_clip',
+                 'insertions', 'deletions', 'blocks', 'partial')
+
+    def __init__(self, ops):
+        self.ops = ops  # ((length, operation), ...)
+        self.ref_span = 0  # Reference bases covered (M, D, N, = and X).
+        self.query_length = 0  # Read bases (M, I, S, = and X).
+        self.aligned = 0  # Read bases aligned to the reference (M, = and X).
+        self.soft_clip = 0
+        self.hard_clip = 0
+        self.insertions = 0  # Number of I operations (events, not bases).
+        self.deletions = 0  # Number of D operations.
+        blocks = []  # Covered reference intervals, relative to POS - 1 (N skips without covering).
+        for length, op in ops:
+            if op in REFERENCE_OPS:
+                if op != "N":
+                    blocks.append((self.ref_span, self.ref_span + length))
+                self.ref_span += length
+            if op in QUERY_OPS:
+                self.query_length += length
+            if op in ALIGNED_OPS:
+                self.aligned += length
+            elif op == "S":
+                self.soft_clip += length
+            elif op == "H":
+                self.hard_clip += length
+            elif op == "I":
+                self.insertions += 1
+            elif op == "D":
+                self.deletions += 1
+        self.blocks = tuple(blocks)
+        self.partial = any(op in PARTIAL_OPS for _, op in ops)
+
+    def __repr__(self):
+        return f"CigarInfo({''.join(f'{length}{op}' for length, op in self.ops)!r})"
+
+
+@lru_cache(maxsize=CIGAR_CACHE_SIZE)
+def parse_cigar(cigar):
+    # Returns the CigarInfo of a CIGAR string ("*" gives an empty alignment).
+    return CigarInfo(tuple((int(length), op) for length, op in CIGAR_PATTERN.findall(cigar)))
+
+
+# ==========================================================================
+# Accumulator: CIGAR operation statistics
+#
+# add() only counts reads per CIGAR string; the counts are folded into the
+# totals (one parse per distinct string) when the table of pending strings
+# reaches CIGAR_CACHE_SIZE, and before results are read or merged.
+# ==========================================================================
+class CigarStats:
+    name = "cigar"
+
+    def __init__(self):
+        self.pending = defaultdict(int)  # CIGAR string -> reads not yet folded.
+        self.reads = 0  # Mapped reads with a CIGAR.
+        self.op_bases = defaultdict(int)  # Operation -> total length.
+        self.insertions = 0  # I events.
+        self.deletions = 0  # D events.
+        self.soft_clips = defaultdict(int)  # Soft-clipped bases per read -> reads.
+        self.hard_clips = defaultdict(int)  # Hard-clipped bases per read -> reads.
+        self.aligned_fraction = defaultdict(int)  # Aligned % of the read (10% bins) -> reads.
+
+    def add(self, record):
+        if record.flag & 4 or record.cigar == "*":
+            return
+        pending = self.pending
+        pending[record.cigar] += 1
+        if len(pending) >= CIGAR_CACHE_SIZE:
+            self.fold()
+
+    def add_columns(self, columns):
+        pending = self.pending
+        for cigar, count in columns.counts("cigar", (columns["flag"] & 4) == 0).items():
+            if cigar != b"*":
+                pending[cigar.decode()] += count
+        if len(pending) >= CIGAR_CACHE_SIZE:
+            self.fold()
+
+    def fold(self):
+        # Adds the pending per-CIGAR read counts to the totals.
+        for cigar, count in self.pending.items():
+            info = parse_cigar(cigar)
+            self.reads += count
+            for length, op in info.ops:
+                self.op_bases[op] += length * count
+            self.insertions += info.insertions * count
+            self.deletions += info.deletions * count
+            self.soft_clips[info.soft_clip] += count
+            self.hard_clips[info.hard_clip] += count
+            if info.query_length:
+                self.aligned_fraction[min(10 * info.aligned // info.query_length, 10) * 10] += count
+        self.pending = defaultdict(int)
+
+    def merge(self, other):
+        self.fold()
+        other.fold()
+        self.reads += other.reads
+        self.insertions += other.insertions
+        self.deletions += other.deletions
+        for mine, theirs in ((self.op_bases, other.op_bases), (self.soft_clips, other.soft_clips),
+                             (self.hard_clips, other.hard_clips), (self.aligned_fraction, other.aligned_fraction)):
+            for key, count in theirs.items():
+                mine[key] += count
+
+    def indel_rate(self):
+        # Insertion and deletion events per aligned base.
+        aligned = sum(self.op_bases[op] for op in ALIGNED_OPS)
+        return (self.insertions + self.deletions) / aligned if aligned else 0.0
+
+    def result(self):
+        self.fold()
+        return {
+            "reads": self.reads,
+            "op_bases": {op: self.op_bases[op] for op in CIGAR_OPS if self.op_bases[op]},
+            "insertions": self.insertions,
+            "deletions": self.deletions,
+            "indel_rate": self.indel_rate(),
+            "soft_clips": dict(sorted(self.soft_clips.items())),
+            "hard_clips": dict(sorted(self.hard_clips.items())),
+            "aligned_fraction": dict(sorted(self.aligned_fraction.items())),
+        }
+
+    def to_dict(self):
+        self.fold()
+        return {"reads": self.reads, "insertions": self.insertions, "deletions": self.deletions,
+                "op_bases": dict(self.op_bases),
+                "soft_clips": {str(k): v for k, v in self.soft_clips.items()},
+                "hard_clips": {str(k): v for k, v in self.hard_clips.items()},
+                "aligned_fraction": {str(k): v for k, v in self.aligned_fraction.items()}}
+
+    @classmethod
+    def from_dict(cls, state):
+        acc = cls()
+        acc.reads, acc.insertions, acc.deletions = state["reads"], state["insertions"], state["deletions"]
+        acc.op_bases.update(state["op_bases"])
+        for name in ("soft_clips", "hard_clips", "aligned_fraction"):  # JSON object keys are strings.
+            getattr(acc, name).update((int(k), v) for k, v in state[name].items())
+        return acc
+
+
+# ==========================================================================
+# Report tables
+# ==========================================================================
+def clip_summary(histogram):
+    # (clipped reads, mean clip length of the clipped reads, longest clip).
+    clipped = sum(count for length, count in histogram.items() if length)
+    bases = sum(length * count for length, count in histogram.items())
+    return clipped, round(bases / clipped, 2) if clipped else 0, max(histogram, default=0)
+
+
+def cigar_table(stats):
+    # Rows of the "CIGAR Statistics" table.
+    result = stats["cigar"].result()
+    rows = [["Reads With CIGAR", result["reads"]]]
+    rows += [[f"{op} Bases", bases] for op, bases in result["op_bases"].items()]
+    rows += [["Insertion Events", result["insertions"]],
+             ["Deletion Events", result["deletions"]],
+             ["Indel Rate (per aligned base)", f"{result['indel_rate'] * 100:.4f}%"]]
+    for label, key in (("Soft", "soft_clips"), ("Hard", "hard_clips")):
+        clipped, mean, longest = clip_summary(result[key])
+        rows += [[f"{label}-Clipped Reads", clipped], [f"Mean {label} Clip Length", mean],
+                 [f"Max {label} Clip Length", longest]]
+    return rows
+
+
+def clip_table(stats, interval_size=10):
+    # Rows of the "Clip Length Distribution" table (clipped reads only, grouped by intervals).
+    from sam_stats import group_quality_by_intervals  # Imported here: sam_stats imports this module.
+    result = stats["cigar"].result()
+    soft = group_quality_by_intervals({k: v for k, v in result["soft_clips"].items() if k}, interval_size)
+    hard = group_quality_by_intervals({k: v for k, v in result["hard_clips"].items() if k}, interval_size)
+    return [[f"{start}-{start + interval_size - 1}", soft.get(start, 0), hard.get(start, 0)]
+            for start in sorted(set(soft) | set(hard))]
+
+
+def aligned_fraction_table(stats):
+    # Rows of the "Aligned Fraction Distribution" table.
+    from sam_stats import percentage  # Imported here: sam_stats itself imports this module.
+    result = stats["cigar"].result()
+    return [[f"{fraction}%" if fraction == 100 else f"{fraction}-{fraction + 9}%", count,
+             percentage(count, result["reads"])]
+            for fraction, count in result["aligned_fraction"].items()]
+
+
+CIGAR_HEADERS = ["Statistic", "Value"]
+CLIP_HEADERS = ["Clip Length", "Soft-Clipped Reads", "Hard-Clipped Reads"]
+ALIGNED_FRACTION_HEADERS = ["Aligned Fraction", "Reads", "Percentage"]
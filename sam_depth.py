@@ -0,0 +1,296 @@
+from array import array  # Compact buffers of pending intervals.
+import base64  # Difference arrays are stored as text in saved statistics.
+import zlib  # Compresses the (mostly zero) difference arrays.
+from sam_cigar import parse_cigar  # Memoized CIGAR parser.
+
+# ==========================================================================
+# Per-base depth coverage
+#
+# Every mapped read adds +1/-1 to a per-chromosome difference array at the
+# start/end of each aligned block of its CIGAR (M, D, = and X; N skips the
+# reference without covering it). The cumulative sum of the difference array
+# is the depth at each base. Difference arrays are split in fixed-size chunks
+# allocated on first use, so references that receive no reads cost nothing.
+# Until FLUSH_SIZE intervals are pending, a track is resolved by sorting its
+# interval ends in plain Python, so small inputs never import NumPy.
+# ==========================================================================
+
+DEFAULT_CHUNK_SIZE = 1 << 20  # Bases per difference-array chunk.
+FLUSH_SIZE = 1 << 16  # Pending intervals applied to the chunks at once.
+DEPTH_THRESHOLDS = (1, 10, 30)  # Breadth of coverage is reported at these depths.
+
+
+def aligned_blocks(pos, cigar):
+    # Yields the 0-based, half-open reference intervals covered by a read.
+    offset = pos - 1
+    for start, end in parse_cigar(cigar).blocks:
+        yield offset + start, offset + end
+
+
+# ==========================================================================
+# DepthTrack: chunked difference array of one chromosome
+# ==========================================================================
+class DepthTrack:
+    def __init__(self, length=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.length = length  # @SQ LN, or None when the reference is not declared.
+        self.chunk_size = chunk_size
+        self.chunks = {}  # Chunk index -> int32 difference array.
+        self.max_end = 0  # Furthest base covered by a read.
+        self._starts = array('q')
+        self._ends = array('q')
+
+    def add_interval(self, start, end):
+        self._starts.append(start)
+        self._ends.append(end)
+        if end > self.max_end:
+            self.max_end = end
+        if len(self._starts) >= FLUSH_SIZE:
+            self.flush()
+
+    def _apply(self, points, value):
+        # Adds value at each point, grouping the points by chunk.
+        import numpy as np  # Loaded on first use: small inputs never need it.
+        chunk_ids = points // self.chunk_size
+        order = np.argsort(chunk_ids, kind="stable")
+        chunk_ids = chunk_ids[order]
+        offsets = (points % self.chunk_size)[order]
+        bounds = np.flatnonzero(np.r_[True, chunk_ids[1:] != chunk_ids[:-1], True])
+        for lo, hi in zip(bounds[:-1], bounds[1:]):
+            chunk_id = int(chunk_ids[lo])
+            chunk = self.chunks.get(chunk_id)
+            if chunk is None:
+                chunk = self.chunks[chunk_id] = np.zeros(self.chunk_size, dtype=np.int32)
+            np.add.at(chunk, offsets[lo:hi], value)
+
+    def flush(self):
+        # Applies the pending intervals to the difference arrays.
+        if not self._starts:
+            return
+        import numpy as np
+        self._apply(np.frombuffer(self._starts, dtype=np.int64), 1)
+        self._apply(np.frombuffer(self._ends, dtype=np.int64), -1)
+        self._starts = array('q')
+        self._ends = array('q')
+
+    def merge(self, other):
+        self._starts.extend(other._starts)
+        self._ends.extend(other._ends)
+        if len(self._starts) >= FLUSH_SIZE or other.chunks:
+            self.flush()
+        for chunk_id, chunk in other.chunks.items():
+            if chunk_id in self.chunks:
+                self.chunks[chunk_id] += chunk
+            else:
+                self.chunks[chunk_id] = chunk.copy()
+        self.max_end = max(self.max_end, other.max_end)
+        if self.length is None:
+            self.length = other.length
+
+    def to_dict(self):
+        return {
+            "length": self.length,
+            "max_end": self.max_end,
+            "starts": base64.b64encode(zlib.compress(self._starts.tobytes(), 1)).decode(),
+            "ends": base64.b64encode(zlib.compress(self._ends.tobytes(), 1)).decode(),
+            "chunks": {str(chunk_id): base64.b64encode(zlib.compress(chunk.tobytes(), 1)).decode()
+                       for chunk_id, chunk in self.chunks.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, state, chunk_size):
+        track = cls(state["length"], chunk_size)
+        track.max_end = state["max_end"]
+        track._starts.frombytes(zlib.decompress(base64.b64decode(state["starts"])))
+        track._ends.frombytes(zlib.decompress(base64.b64decode(state["ends"])))
+        for chunk_id, data in state["chunks"].items():
+            import numpy as np
+            chunk = np.frombuffer(zlib.decompress(base64.b64decode(data)), dtype=np.int32).copy()
+            track.chunks[int(chunk_id)] = chunk
+        return track
+
+    def total_length(self):
+        return self.length if self.length is not None else self.max_end
+
+    def sweep(self):
+        # Yields (start, end, depth) runs over [0, length) from the pending intervals only.
+        length = self.total_length()
+        events = sorted([(point, 1) for point in self._starts] + [(point, -1) for point in self._ends])
+        position, depth = 0, 0
+        for point, delta in events:
+            if point >= length:
+                break
+            if point > position:
+                yield position, point, depth
+                position = point
+            depth += delta
+        if length > position:
+            yield position, length, depth
+
+    def iter_depth(self):
+        # Yields (start, end, depth) per chunk over [0, length); depth is an array,
+        # or a single int for chunks that were never touched (constant depth).
+        import numpy as np
+        self.flush()
+        length = self.total_length()
+        carry = 0  # Depth entering the chunk.
+        for chunk_id in range((length + self.chunk_size - 1) // self.chunk_size):
+            start = chunk_id * self.chunk_size
+            end = min(start + self.chunk_size, length)
+            chunk = self.chunks.get(chunk_id)
+            if chunk is None:
+                yield start, end, carry
+                continue
+            depth = np.cumsum(chunk, dtype=np.int64) + carry
+            carry = int(depth[-1])
+            yield start, end, depth[:end - start]
+
+    def histogram(self):
+        # Number of bases at each depth (index = depth), as a list.
+        if not self.chunks:  # Small track: no NumPy needed.
+            hist = [0]
+            for start, end, depth in self.sweep():
+                hist.extend([0] * (depth + 1 - len(hist)))
+                hist[depth] += end - start
+            return hist
+        import numpy as np
+        hist = np.zeros(1, dtype=np.int64)
+        for start, end, depth in self.iter_depth():
+            if isinstance(depth, int):
+                counts = np.zeros(depth + 1, dtype=np.int64)
+                counts[depth] = end - start
+            else:
+                counts = np.bincount(depth)
+            if len(counts) > len(hist):
+                hist = np.pad(hist, (0, len(counts) - len(hist)))
+            hist[:len(counts)] += counts
+        return hist.tolist()
+
+    def iter_runs(self):
+        # Yields (start, end, depth) runs of constant, non-zero depth.
+        run_start, run_depth = 0, 0
+        if not self.chunks:  # Small track: no NumPy needed.
+            blocks = self.sweep()
+        else:
+            import numpy as np
+            blocks = self.iter_depth()
+        for start, end, depth in blocks:
+            if isinstance(depth, int):
+                changes, values = [start], [depth]
+            else:
+                points = np.flatnonzero(np.diff(depth)) + 1
+                changes = [start] + (points + start).tolist()
+                values = [int(depth[0])] + depth[points].tolist()
+            for position, value in zip(changes, values):
+                if value != run_depth:
+                    if run_depth and position > run_start:
+                        yield run_start, position, run_depth
+                    run_start, run_depth = position, value
+        if run_depth:
+            yield run_start, self.total_length(), run_depth
+
+
+# ==========================================================================
+# Accumulator: per-base depth of every chromosome
+# ==========================================================================
+def depth_summary(hist, length):
+    # Mean/median depth and breadth at DEPTH_THRESHOLDS from a depth histogram.
+    if length == 0:
+        return {"length": 0, "mean_depth": 0.0, "median_depth": 0,
+                **{f"breadth_{t}x": 0.0 for t in DEPTH_THRESHOLDS}}
+    median, cumulative = 0, 0
+    for depth, bases in enumerate(hist):  # One entry per depth value: cheap in plain Python.
+        cumulative += bases
+        if cumulative >= (length + 1) // 2:
+            median = depth
+            break
+    summary = {
+        "length": int(length),
+        "mean_depth": round(sum(depth * bases for depth, bases in enumerate(hist)) / length, 3),
+        "median_depth": median,
+    }
+    for threshold in DEPTH_THRESHOLDS:
+        covered = sum(hist[threshold:])
+        summary[f"breadth_{threshold}x"] = round(covered / length * 100, 2)
+    return summary
+
+
+class DepthCoverage:
+    name = "depth"
+
+    def __init__(self, references=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        # references: [(name, length), ...] from the @SQ header lines.
+        self.chunk_size = chunk_size
+        self.tracks = {name: DepthTrack(length, chunk_size) for name, length in (references or [])}
+
+    def track(self, chrom):
+        track = self.tracks.get(chrom)
+        if track is None:  # Reference missing from the header: length from the reads.
+            track = self.tracks[chrom] = DepthTrack(None, self.chunk_size)
+        return track
+
+    def add(self, record):
+        if record.flag & 4 or record.rname == "*" or record.cigar == "*":
+            return
+        track = self.track(record.rname)
+        offset = record.pos - 1
+        for start, end in parse_cigar(record.cigar).blocks:  # Parsed once per distinct CIGAR.
+            track.add_interval(offset + start, offset + end)
+
+    def add_columns(self, columns):
+        names, name_codes = columns.codes("rname")
+        cigars, cigar_codes = columns.codes("cigar")
+        blocks = [parse_cigar(cigar.decode()).blocks for cigar in cigars]
+        tracks = {}  # RNAME code -> track.
+        mapped = (columns["flag"] & 4) == 0
+        for name, pos, cigar in zip(name_codes[mapped].tolist(), columns["pos"][mapped].tolist(),
+                                    cigar_codes[mapped].tolist()):
+            if names[name] == b"*" or cigars[cigar] == b"*":
+                continue
+            track = tracks.get(name)
+            if track is None:
+                track = tracks[name] = self.track(names[name].decode())
+            offset = pos - 1
+            for start, end in blocks[cigar]:
+                track.add_interval(offset + start, offset + end)
+
+    def merge(self, other):
+        for chrom, track in other.tracks.items():
+            if chrom in self.tracks:
+                self.tracks[chrom].merge(track)
+            else:
+                self.tracks[chrom] = track
+
+    def result(self):
+        return {chrom: depth_summary(track.histogram(), track.total_length())
+                for chrom, track in self.tracks.items()}
+
+    def to_dict(self):
+        return {"chunk_size": self.chunk_size,
+                "tracks": {chrom: track.to_dict() for chrom, track in self.tracks.items()}}
+
+    @classmethod
+    def from_dict(cls, state):
+        acc = cls(chunk_size=state["chunk_size"])
+        acc.tracks = {chrom: DepthTrack.from_dict(track, state["chunk_size"])
+                      for chrom, track in state["tracks"].items()}
+        return acc
+
+    def write_bedgraph(self, path):
+        # Writes the non-zero depth runs as a bedGraph file (0-based, half-open).
+        with open(path, "w") as file:
+            for chrom, track in self.tracks.items():
+                for start, end, depth in track.iter_runs():
+                    file.write(f"{chrom}\t{start}\t{end}\t{depth}\n")
+
+
+DEPTH_HEADERS = ["Chromosome", "Length", "Mean Depth", "Median Depth"] + \
+                [f">= {t}x (%)" for t in DEPTH_THRESHOLDS]
+
+
+def depth_table(stats):
+    # Rows of the "Depth Coverage Statistics" table.
+    return [
+        [chrom, summary["length"], summary["mean_depth"], summary["median_depth"]] +
+        [summary[f"breadth_{t}x"] for t in DEPTH_THRESHOLDS]
+        for chrom, summary in stats["depth"].result().items()
+    ]
@@ -0,0 +1,435 @@
+import base64  # Fingerprint arrays are stored as text in saved statistics.
+import math  # False positive rate of the Bloom filter.
+import zlib  # CRC-32 of reference names, compression of the saved arrays.
+from functools import lru_cache  # Clip offsets of each distinct CIGAR computed once.
+from sam_cigar import parse_cigar  # Memoized CIGAR parser.
+
+# ==========================================================================
+# Duplicate reads
+#
+# A read is a duplicate of an earlier read with the same unclipped 5'
+# position, strand and mate coordinates (mate reference and POS) on the same
+# reference. These five values are hashed into one 64-bit fingerprint per
+# mapped primary read, computed with NumPy on whole blocks of reads.
+#
+# exact mode: the fingerprints of each reference are kept as a sorted uint64
+#   array of distinct values (8 bytes per distinct read); new fingerprints
+#   are buffered and merged into it in batches, counting those already seen.
+# bloom mode: fingerprints go into a Bloom filter of fixed size; a read whose
+#   bits are all set is counted as a duplicate. Memory does not grow with the
+#   file, at the price of a small false positive rate (reported).
+#
+# The first read of each fingerprint is the original, the later ones are the
+# duplicates; their QNAMEs can be written to a file.
+#
+# NumPy is imported by the functions that build arrays. Reads given one at a
+# time are buffered by BATCH_SIZE; when the result is asked for before the
+# first batch in exact mode, the buffered reads are counted in pure Python
+# (fingerprint_int), so a small file analysed record by record for its tables
+# only never loads NumPy.
+# ==========================================================================
+
+DUPLICATE_MODES = ["exact", "bloom"]
+COMPACT_SIZE = 1 << 20  # Buffered fingerprints merged into the sorted arrays at once (at least).
+BATCH_SIZE = 8192  # Records buffered by add() before a NumPy pass.
+DEFAULT_BLOOM_MB = 64
+BLOOM_HASHES = 4
+POPCOUNT_SLICE = 1 << 20  # Filter bytes whose set bits are counted at once.
+SECONDARY_OR_SUPPLEMENTARY = 256 | 2048
+POSITION_OFFSET = 1 << 32  # Keeps unclipped positions before the reference start positive.
+MASK_32 = 0xffffffff
+MASK_64 = 0xffffffffffffffff
+
+
+def splitmix64(values):
+    # SplitMix64 finalizer on a uint64 array (multiplications wrap around, as in C).
+    import numpy as np  # Fingerprints are hashed as uint64 arrays.
+    values = values + np.uint64(0x9E3779B97F4A7C15)
+    values = (values ^ (values >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
+
+
+def fingerprints(five_prime, reverse, mate_references, mate_positions):
+    # 64-bit fingerprints of (unclipped 5' position, strand, mate reference CRC-32, mate POS).
+    import numpy as np  # Fingerprints are hashed as uint64 arrays.
+    position = ((five_prime + POSITION_OFFSET) << 1 | reverse).astype(np.uint64)
+    mate = (mate_references.astype(np.uint64) << np.uint64(32)) | (mate_positions & MASK_32).astype(np.uint64)
+    return splitmix64(splitmix64(position) ^ mate)
+
+
+def splitmix64_int(value):
+    # splitmix64() of one Python integer.
+    value = (value + 0x9E3779B97F4A7C15) & MASK_64
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & MASK_64
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & MASK_64
+    return value ^ (value >> 31)
+
+
+def fingerprint_int(five_prime, reverse, mate_reference, mate_position):
+    # fingerprints() of one read, with Python integers.
+    position = ((five_prime + POSITION_OFFSET) << 1 | reverse) & MASK_64
+    mate = (mate_reference << 32 | mate_position & MASK_32) & MASK_64
+    return splitmix64_int(splitmix64_int(position) ^ mate)
+
+
+@lru_cache(maxsize=1 << 16)
+def clip_offsets(cigar):
+    # (bases clipped before POS, reference span + bases clipped after the end) of a CIGAR.
+    info = parse_cigar(cigar)
+    leading = trailing = 0
+    for length, op in info.ops:
+        if op not in "SH":
+            break
+        leading += length
+    for length, op in reversed(info.ops):
+        if op not in "SH":
+            break
+        trailing += length
+    return leading, info.ref_span + trailing
+
+
+def name_crc(name):
+    return zlib.crc32(name.encode() if isinstance(name, str) else name)
+
+
+def encode_array(values):
+    return base64.b64encode(zlib.compress(values.tobytes(), 1)).decode()
+
+
+def decode_array(text, dtype):
+    import numpy as np  # Only loaded when saved statistics are read back.
+    return np.frombuffer(zlib.decompress(base64.b64decode(text)), dtype=dtype).copy()
+
+
+def count_set_bits(bits):
+    # Set bits of a uint8 array, counted POPCOUNT_SLICE bytes at a time (never an array of one value per bit).
+    import numpy as np  # The filter is a NumPy array already.
+    count_bits = getattr(np, "bitwise_count", None)  # NumPy 2; a 256-entry lookup table before.
+    if count_bits is None:
+        table = np.array([bin(byte).count("1") for byte in range(256)], dtype=np.uint8)
+        count_bits = table.__getitem__
+    return sum(int(count_bits(bits[start:start + POPCOUNT_SLICE]).sum(dtype=np.int64))
+               for start in range(0, len(bits), POPCOUNT_SLICE))
+
+
+class DuplicateStats:
+    name = "duplicates"
+
+    def __init__(self, mode="exact", bloom_mb=DEFAULT_BLOOM_MB, qnames_path=None):
+        self.mode = mode
+        self.reads = {}  # Reference -> mapped primary reads checked.
+        self.duplicates = {}  # Reference -> duplicate reads.
+        self.qnames_path = qnames_path  # File receiving the QNAMEs of the duplicates, or None.
+        self._qnames_started = False
+        if mode == "exact":
+            self.unique = {}  # Reference -> sorted uint64 array of distinct fingerprints.
+            self._pending = {}  # Reference -> ([fingerprint arrays], [QNAME lists]) not merged yet.
+            self._pending_size = 0
+        else:
+            self.bloom_bytes = bloom_mb << 20
+            self.bits = None  # bloom_mb MB of filter bits, allocated by filter_bits() on first use.
+            self.inserted = 0  # Distinct fingerprints added to the filter.
+        self._records = ([], [], [], [], [], [])  # RNAME, POS, FLAG, CIGAR, RNEXT, PNEXT buffered by add().
+        self._qnames = []
+
+    # ----------------------------------------------------------------------
+    # Input
+    # ----------------------------------------------------------------------
+    def add(self, record):
+        flag = record.flag
+        if flag & 4 or flag & SECONDARY_OR_SUPPLEMENTARY or record.rname == "*" or record.cigar == "*":
+            return
+        for values, value in zip(self._records, (record.rname, record.pos, flag, record.cigar, record.rnext,
+                                                 record.pnext)):
+            values.append(value)
+        if self.qnames_path:
+            self._qnames.append(record.qname)
+        if len(self._records[0]) >= BATCH_SIZE:
+            self.flush()
+
+    def buffered_reads(self):
+        # The records buffered by add() as lists: (reference names, then the reference code, POS, FLAG,
+        # clip_offsets(), mate reference CRC-32 and PNEXT of each read).
+        rnames, positions, flags, cigars, rnexts, pnexts = self._records
+        names, codes = {}, []
+        for rname in rnames:
+            codes.append(names.setdefault(rname, len(names)))
+        clips = [clip_offsets(cigar) for cigar in cigars]
+        rname_crcs = {rname: name_crc(rname) for rname in names}
+        mate_crcs = [rname_crcs[rname] if rnext == "=" else 0 if rnext == "*" else name_crc(rnext)
+                     for rname, rnext in zip(rnames, rnexts)]
+        return list(names), codes, positions, flags, clips, mate_crcs, pnexts
+
+    def flush(self):
+        # NumPy pass over the records buffered by add().
+        if not self._records[0]:
+            return
+        import numpy as np  # Loaded with the first batch of reads.
+        names, codes, positions, flags, clips, mate_crcs, pnexts = self.buffered_reads()
+        qnames = self._qnames if self.qnames_path else None
+        self._records, self._qnames = ([], [], [], [], [], []), []
+        self.add_reads(names, np.array(codes, dtype=np.int64), np.array(positions, dtype=np.int64),
+                       np.array(flags, dtype=np.int64), np.array(clips, dtype=np.int64).reshape(-1, 2),
+                       np.array(mate_crcs, dtype=np.int64), np.array(pnexts, dtype=np.int64), qnames)
+
+    def buffered_counts(self):
+        # ({reference: reads}, {reference: duplicates}) of the records buffered by add(), in pure Python and
+        # without consuming them: the result of a small input before any NumPy pass.
+        names, codes, positions, flags, clips, mate_crcs, pnexts = self.buffered_reads()
+        reads, duplicates, seen = {}, {}, set()
+        for code, position, flag, (leading, trailing), mate_crc, pnext in zip(codes, positions, flags, clips,
+                                                                              mate_crcs, pnexts):
+            reverse = flag & 16 != 0
+            five_prime = position - 1 + trailing if reverse else position - leading
+            key = (code, fingerprint_int(five_prime, reverse, mate_crc, pnext))
+            name = names[code]
+            reads[name] = reads.get(name, 0) + 1
+            duplicates[name] = duplicates.get(name, 0) + (key in seen)
+            seen.add(key)
+        return reads, duplicates
+
+    def add_columns(self, columns):
+        import numpy as np  # The columns of sam_mmap.py are NumPy arrays already.
+        flags = columns["flag"]
+        names, codes = columns.codes("rname")
+        cigars, cigar_codes = columns.codes("cigar")
+        keep = ((flags & 4) == 0) & ((flags & SECONDARY_OR_SUPPLEMENTARY) == 0)
+        keep &= codes != names.index(b"*") if b"*" in names else True
+        keep &= cigar_codes != cigars.index(b"*") if b"*" in cigars else True
+        clips = np.array([clip_offsets(cigar.decode()) for cigar in cigars], dtype=np.int64).reshape(-1, 2)
+        mate_names, mate_codes = columns.codes("rnext")
+        rname_crcs = np.array([name_crc(name) for name in names], dtype=np.int64)
+        mate_crcs = np.array([-1 if name == b"=" else 0 if name == b"*" else name_crc(name)
+                              for name in mate_names], dtype=np.int64)[mate_codes]
+        mate_crcs = np.where(mate_crcs < 0, rname_crcs[codes], mate_crcs)  # "=": the read's own reference.
+        qnames = None
+        if self.qnames_path:
+            qnames = [qname.decode() for qname, kept in zip(columns["qname"], keep.tolist()) if kept]
+        self.add_reads([name.decode() for name in names], codes[keep], columns["pos"][keep], flags[keep],
+                       clips[cigar_codes[keep]], mate_crcs[keep], columns["pnext"][keep], qnames)
+
+    def add_reads(self, names, codes, positions, flags, clips, mate_crcs, mate_positions, qnames=None):
+        # names[codes[i]]: reference of read i; clips: (n, 2) array of clip_offsets().
+        if not len(codes):
+            return
+        import numpy as np  # Reads are grouped by reference with array operations.
+        reverse = (flags & 16) != 0
+        five_prime = np.where(reverse, positions - 1 + clips[:, 1], positions - clips[:, 0])
+        values = fingerprints(five_prime, reverse, mate_crcs, mate_positions)
+        order = np.argsort(codes, kind="stable")  # Group the reads of each reference together.
+        sorted_codes = codes[order]
+        starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+        for start, end in zip(starts.tolist(), np.r_[starts[1:], len(codes)].tolist()):
+            name = names[int(sorted_codes[start])]
+            indexes = order[start:end]
+            self.reads[name] = self.reads.get(name, 0) + len(indexes)
+            group_qnames = [qnames[i] for i in indexes.tolist()] if qnames is not None else None
+            if self.mode == "exact":
+                fingerprint_lists, qname_lists = self._pending.setdefault(name, ([], []))
+                fingerprint_lists.append(values[indexes])
+                qname_lists.append(group_qnames)
+                self._pending_size += len(indexes)
+            else:
+                self.add_bloom(name, values[indexes] ^ np.uint64(name_crc(name)), group_qnames)
+        if self.mode == "exact" and self._pending_size >= max(COMPACT_SIZE, self.unique_count() // 4):
+            self.compact()
+
+    # ----------------------------------------------------------------------
+    # exact mode: sorted arrays of distinct fingerprints
+    # ----------------------------------------------------------------------
+    def unique_count(self):
+        return sum(len(values) for values in self.unique.values())
+
+    def compact(self):
+        # Merges the buffered fingerprints into the sorted arrays, counting the duplicates.
+        import numpy as np  # Fingerprints are sorted and compared as uint64 arrays.
+        duplicate_qnames = []
+        for name, (fingerprint_lists, qname_lists) in self._pending.items():
+            values = np.concatenate(fingerprint_lists)
+            order = np.argsort(values, kind="stable")  # Stable: the first read of a fingerprint comes first.
+            ordered = values[order]
+            first = np.r_[True, ordered[1:] != ordered[:-1]]
+            unique = self.unique.get(name, np.zeros(0, dtype=np.uint64))
+            positions = np.searchsorted(unique, ordered)
+            seen = unique[np.minimum(positions, len(unique) - 1)] == ordered if len(unique) else \
+                np.zeros(len(ordered), dtype=bool)
+            new = first & ~seen
+            self.duplicates[name] = self.duplicates.get(name, 0) + int(len(ordered) - new.sum())
+            self.unique[name] = np.insert(unique, positions[new], ordered[new])
+            if qname_lists[0] is not None:
+                qnames = [qname for qname_list in qname_lists for qname in qname_list]
+                duplicate_qnames += [qnames[i] for i in np.sort(order[~new]).tolist()]
+        self._pending = {}
+        self._pending_size = 0
+        self.write_qnames(duplicate_qnames)
+
+    # ----------------------------------------------------------------------
+    # bloom mode: fixed-size filter
+    # ----------------------------------------------------------------------
+    def filter_bits(self):
+        # The filter, allocated on first use: a SamStats built only for its cache key never pays for it.
+        if self.bits is None:
+            import numpy as np  # Bloom mode always builds arrays.
+            self.bits = np.zeros(self.bloom_bytes, dtype=np.uint8)
+        return self.bits
+
+    def bloom_positions(self, values):
+        # (n, BLOOM_HASHES) bit positions of each fingerprint (double hashing).
+        import numpy as np  # Bloom mode always builds arrays.
+        first = values & np.uint64(MASK_32)
+        step = (values >> np.uint64(32)) | np.uint64(1)
+        hashes = first[:, None] + step[:, None] * np.arange(BLOOM_HASHES, dtype=np.uint64)
+        return hashes % np.uint64(self.bloom_bytes * 8)
+
+    def add_bloom(self, name, values, qnames=None):
+        import numpy as np  # Bloom mode always builds arrays.
+        bits = self.filter_bits()
+        _, first_index = np.unique(values, return_index=True)
+        first = np.zeros(len(values), dtype=bool)
+        first[first_index] = True  # Repeats inside the batch are duplicates for sure.
+        positions = self.bloom_positions(values[first])
+        present = ((bits[positions >> np.uint64(3)] >> (positions & np.uint64(7)).astype(np.uint8)) & 1).all(
+            axis=1)
+        duplicate = ~first
+        duplicate[np.flatnonzero(first)[present]] = True
+        new = positions[~present].ravel()
+        np.bitwise_or.at(bits, new >> np.uint64(3), (1 << (new & np.uint64(7))).astype(np.uint8))
+        self.inserted += int((~present).sum())
+        self.duplicates[name] = self.duplicates.get(name, 0) + int(duplicate.sum())
+        if qnames is not None:
+            self.write_qnames([qname for qname, is_duplicate in zip(qnames, duplicate.tolist()) if is_duplicate])
+
+    def false_positive_rate(self):
+        # Probability that a new fingerprint is taken for a duplicate, at the current filling.
+        return (1 - math.exp(-BLOOM_HASHES * self.inserted / (self.bloom_bytes * 8))) ** BLOOM_HASHES
+
+    def estimated_size(self):
+        # Distinct fingerprints in the filter, estimated from the share of bits set.
+        bits = self.bloom_bytes * 8
+        set_bits = count_set_bits(self.bits) if self.bits is not None else 0
+        if set_bits >= bits:
+            return self.inserted
+        return round(-bits / BLOOM_HASHES * math.log(1 - set_bits / bits))
+
+    # ----------------------------------------------------------------------
+    # Output and accumulator protocol
+    # ----------------------------------------------------------------------
+    def write_qnames(self, qnames):
+        if not self.qnames_path or (not qnames and self._qnames_started):
+            return
+        with open(self.qnames_path, "a" if self._qnames_started else "w") as file:
+            file.writelines(f"{qname}\n" for qname in qnames)
+        self._qnames_started = True
+
+    def finish(self):
+        self.flush()
+        if self.mode == "exact" and self._pending:
+            self.compact()
+        self.write_qnames([])  # Creates the file even when there is no duplicate.
+
+    def config(self):
+        # Settings that change the result (part of the cache key of sam_cache.py).
+        return self.mode if self.mode == "exact" else f"bloom:{self.bloom_bytes}"
+
+    def merge(self, other):
+        if other.mode != self.mode:
+            raise ValueError(f"Cannot merge duplicate statistics computed in {other.mode} mode into {self.mode} "
+                             "mode statistics.")
+        if self.mode == "bloom" and other.bloom_bytes != self.bloom_bytes:
+            raise ValueError(f"Cannot merge Bloom filters of different sizes ({other.bloom_bytes} and "
+                             f"{self.bloom_bytes} bytes).")
+        self.finish()
+        other.finish()
+        for name, reads in other.reads.items():
+            self.reads[name] = self.reads.get(name, 0) + reads
+        for name, duplicates in other.duplicates.items():
+            self.duplicates[name] = self.duplicates.get(name, 0) + duplicates
+        if self.mode == "exact":
+            # A distinct read of other already seen in self is a duplicate (its QNAME is not written).
+            for name, values in other.unique.items():
+                self._pending[name] = ([values], [None])
+                self._pending_size += len(values)
+            self.compact()
+            return
+        # Bloom filters: the reads of other also set in self are estimated from the size of the union.
+        if other.bits is None:  # Nothing inserted in other.
+            return
+        union_before = self.estimated_size()
+        other_size = other.estimated_size()
+        bits = self.filter_bits()
+        bits |= other.bits
+        cross = max(union_before + other_size - self.estimated_size(), 0)
+        self.inserted += other.inserted - cross
+        if cross:
+            total = sum(other.reads.values()) or 1
+            for name, reads in other.reads.items():  # Spread over the references of other.
+                self.duplicates[name] = self.duplicates.get(name, 0) + round(cross * reads / total)
+
+    def result(self):
+        if self.mode == "exact" and not self.reads and not self.qnames_path:  # No NumPy pass yet.
+            read_counts, duplicate_counts = self.buffered_counts()
+        else:
+            self.finish()
+            read_counts, duplicate_counts = self.reads, self.duplicates
+        per_reference = {name: {"reads": reads, "duplicates": duplicate_counts.get(name, 0)}
+                         for name, reads in read_counts.items()}
+        reads = sum(read_counts.values())
+        duplicates = sum(duplicate_counts.values())
+        result = {"mode": self.mode, "reads": reads, "duplicates": duplicates,
+                  "rate": duplicates / reads if reads else 0.0, "references": per_reference}
+        if self.mode == "bloom":
+            result["filter_bytes"] = self.bloom_bytes
+            result["false_positive_rate"] = self.false_positive_rate()
+        return result
+
+    def to_dict(self):
+        self.finish()
+        state = {"mode": self.mode, "reads": self.reads, "duplicates": self.duplicates}
+        if self.mode == "exact":
+            state["unique"] = {name: encode_array(values) for name, values in self.unique.items()}
+        else:
+            state["bits"] = encode_array(self.filter_bits())
+            state["inserted"] = self.inserted
+        return state
+
+    @classmethod
+    def from_dict(cls, state):
+        import numpy as np  # Saved arrays are read back as NumPy arrays.
+        acc = cls(state["mode"], bloom_mb=0)
+        acc.reads, acc.duplicates = dict(state["reads"]), dict(state["duplicates"])
+        if acc.mode == "exact":
+            acc.unique = {name: decode_array(values, np.uint64) for name, values in state["unique"].items()}
+        else:
+            acc.bits = decode_array(state["bits"], np.uint8)
+            acc.bloom_bytes = len(acc.bits)
+            acc.inserted = state["inserted"]
+        return acc
+
+
+# ==========================================================================
+# Report tables
+# ==========================================================================
+def duplicate_table(stats):
+    # Rows of the "Duplicate Statistics" table.
+    from sam_stats import percentage
+    result = stats["duplicates"].result()
+    rows = [["Mode", result["mode"]],
+            ["Mapped Primary Reads", result["reads"]],
+            ["Duplicate Reads", result["duplicates"]],
+            ["Duplicate Rate", percentage(result["duplicates"], result["reads"])]]
+    if result["mode"] == "bloom":
+        rows += [["Filter Size (MB)", round(result["filter_bytes"] / (1 << 20), 1)],
+                 ["False Positive Rate", f"{result['false_positive_rate'] * 100:.4f}%"]]
+    return rows
+
+
+def duplicate_reference_table(stats):
+    # Rows of the "Duplicates per Chromosome" table.
+    from sam_stats import percentage
+    return [[name, counts["reads"], counts["duplicates"], percentage(counts["duplicates"], counts["reads"])]
+            for name, counts in stats["duplicates"].result()["references"].items()]
+
+
+DUPLICATE_HEADERS = ["Statistic", "Value"]
+DUPLICATE_REFERENCE_HEADERS = ["Chromosome", "Reads", "Duplicates", "Duplicate Rate"]
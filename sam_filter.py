@@ -0,0 +1,236 @@
+import argparse  # Options of a filter set (--filter NAME:OPTIONS).
+import shlex  # Splits the options of a filter set like a shell would.
+from sam_io import is_compressed, iter_sam_records, parse_sam_lines  # Streaming SAM/BAM reader.
+from sam_stats import SamStats  # Single-pass statistics engine.
+
+# ==========================================================================
+# Filter push-down
+#
+# A ReadFilter keeps the reads whose FLAG has every --require-flags bit and
+# none of the --exclude-flags bits, whose MAPQ is >= --min-mapq and whose
+# RNAME is one of --ref. It is evaluated where the reads are parsed, before
+# anything else is done with them:
+#   - text lines (filter_lines): only the first five columns are split off
+#     and compared; the rest of a rejected line is never split or converted,
+#   - column blocks (ReadFilter.mask): the FLAG, MAPQ and RNAME columns of the
+#     block are compared at once and the accumulators get a view of the kept
+#     lines (ColumnBlock.select), the other columns being converted for
+#     those lines only,
+#   - BAM records are decoded, then filtered.
+# Several filter sets can share one scan of the file: each set has its own
+# SamStats and receives the reads it accepts (filtered_stats), so the report
+# of every set comes out of the same pass.
+# ==========================================================================
+
+MAIN_SET = ""  # Name of the set defined by the main command-line options.
+
+
+def parse_flags(text):
+    # "2304", "0x900" or "256,2048" -> 2304.
+    try:
+        return sum(int(part, 0) for part in text.replace("+", ",").split(",") if part)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid FLAG value '{text}'")
+
+
+def add_filter_arguments(parser):
+    # Options of a filter set, shared by analyse_sam.py and the --filter sets.
+    parser.add_argument("--require-flags", type=parse_flags, default=0, metavar="FLAGS",
+                        help="Only keep reads with all these FLAG bits set (e.g. 0x2 or 1,2).")
+    parser.add_argument("--exclude-flags", type=parse_flags, default=0, metavar="FLAGS",
+                        help="Drop reads with any of these FLAG bits set (e.g. 0x900: secondary and "
+                             "supplementary alignments).")
+    parser.add_argument("--min-mapq", type=int, metavar="Q", help="Only keep reads with MAPQ >= Q.")
+    parser.add_argument("--ref", action="append", metavar="NAMES",
+                        help="Only keep reads on these references (comma-separated, may be repeated).")
+    return parser
+
+
+class ReadFilter:
+    def __init__(self, require_flags=0, exclude_flags=0, min_mapq=None, references=None):
+        self.require_flags = require_flags
+        self.exclude_flags = exclude_flags
+        self.min_mapq = min_mapq
+        self.references = frozenset(references) if references else None
+
+    @classmethod
+    def from_args(cls, args):
+        references = [name for names in (args.ref or []) for name in names.split(",") if name]
+        return cls(args.require_flags, args.exclude_flags, args.min_mapq, references)
+
+    def __bool__(self):
+        # False when the filter keeps every read.
+        return bool(self.require_flags or self.exclude_flags or self.min_mapq is not None or self.references)
+
+    def describe(self):
+        # Rows of the "Filter" table.
+        return [["Require Flags", hex(self.require_flags) if self.require_flags else "-"],
+                ["Exclude Flags", hex(self.exclude_flags) if self.exclude_flags else "-"],
+                ["Minimum MAPQ", self.min_mapq if self.min_mapq is not None else "-"],
+                ["References", ", ".join(sorted(self.references)) if self.references else "all"]]
+
+    def accepts(self, flag, mapq, rname):
+        return ((flag & self.require_flags) == self.require_flags and not flag & self.exclude_flags
+                and (self.min_mapq is None or mapq >= self.min_mapq)
+                and (self.references is None or rname in self.references))
+
+    def matches(self, record):
+        return self.accepts(record.flag, record.mapq, record.rname)
+
+    def mask(self, columns):
+        # Boolean array of the lines of a sam_mmap.ColumnBlock this filter keeps.
+        import numpy as np  # Only called with the NumPy columns of sam_mmap.py.
+        flags = columns["flag"]
+        keep = (flags & self.require_flags) == self.require_flags
+        if self.exclude_flags:
+            keep &= (flags & self.exclude_flags) == 0
+        if self.min_mapq is not None:
+            keep &= columns["mapq"] >= self.min_mapq
+        if self.references is not None:
+            names, codes = columns.codes("rname")
+            wanted = np.array([name.decode() in self.references for name in names], dtype=bool)
+            keep &= wanted[codes]
+        return keep
+
+
+class FilterSetParser(argparse.ArgumentParser):
+    # Raises instead of exiting: a bad --filter is reported like the other option errors.
+    def error(self, message):
+        raise ValueError(message)
+
+
+def parse_filter_set(text):
+    # "NAME:OPTIONS" of --filter (e.g. "q20:--min-mapq 20 --exclude-flags 0x900") -> (name, ReadFilter).
+    name, separator, options = text.partition(":")
+    if not separator or not name.strip():
+        raise ValueError(f"invalid --filter '{text}', expected NAME:OPTIONS")
+    parser = add_filter_arguments(FilterSetParser(prog=f"--filter {name}:", add_help=False))
+    try:
+        args = parser.parse_args(shlex.split(options))
+    except ValueError as error:
+        raise ValueError(f"invalid --filter '{text}': {error}")
+    return name.strip(), ReadFilter.from_args(args)
+
+
+# ==========================================================================
+# Filtering inside the parsers
+# ==========================================================================
+def filter_lines(lines, filters):
+    # Yields the alignment lines accepted by at least one of the filters (header lines pass through).
+    # Only FLAG, RNAME and MAPQ are split off a line to decide.
+    if not all(filters):  # One set keeps every read: nothing can be dropped here.
+        yield from lines
+        return
+    for line in lines:
+        if line.startswith("@"):
+            yield line
+            continue
+        fields = line.split("\t", 5)
+        if len(fields) < 6:
+            continue
+        try:
+            flag, mapq = int(fields[1]), int(fields[4])
+        except ValueError:
+            yield line  # Let the parser report the line.
+            continue
+        rname = fields[2]
+        if any(read_filter.accepts(flag, mapq, rname) for read_filter in filters):
+            yield line
+
+
+class FilteredStats:
+    # One SamStats per filter set, fed from a single pass over the reads.
+    def __init__(self, sets):
+        # sets: {name: (ReadFilter, SamStats)}
+        self.sets = sets
+
+    @property
+    def filters(self):
+        return [read_filter for read_filter, _ in self.sets.values()]
+
+    def update(self, records):
+        sets = [(read_filter.matches if read_filter else None, stats.add) for read_filter, stats in self.sets.values()]
+        for record in records:
+            for matches, add in sets:
+                if matches is None or matches(record):
+                    add(record)
+        return self
+
+    def update_columns(self, blocks):
+        for columns in blocks:
+            for read_filter, stats in self.sets.values():
+                if not read_filter:
+                    stats.update_columns([columns])
+                    continue
+                mask = read_filter.mask(columns)
+                if mask.any():
+                    stats.update_columns([columns.select(mask)])
+        return self
+
+    def merge(self, other):
+        for name, (_, stats) in self.sets.items():
+            stats.merge(other.sets[name][1])
+        return self
+
+    def results(self):
+        # {name: (ReadFilter, SamStats)}
+        return self.sets
+
+
+def filtered_range(path, start, end, filters, accumulator_factory):
+    # Worker: statistics of every filter set on the byte range [start, end) of a plain SAM file.
+    from sam_mmap import iter_column_blocks, iter_mmap_lines
+    stats = FilteredStats({name: (read_filter, SamStats(accumulator_factory()))
+                           for name, read_filter in filters.items()})
+    accumulators = [acc for _, set_stats in stats.sets.values() for acc in set_stats.accumulators.values()]
+    if all(getattr(acc, "add_columns", None) is not None for acc in accumulators):
+        return stats.update_columns(iter_column_blocks(path, start, end))
+    return stats.update(parse_sam_lines(filter_lines(iter_mmap_lines(path, start, end), stats.filters)))
+
+
+def filtered_stats(path, filters, accumulator_factory, jobs=1, threads=None):
+    # Single scan of a SAM, .sam.gz or BAM file computing the statistics of every filter set.
+    # filters: {name: ReadFilter}; returns {name: (ReadFilter, SamStats)}.
+    if is_compressed(path):
+        stats = FilteredStats({name: (read_filter, SamStats(accumulator_factory()))
+                               for name, read_filter in filters.items()})
+        return stats.update(iter_sam_records(path, threads)).results()
+    from sam_parallel import split_byte_ranges, find_body_offset
+    ranges = split_byte_ranges(path, max(jobs, 1), find_body_offset(path))
+    if jobs <= 1 or len(ranges) <= 1:
+        stats = filtered_range(path, ranges[0][0] if ranges else 0, ranges[-1][1] if ranges else 0, filters,
+                               accumulator_factory)
+        return stats.results()
+    from concurrent.futures import ProcessPoolExecutor  # Only loaded when a pool is needed.
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(filtered_range, path, start, end, filters, accumulator_factory)
+                   for start, end in ranges]
+        stats = futures[0].result()
+        for future in futures[1:]:  # Merge in file order for deterministic results.
+            stats.merge(future.result())
+    return stats.results()
+
+
+# ==========================================================================
+# Report of the filter sets
+# ==========================================================================
+FILTER_HEADERS = ["Filter", "Value"]
+
+
+def filtered_tables(tables, read_filter):
+    # Report tables of a filter set: the filter first, then the tables computed on the kept reads.
+    return {"Filter": (FILTER_HEADERS, read_filter.describe()), **tables}
+
+
+def format_filter_sets(reports, output_format):
+    # Output of several filter sets: {name: tables} -> one text/JSON/TSV document.
+    import json
+    from sam_report import OUTPUT_FORMATS, tables_to_dict
+    if output_format == "json":
+        return json.dumps({name or "main": tables_to_dict(tables) for name, tables in reports.items()}, indent=2)
+    parts = []
+    for name, tables in reports.items():
+        title = name or "main"
+        parts.append(f"\n##### Filter set: {title} #####" if output_format == "text" else f"## {title}")
+        parts.append(OUTPUT_FORMATS[output_format](tables))
+    return "\n".join(parts)
@@ -0,0 +1,265 @@
+import sys  # Library to access command-line arguments.
+import argparse  # Parses the command-line options.
+import heapq  # Mates waiting to be written in coordinate order.
+import random  # Seeded generator: the same options always give the same file.
+from bisect import bisect  # Weighted choices from cumulative weights.
+from sam_cigar import parse_cigar  # Reference span of the generated CIGARs.
+
+# ==========================================================================
+# Deterministic synthetic SAM generator
+#
+# Writes SAM files in the format of test_mapping.sam (bwa-like @SQ/@PG header,
+# "Clone1-<n>" read names, pairs with FLAG 99/147 or 83/163, both-unmapped
+# pairs with FLAG 77/141) with configurable read count, pairing, unmapped
+# fraction, CIGAR mix, MAPQ distribution and references. Records are written
+# as they are generated, so 100M+ record files cost constant memory. With
+# --sorted, reads are generated in coordinate order and each mate waits in a
+# small heap until the scan reaches its position.
+# ==========================================================================
+
+DEFAULT_CIGAR_MIX = "match:0.90,soft:0.05,indel:0.03,hard:0.01,splice:0.01"
+DEFAULT_MAPQ = "60:0.85,0:0.05,27:0.05,13:0.05"
+QUALITY_CHARS = "GGGGGGGGGGGGGGGGFGEDCB@>=10/"  # Mostly high qualities, as in test_mapping.sam.
+POOL_SIZE = 1 << 16  # Random bases/qualities sliced to build SEQ and QUAL.
+
+
+def parse_weights(spec, convert=str):
+    # Parses "value:weight,value:weight" into (values, cumulative weights).
+    values, cumulative, total = [], [], 0.0
+    for item in spec.split(","):
+        value, _, weight = item.partition(":")
+        total += float(weight or 1)
+        values.append(convert(value.strip()))
+        cumulative.append(total)
+    if not values or total <= 0:
+        raise ValueError(f"Invalid weights '{spec}'.")
+    return values, [weight / total for weight in cumulative]
+
+
+def make_cigar(kind, read_length, rng):
+    # Returns (CIGAR, query length) for one read of the given CIGAR category.
+    if kind == "soft":
+        clip = rng.randint(5, read_length // 2)
+        if rng.random() < 0.5:
+            return f"{clip}S{read_length - clip}M", read_length
+        return f"{read_length - clip}M{clip}S", read_length
+    if kind == "indel":
+        left = rng.randint(10, read_length - 20)
+        size = rng.randint(1, 5)
+        if rng.random() < 0.5:
+            return f"{left}M{size}I{read_length - left - size}M", read_length
+        return f"{left}M{size}D{read_length - left}M", read_length
+    if kind == "hard":
+        clip = rng.randint(5, read_length // 2)
+        return f"{clip}H{read_length - clip}M", read_length - clip
+    if kind == "splice":
+        left = rng.randint(10, read_length - 10)
+        return f"{left}M{rng.randint(50, 5000)}N{read_length - left}M", read_length
+    if kind == "match":
+        return f"{read_length}M", read_length
+    raise ValueError(f"Unknown CIGAR category '{kind}'.")
+
+
+class SamGenerator:
+    def __init__(self, reads, seed=1, paired=1.0, unmapped=0.3, cigar_mix=DEFAULT_CIGAR_MIX,
+                 mapq=DEFAULT_MAPQ, references=1, reference_length=1_000_000, read_length=100,
+                 insert_mean=200, insert_sd=15, coordinate_sorted=False):
+        self.reads = reads  # Number of records (lines) to write.
+        self.rng = random.Random(seed)
+        self.paired = paired  # Fraction of records belonging to a pair.
+        self.unmapped = unmapped  # Fraction of pairs (or single reads) left unmapped.
+        self.cigar_kinds, self.cigar_weights = parse_weights(cigar_mix)
+        self.mapq_values, self.mapq_weights = parse_weights(mapq, int)
+        if references == 1:
+            self.references = [("Reference", reference_length)]
+        else:
+            self.references = [(f"chr{i}", reference_length) for i in range(1, references + 1)]
+        self.read_length = read_length
+        self.insert_mean = insert_mean
+        self.insert_sd = insert_sd
+        self.coordinate_sorted = coordinate_sorted
+        self.bases = "".join(self.rng.choice("ACGT") for _ in range(POOL_SIZE + read_length))
+        self.qualities = "".join(self.rng.choice(QUALITY_CHARS) for _ in range(POOL_SIZE + read_length))
+
+    def header(self):
+        lines = ["@HD\tVN:1.6\tSO:coordinate"] if self.coordinate_sorted else []
+        lines += [f"@SQ\tSN:{name}\tLN:{length}" for name, length in self.references]
+        lines.append("@PG\tID:sam_generate\tPN:sam_generate\tVN:1.0")
+        return "".join(line + "\n" for line in lines)
+
+    def sequence(self, length):
+        start = self.rng.randrange(POOL_SIZE)
+        return self.bases[start:start + length], self.qualities[start:start + length]
+
+    def choose(self, values, weights):
+        return values[bisect(weights, self.rng.random())] if weights[-1] > 0 else values[-1]
+
+    def read_line(self, qname, flag, rname, pos, mapq, cigar, query_length, rnext, pnext, tlen):
+        seq, qual = self.sequence(query_length)
+        return f"{qname}\t{flag}\t{rname}\t{pos}\t{mapq}\t{cigar}\t{rnext}\t{pnext}\t{tlen}\t{seq}\t{qual}\n"
+
+    def mapped_pair(self, number, rname, length, pos=None):
+        # Returns the (position, line) of both mates of a mapped pair.
+        rng = self.rng
+        insert = max(int(rng.gauss(self.insert_mean, self.insert_sd)), self.read_length)
+        if pos is None:
+            pos = rng.randint(1, max(length - insert, 1))
+        mapq = self.choose(self.mapq_values, self.mapq_weights)
+        cigar1, query1 = make_cigar(self.choose(self.cigar_kinds, self.cigar_weights), self.read_length, rng)
+        cigar2, query2 = make_cigar(self.choose(self.cigar_kinds, self.cigar_weights), self.read_length, rng)
+        span2 = parse_cigar(cigar2).ref_span
+        mate_pos = max(pos + insert - span2, pos)
+        tlen = mate_pos + span2 - pos
+        if rng.random() < 0.5:  # First mate forward, second reverse.
+            flags = 99, 147
+        else:  # First mate reverse, second forward: the leftmost read is the second mate.
+            flags = 163, 83
+        qname = f"Clone1-{number}"
+        left = self.read_line(qname, flags[0], rname, pos, mapq, cigar1, query1, "=", mate_pos, tlen)
+        right = self.read_line(qname, flags[1], rname, mate_pos, mapq, cigar2, query2, "=", pos, -tlen)
+        return (pos, left), (mate_pos, right)
+
+    def unmapped_records(self, number, paired):
+        qname = f"Clone1-{number}"
+        if not paired:
+            return [self.read_line(qname, 4, "*", 0, 0, "*", self.read_length, "*", 0, 0)]
+        return [self.read_line(qname, 77, "*", 0, 0, "*", self.read_length, "*", 0, 0),
+                self.read_line(qname, 141, "*", 0, 0, "*", self.read_length, "*", 0, 0)]
+
+    def mapped_single(self, number, rname, length, pos=None):
+        rng = self.rng
+        if pos is None:
+            pos = rng.randint(1, max(length - self.read_length, 1))
+        cigar, query = make_cigar(self.choose(self.cigar_kinds, self.cigar_weights), self.read_length, rng)
+        flag = 16 if rng.random() < 0.5 else 0
+        return pos, self.read_line(f"Clone1-{number}", flag, rname, pos,
+                                   self.choose(self.mapq_values, self.mapq_weights), cigar, query, "*", 0, 0)
+
+    def plan(self):
+        # Yields (paired, unmapped) for every read name until `reads` records are planned.
+        rng = self.rng
+        remaining = self.reads
+        while remaining > 0:
+            paired = remaining >= 2 and rng.random() < self.paired
+            remaining -= 2 if paired else 1
+            yield paired, rng.random() < self.unmapped
+
+    def iter_lines(self):
+        # Yields the alignment lines (unsorted: read names in decreasing order, as in test_mapping.sam).
+        if self.coordinate_sorted:
+            yield from self.iter_sorted_lines()
+            return
+        rng = self.rng
+        number = 350000 + self.reads
+        for paired, unmapped in self.plan():
+            number -= 1
+            if unmapped:
+                yield from self.unmapped_records(number, paired)
+                continue
+            rname, length = self.references[rng.randrange(len(self.references))]
+            if paired:
+                first, second = self.mapped_pair(number, rname, length)
+                yield first[1]
+                yield second[1]
+            else:
+                yield self.mapped_single(number, rname, length)[1]
+
+    def iter_sorted_lines(self):
+        # Same kind of records in coordinate order; unmapped reads come last.
+        rng = self.rng
+        number = 350000 + self.reads
+        unplaced = 0  # Unmapped records, written at the end.
+        # Mapped read names are spread evenly over the references, in reference order.
+        names_per_reference = max(self.reads * (1 - self.unmapped) / (1 + self.paired) / len(self.references), 1)
+        references = iter(self.references)
+        rname, length = next(references)
+        step = max(length - self.insert_mean - 2 * self.insert_sd, 1) / names_per_reference
+        position, placed = 1.0, 0
+        waiting = []  # Heap of (position, sequence, line) of mates ahead of the scan.
+        for sequence, (paired, unmapped) in enumerate(self.plan()):
+            number -= 1
+            if unmapped:
+                unplaced += 2 if paired else 1
+                continue
+            if placed >= names_per_reference:  # Next reference: write the mates left behind first.
+                next_reference = next(references, None)
+                if next_reference is not None:
+                    while waiting:
+                        yield heapq.heappop(waiting)[2]
+                    rname, length = next_reference
+                    position, placed = 1.0, 0
+            placed += 1
+            position += rng.expovariate(1 / step)
+            pos = min(int(position), max(length - self.insert_mean - 2 * self.insert_sd, 1))
+            while waiting and waiting[0][0] <= pos:
+                yield heapq.heappop(waiting)[2]
+            if paired:
+                first, second = self.mapped_pair(number, rname, length, pos)
+                yield first[1]
+                heapq.heappush(waiting, (second[0], sequence, second[1]))
+            else:
+                yield self.mapped_single(number, rname, length, pos)[1]
+        while waiting:
+            yield heapq.heappop(waiting)[2]
+        while unplaced > 0:
+            number -= 1
+            paired = unplaced >= 2
+            yield from self.unmapped_records(number, paired)
+            unplaced -= 2 if paired else 1
+
+    def write(self, file):
+        file.write(self.header())
+        count = 0
+        buffer = []
+        for line in self.iter_lines():
+            buffer.append(line)
+            if len(buffer) >= 4096:
+                file.writelines(buffer)
+                count += len(buffer)
+                buffer = []
+        file.writelines(buffer)
+        return count + len(buffer)
+
+
+def generate_sam(path, reads, **options):
+    # Writes a synthetic SAM file and returns the number of records written.
+    generator = SamGenerator(reads, **options)
+    if path == "-":
+        return generator.write(sys.stdout)
+    with open(path, "w") as file:
+        return generator.write(file)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a deterministic synthetic SAM file.")
+    parser.add_argument("output", help="SAM file to write ('-' for standard output).")
+    parser.add_argument("--reads", "-n", type=float, default=1e4,
+                        help="Number of records, e.g. 1e6 (default: %(default)s).")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed (default: %(default)s).")
+    parser.add_argument("--paired", type=float, default=1.0,
+                        help="Fraction of records belonging to a pair (default: %(default)s).")
+    parser.add_argument("--unmapped", type=float, default=0.3,
+                        help="Fraction of read names left unmapped (default: %(default)s).")
+    parser.add_argument("--cigar-mix", default=DEFAULT_CIGAR_MIX,
+                        help="Weights of the CIGAR categories match, soft, indel, hard and splice "
+                             "(default: %(default)s).")
+    parser.add_argument("--mapq", default=DEFAULT_MAPQ,
+                        help="MAPQ distribution as value:weight pairs (default: %(default)s).")
+    parser.add_argument("--references", type=int, default=1,
+                        help="Number of references: 'Reference' alone, or chr1..chrN (default: %(default)s).")
+    parser.add_argument("--reference-length", type=int, default=1_000_000,
+                        help="Length of each reference (default: %(default)s).")
+    parser.add_argument("--read-length", type=int, default=100, help="Read length (default: %(default)s).")
+    parser.add_argument("--sorted", action="store_true", help="Write the records in coordinate order.")
+    args = parser.parse_args()
+
+    try:
+        count = generate_sam(args.output, int(args.reads), seed=args.seed, paired=args.paired,
+                             unmapped=args.unmapped, cigar_mix=args.cigar_mix, mapq=args.mapq,
+                             references=args.references, reference_length=args.reference_length,
+                             read_length=args.read_length, coordinate_sorted=args.sorted)
+    except ValueError as error:
+        print(f"Error: {error}")
+        sys.exit(1)
+    if args.output != "-":
+        print(f"{count} records written to '{args.output}'.")
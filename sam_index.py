@@ -0,0 +1,134 @@
+import json  # The index is stored as a small JSON sidecar file.
+import os  # Library to manage files and directories.
+import re  # For working with regular expressions.
+from sam_io import parse_sam_line, reference_span  # SAM line parser and CIGAR span.
+
+# ==========================================================================
+# Sidecar positional index for coordinate-sorted SAM files
+#
+# For every reference the index stores the byte range of its block of lines
+# and a linear index: for each window of BIN_SIZE bases, the byte offset of
+# the first line whose alignment overlaps the window. A region query seeks to
+# the offset of the window containing the region start and stops reading at
+# the first record beyond the region end.
+# ==========================================================================
+
+INDEX_SUFFIX = ".sai"
+BIN_SIZE = 1 << 14  # 16 kb windows, as in the BAI linear index.
+REGION_PATTERN = re.compile(r"^(?P<chrom>.+?)(?::(?P<start>[\d,]+)(?:-(?P<end>[\d,]+))?)?$")
+
+
+def index_path(path):
+    # Path of the sidecar index of a SAM file.
+    return path + INDEX_SUFFIX
+
+
+def parse_region(region):
+    # Parses "chrom", "chrom:start" or "chrom:start-end" (1-based, inclusive).
+    match = REGION_PATTERN.match(region.strip())
+    if not match:
+        raise ValueError(f"Invalid region '{region}'.")
+    start = int(match.group("start").replace(",", "")) if match.group("start") else 1
+    end = int(match.group("end").replace(",", "")) if match.group("end") else None
+    if end is not None and end < start:
+        raise ValueError(f"Invalid region '{region}': end is before start.")
+    return match.group("chrom"), start, end
+
+
+# ==========================================================================
+# Function to build the index
+# ==========================================================================
+def build_index(path, bin_size=BIN_SIZE):
+    # Scans a coordinate-sorted SAM file once and returns its index as a dict.
+    references = {}
+    current = None  # Index entry of the reference being scanned.
+    last_pos = 0
+    offset = 0
+    block_end = 0  # End of the last indexed line.
+    with open(path, "rb") as file:
+        for line in file:
+            line_offset = offset
+            offset += len(line)
+            if line.startswith(b"@"):
+                continue
+            fields = line.split(b"\t", 6)
+            if len(fields) < 7:
+                continue
+            chrom = fields[2].decode()
+            if chrom == "*":  # Unplaced unmapped reads close the sorted part of the file.
+                break
+            pos = int(fields[3])
+            if current is None or chrom != current["name"]:
+                if chrom in references:
+                    raise ValueError(f"'{path}' is not coordinate-sorted: '{chrom}' appears twice.")
+                if current is not None:
+                    current["end"] = block_end
+                current = references[chrom] = {"name": chrom, "start": line_offset, "end": None, "linear": []}
+                last_pos = 0
+            if pos < last_pos:
+                raise ValueError(f"'{path}' is not coordinate-sorted at byte {line_offset}.")
+            last_pos = pos
+            # Record the offset for every window this alignment overlaps that has none yet.
+            last = pos - 1 + max(reference_span(fields[5].decode()), 1) - 1
+            linear = current["linear"]
+            for window in range(max(len(linear), (pos - 1) // bin_size), last // bin_size + 1):
+                while len(linear) < window:
+                    linear.append(-1)
+                linear.append(line_offset)
+            block_end = offset
+        if current is not None:
+            current["end"] = block_end
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime": stat.st_mtime, "bin_size": bin_size,
+            "references": {name: {key: ref[key] for key in ("start", "end", "linear")}
+                           for name, ref in references.items()}}
+
+
+def write_index(path, bin_size=BIN_SIZE):
+    # Builds the index of a SAM file and writes it next to the file.
+    index = build_index(path, bin_size)
+    with open(index_path(path), "w") as file:
+        json.dump(index, file)
+    return index_path(path)
+
+
+def load_index(path):
+    # Loads the sidecar index and checks that it matches the current file.
+    with open(index_path(path)) as file:
+        index = json.load(file)
+    stat = os.stat(path)
+    if index["size"] != stat.st_size or index["mtime"] != stat.st_mtime:
+        raise ValueError(f"The index of '{path}' is out of date, rebuild it with 'analyse_sam.py index'.")
+    return index
+
+
+# ==========================================================================
+# Function to stream the records overlapping a region
+# ==========================================================================
+def iter_region_records(path, region, index=None):
+    # Yields the records whose alignment overlaps the region (1-based, inclusive).
+    chrom, start, end = parse_region(region)
+    if index is None:
+        index = load_index(path)
+    reference = index["references"].get(chrom)
+    if reference is None:
+        return
+    linear = reference["linear"]
+    window = (start - 1) // index["bin_size"]
+    first = next((offset for offset in linear[window:] if offset >= 0), None)  # First window with reads.
+    if first is None:
+        return
+    with open(path, "rb") as file:
+        file.seek(first)
+        position = first
+        for line in file:
+            position += len(line)
+            record = parse_sam_line(line.decode())
+            if record is None:
+                continue
+            if record.rname != chrom or (end is not None and record.pos > end):
+                break
+            if record.pos + max(reference_span(record.cigar), 1) - 1 >= start:
+                yield record
+            if position >= reference["end"]:
+                break
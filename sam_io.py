@@ -0,0 +1,118 @@
+from sam_cigar import parse_cigar  # Memoized CIGAR parser.
+
+# KEYS: List defining the 11 mandatory SAM columns, in file order.
+KEYS = ['QNAME', 'FLAG', 'RNAME', 'POS', 'MAPQ', 'CIGAR', 'RNEXT', 'PNEXT', 'TLEN', 'SEQ', 'QUAL']
+
+
+# ==========================================================================
+# SamRecord: typed view of the mandatory columns of one alignment line
+# ==========================================================================
+class SamRecord:
+    # FLAG, POS, MAPQ, PNEXT and TLEN are converted to integers once, when the
+    # line is parsed, so the statistics never have to call int() again.
+    __slots__ = ('qname', 'flag', 'rname', 'pos', 'mapq', 'cigar',
+                 'rnext', 'pnext', 'tlen', 'seq', 'qual')
+
+    def __init__(self, qname, flag, rname, pos, mapq, cigar, rnext, pnext, tlen, seq, qual):
+        self.qname = qname
+        self.flag = flag
+        self.rname = rname
+        self.pos = pos
+        self.mapq = mapq
+        self.cigar = cigar
+        self.rnext = rnext
+        self.pnext = pnext
+        self.tlen = tlen
+        self.seq = seq
+        self.qual = qual
+
+    def __repr__(self):
+        return (f"SamRecord({self.qname!r}, flag={self.flag}, rname={self.rname!r}, "
+                f"pos={self.pos}, mapq={self.mapq}, cigar={self.cigar!r})")
+
+
+def reference_span(cigar):
+    # Number of reference bases covered by an alignment (M, D, N, = and X operations).
+    return parse_cigar(cigar).ref_span
+
+
+# ==========================================================================
+# Functions to parse SAM lines into records
+# ==========================================================================
+def parse_sam_line(line):
+    # Parses one alignment line. Returns None when a mandatory column is missing.
+    infos = line.rstrip("\r\n").split("\t", len(KEYS))  # Optional tags stay joined in a 12th field.
+    if len(infos) < len(KEYS):  # Verify if all columns are present.
+        return None
+    return SamRecord(infos[0], int(infos[1]), infos[2], int(infos[3]), int(infos[4]), infos[5],
+                     infos[6], int(infos[7]), int(infos[8]), infos[9], infos[10])
+
+
+def parse_sam_lines(lines):
+    # Generator turning an iterable of text lines into SamRecord objects.
+    for line in lines:
+        if line.startswith("@"):  # Ignore header lines starting with "@".
+            continue
+        record = parse_sam_line(line)
+        if record is not None:
+            yield record
+
+
+def is_compressed(path):
+    # True for gzip/BGZF input (.sam.gz, .bam), detected from the magic bytes.
+    with open(path, "rb") as file:
+        return file.read(2) == b"\x1f\x8b"
+
+
+SNAPSHOT_MAGIC = b"SAMCOL1\n"  # First bytes of a binary columnar snapshot (sam_snapshot.py).
+
+
+def is_snapshot(path):
+    # True for a .samcol snapshot written by 'analyse_sam.py export', detected from the magic bytes.
+    with open(path, "rb") as file:
+        return file.read(len(SNAPSHOT_MAGIC)) == SNAPSHOT_MAGIC
+
+
+def iter_sam_records(path, threads=None):
+    # Streams the alignments of a SAM, .sam.gz or BAM file one record at a time (constant memory).
+    # threads: number of BGZF decompression threads (compressed input only).
+    if is_compressed(path):
+        from sam_bam import iter_compressed_records  # Only needed for compressed input.
+        yield from iter_compressed_records(path, threads)
+        return
+    with open(path, "r") as file:
+        yield from parse_sam_lines(file)
+
+
+# ==========================================================================
+# Functions to read the "@" header
+# ==========================================================================
+def read_header_lines(path):
+    # Returns the header lines of a SAM, .sam.gz or BAM file (without line endings).
+    if is_compressed(path):
+        from sam_bam import read_compressed_header  # Only needed for compressed input.
+        return read_compressed_header(path)
+    header = []
+    with open(path, "r") as file:
+        for line in file:
+            if not line.startswith("@"):
+                break
+            header.append(line.rstrip("\r\n"))
+    return header
+
+
+def parse_references(header_lines):
+    # Extracts [(SN, LN), ...] from the @SQ lines, in header order.
+    references = []
+    for line in header_lines:
+        if not line.startswith("@SQ"):
+            continue
+        fields = dict(field.split(":", 1) for field in line.split("\t")[1:] if ":" in field)
+        if "SN" in fields and "LN" in fields:
+            references.append((fields["SN"], int(fields["LN"])))
+    return references
+
+
+def read_references(path):
+    # Reference names and lengths declared in the @SQ header lines.
+    return parse_references(read_header_lines(path))
@@ -0,0 +1,210 @@
+import mmap  # The file is read through a memory map.
+import os  # Library to manage files and directories.
+from collections import Counter  # Counts of the integer columns.
+import numpy as np  # Tab offsets and integer columns computed on whole blocks.
+from sam_io import KEYS, is_compressed, iter_sam_records, parse_sam_lines  # Streaming SAM/BAM reader.
+from sam_stats import SamStats  # Single-pass statistics engine.
+
+# ==========================================================================
+# Memory-mapped column parser
+#
+# The file is memory-mapped and cut into blocks of whole lines. A block is
+# never decoded or split into per-line strings: the offsets of its newlines
+# and tabs are found with NumPy in one pass over the bytes, which gives the
+# start and end of every column of every line. A column is only converted
+# when a statistic reads it (ColumnBlock["flag"], ...), and then for the
+# whole block at once: FLAG, POS, MAPQ, PNEXT and TLEN become int64 arrays
+# (digits summed in place, no int() per read), the other columns lists of
+# bytes. SEQ and QUAL are never touched unless asked for.
+#
+# Accumulators opt in with an add_columns(columns) method; when one of them
+# has none, the file is parsed into SamRecord objects as before.
+# ==========================================================================
+
+BLOCK_SIZE = 1 << 22  # Bytes of the memory map parsed at a time.
+FIELD_INDEX = {key.lower(): index for index, key in enumerate(KEYS)}  # SamRecord attribute -> column.
+INTEGER_FIELDS = {"flag", "pos", "mapq", "pnext", "tlen"}
+MAX_CODE_WIDTH = 64  # Longest text value deduplicated by NumPy (see ColumnBlock.codes).
+TAB, NEWLINE, MINUS, ZERO, HEADER = 9, 10, 45, 48, 64  # Byte values.
+
+
+class ColumnBlock:
+    # Alignment lines of one block of the file, converted column by column on demand.
+    def __init__(self, block):
+        self.block = block
+        data = self.data = np.frombuffer(block, dtype=np.uint8)  # View of the block, no copy.
+        separators = np.flatnonzero(data <= NEWLINE)  # Tabs and newlines in one pass.
+        kinds = data[separators]
+        tabs = separators[kinds == TAB]
+        ends = separators[kinds == NEWLINE]
+        if len(ends) == 0 or ends[-1] != len(data) - 1:  # Last line without a newline.
+            ends = np.append(ends, len(data))
+        starts = np.empty_like(ends)
+        starts[:1] = 0
+        starts[1:] = ends[:-1] + 1
+        first_tab = np.searchsorted(tabs, starts)
+        tab_count = np.searchsorted(tabs, ends) - first_tab
+        # Header lines and lines with fewer than 11 columns are skipped, as in parse_sam_lines().
+        keep = tab_count >= len(KEYS) - 1
+        keep[keep] = data[starts[keep]] != HEADER
+        self.starts, self.ends, self.first_tab = starts[keep], ends[keep], first_tab[keep]
+        self.tabs = np.append(tabs, len(data))  # Sentinel: QUAL of a last line without optional tags.
+        self.columns = {}
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, field):
+        column = self.columns.get(field)
+        if column is None:
+            index = FIELD_INDEX[field]
+            column = self.integers(index) if field in INTEGER_FIELDS else self.strings(index)
+            self.columns[field] = column
+        return column
+
+    def select(self, mask):
+        # View of the lines where mask is True (same bytes; converted columns are subset, not recomputed).
+        view = object.__new__(ColumnBlock)
+        view.block, view.data, view.tabs = self.block, self.data, self.tabs
+        view.starts, view.ends, view.first_tab = self.starts[mask], self.ends[mask], self.first_tab[mask]
+        view.columns = {}
+        for key, column in self.columns.items():
+            if key.endswith(":codes"):
+                view.columns[key] = (column[0], column[1][mask])
+            elif isinstance(column, list):
+                view.columns[key] = [value for value, kept in zip(column, mask.tolist()) if kept]
+            else:
+                view.columns[key] = column[mask]
+        return view
+
+    def bounds(self, index):
+        # (start, end) byte offsets of column `index` on every line.
+        start = self.starts if index == 0 else self.tabs[self.first_tab + index - 1] + 1
+        end = self.tabs[self.first_tab + index]
+        if index == len(KEYS) - 1:  # QUAL ends at the next tab only if optional tags follow.
+            end = np.minimum(end, self.ends)
+        return start, end
+
+    def integers(self, index):
+        # Column as an int64 array, read right to left one digit position at a time.
+        start, end = self.bounds(index)
+        data = self.data
+        negative = data[np.minimum(start, len(data) - 1)] == MINUS
+        start = start + negative
+        length = end - start
+        values = np.zeros(len(start), dtype=np.int64)
+        invalid = length <= 0
+        scale = 1
+        for position in range(int(length.max()) if len(length) else 0):
+            present = length > position
+            digits = data[np.where(present, end - 1 - position, 0)].astype(np.int64) - ZERO
+            invalid |= present & ((digits < 0) | (digits > 9))
+            values += np.where(present, digits, 0) * scale
+            scale *= 10
+        if invalid.any():  # int() would have raised on this line too.
+            line = invalid.argmax()
+            text = self.block[self.starts[line]:self.ends[line]][:80].decode(errors="replace")
+            raise ValueError(f"invalid {KEYS[index]} in line: {text}")
+        return np.where(negative, -values, values)
+
+    def strings(self, index):
+        # Column as a list of bytes values.
+        block = self.block
+        start, end = self.bounds(index)
+        return [block[s:e] for s, e in zip(start.tolist(), end.tolist())]
+
+    def counts(self, field, mask=None):
+        # {value: lines} of a column (only the lines where mask is True), in order of first appearance.
+        if field in INTEGER_FIELDS:
+            values = self[field] if mask is None else self[field][mask]
+            return Counter(values.tolist())
+        names, codes = self.codes(field)
+        counts = np.bincount(codes if mask is None else codes[mask], minlength=len(names)).tolist()
+        return {name: count for name, count in zip(names, counts) if count}
+
+    def codes(self, field):
+        # (distinct values in order of first appearance, int64 array of value indexes) of a text column.
+        key = field + ":codes"
+        if key not in self.columns:
+            start, end = self.bounds(FIELD_INDEX[field])
+            length = end - start
+            width = int(length.max())
+            if width > MAX_CODE_WIDTH:  # Long values: one dict lookup per line.
+                ids = {}
+                codes = np.array([ids.setdefault(value, len(ids)) for value in self[field]], dtype=np.int64)
+                self.columns[key] = (list(ids), codes)
+                return self.columns[key]
+            # Values padded with zero bytes to a fixed width, then sorted and deduplicated by NumPy.
+            offsets = np.arange(width)
+            matrix = self.data[np.minimum(start[:, None] + offsets, len(self.data) - 1)]
+            matrix[offsets >= length[:, None]] = 0
+            keys = matrix.view(f"S{width}").ravel()
+            values, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+            order = np.argsort(first)  # Back to the order of first appearance.
+            rank = np.empty_like(order)
+            rank[order] = np.arange(len(order))
+            self.columns[key] = ([bytes(value) for value in values[order]], rank[inverse.ravel()])
+        return self.columns[key]
+
+
+def iter_mmap_blocks(path, start=0, end=None, block_size=BLOCK_SIZE):
+    # Yields blocks of whole lines (about block_size bytes each) of the byte range [start, end).
+    end = os.path.getsize(path) if end is None else end
+    if start >= end:
+        return
+    with open(path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        release = hasattr(mapped, "madvise") and hasattr(mmap, "MADV_DONTNEED")  # Linux, Python 3.8+.
+        if release:
+            mapped.madvise(mmap.MADV_SEQUENTIAL)
+        released = start - start % mmap.PAGESIZE  # Pages before `released` were given back.
+        position = start
+        while position < end:
+            stop = min(position + block_size, end)
+            if stop < end:  # Cut after the last newline of the block (or of the line it ends in).
+                newline = mapped.rfind(b"\n", position, stop)
+                if newline < 0:
+                    newline = mapped.find(b"\n", stop, end)
+                stop = end if newline < 0 else newline + 1
+            block = mapped[position:stop]
+            position = stop
+            if release and position - released >= mmap.PAGESIZE:
+                # The block is copied: drop its pages from the resident memory of this process.
+                length = (position - released) // mmap.PAGESIZE * mmap.PAGESIZE
+                mapped.madvise(mmap.MADV_DONTNEED, released, length)
+                released += length
+            yield block.replace(b"\r\n", b"\n") if b"\r" in block else block
+
+
+def iter_column_blocks(path, start=0, end=None, block_size=BLOCK_SIZE):
+    # Yields a ColumnBlock for every block of the byte range [start, end) that holds alignments.
+    for block in iter_mmap_blocks(path, start, end, block_size):
+        columns = ColumnBlock(block)
+        if len(columns):
+            yield columns
+
+
+def iter_mmap_lines(path, start=0, end=None):
+    # Yields the decoded lines of the byte range [start, end).
+    for block in iter_mmap_blocks(path, start, end):
+        yield from block.decode().split("\n")
+
+
+def mmap_stats(path, accumulators=None, start=0, end=None, profiler=None):
+    # Single pass over a plain SAM file (or the byte range [start, end)) through the memory map.
+    # profiler: sam_profile.Profiler showing the parsing throughput, or None.
+    stats = SamStats(accumulators)
+    if all(getattr(acc, "add_columns", None) is not None for acc in stats.accumulators.values()):
+        blocks = iter_column_blocks(path, start, end)
+        if profiler is not None:
+            blocks = profiler.track_blocks(blocks, (os.path.getsize(path) if end is None else end) - start)
+        return stats.update_columns(blocks)
+    records = parse_sam_lines(iter_mmap_lines(path, start, end))
+    return stats.update(profiler.track(records) if profiler is not None else records)
+
+
+def file_stats(path, accumulators=None, threads=None, profiler=None):
+    # Statistics of a SAM, .sam.gz or BAM file: column parser for plain SAM, streaming reader otherwise.
+    if is_compressed(path):
+        records = iter_sam_records(path, threads)
+        return SamStats(accumulators).update(profiler.track(records) if profiler is not None else records)
+    return mmap_stats(path, accumulators, profiler=profiler)
@@ -0,0 +1,305 @@
+import heapq  # Pending mates ordered by the position where their mate is expected.
+import os  # Library to manage files and directories.
+import shutil  # Removes the spill directory.
+import tempfile  # Spill directory for unsorted input.
+import zlib  # crc32: stable hash of QNAME for the spill partitions.
+from collections import defaultdict  # Simplifies the handling of dictionaries.
+
+# ==========================================================================
+# Memory-bounded mate pairing
+#
+# Only primary records of paired reads (FLAG 1 set, 256 and 2048 unset) are
+# paired. A read waits in `pending` until its mate arrives, as a small tuple
+# (flag, rname, pos, tlen, mate rname, pnext) instead of the whole record.
+#   - coordinate-sorted input: a pending read is dropped (counted as an
+#     orphan) once the scan has passed the position of its mate (RNEXT,
+#     PNEXT), so memory is bounded by the pairing window;
+#   - unsorted input: when `max_pending` reads are waiting, they are written
+#     to `partitions` files by hash of QNAME; at the end each partition is
+#     paired on its own, so both mates always meet in the same partition.
+# If a file announced as sorted turns out not to be, pairing falls back to
+# the unsorted mode.
+# ==========================================================================
+
+DEFAULT_MAX_PENDING = 1_000_000  # Reads kept in memory before spilling (unsorted input).
+DEFAULT_PARTITIONS = 64  # Spill files.
+LAST_RANK = float("inf")  # Sort rank of RNAME "*" (unplaced reads come last).
+
+
+def is_coordinate_sorted(header_lines):
+    # True when the @HD line declares SO:coordinate.
+    for line in header_lines:
+        if line.startswith("@HD"):
+            return "SO:coordinate" in line.split("\t")
+    return False
+
+
+class PairStats:
+    name = "pairs"
+
+    def __init__(self, coordinate_sorted=False, references=None, max_pending=DEFAULT_MAX_PENDING,
+                 partitions=DEFAULT_PARTITIONS, spill_dir=None):
+        # references: [(name, length), ...] from the @SQ lines, in sort order.
+        self.coordinate_sorted = coordinate_sorted
+        self.max_pending = max_pending
+        self.partitions = partitions
+        self.spill_dir = spill_dir  # Parent directory of the spill files (system default if None).
+        self.ranks = {name: rank for rank, (name, _) in enumerate(references or [])}
+        self.pending = {}  # QNAME -> (flag, rname, pos, tlen, mate rname, pnext).
+        self.expected = []  # Heap of (mate rank, PNEXT, QNAME), sorted input only.
+        self.deferred = defaultdict(list)  # Mate reference not reached yet -> [(PNEXT, QNAME)].
+        self.position = (-1, 0)  # (rank, pos) of the last record scanned.
+        self.spill_path = None  # Spill directory, created on the first spill.
+        self.peak_pending = 0  # Largest number of reads waiting in memory.
+        self.single_end = 0  # Primary reads without FLAG 1.
+        self.pairs = 0
+        self.both_mapped = 0
+        self.one_mapped = 0
+        self.none_mapped = 0
+        self.proper = 0  # Both mapped and FLAG 2 set.
+        self.discordant = 0  # Both mapped without FLAG 2 (cross-chromosome pairs included).
+        self.cross_chromosome = 0
+        self.orphans = 0  # Reads whose mate never showed up.
+        self.insert_sizes = defaultdict(int)  # |TLEN| -> pairs (both mapped on the same reference).
+
+    # ----------------------------------------------------------------------
+    # Feeding records
+    # ----------------------------------------------------------------------
+    def add(self, record):
+        flag = record.flag
+        if flag & 0x900:  # Secondary and supplementary alignments.
+            return
+        if not flag & 1:
+            self.single_end += 1
+            return
+        if self.coordinate_sorted:
+            self.advance(record.rname, record.pos)
+        mate_rname = record.rname if record.rnext == "=" else record.rnext
+        self.add_entry(record.qname, (flag, record.rname, record.pos, record.tlen, mate_rname, record.pnext))
+
+    def add_entry(self, qname, entry):
+        mate = self.pending.pop(qname, None)
+        if mate is not None:
+            self.count_pair(mate, entry)
+            return
+        self.pending[qname] = entry
+        if len(self.pending) > self.peak_pending:
+            self.peak_pending = len(self.pending)
+        if self.coordinate_sorted:
+            self.expect(qname, entry[4], entry[5])
+        elif len(self.pending) >= self.max_pending:
+            self.spill()
+
+    def rank(self, rname):
+        return LAST_RANK if rname == "*" else self.ranks.get(rname)
+
+    def expect(self, qname, mate_rname, pnext):
+        rank = self.rank(mate_rname)
+        if rank is None:  # Reference not declared and not scanned yet: wait until the scan reaches it.
+            self.deferred[mate_rname].append((pnext, qname))
+        else:
+            heapq.heappush(self.expected, (rank, pnext, qname))
+
+    def advance(self, rname, pos):
+        # Moves the scan to (rname, pos) and drops the reads whose mate position is behind it.
+        if rname != "*" and rname not in self.ranks:  # Undeclared reference: ranked in scan order.
+            self.ranks[rname] = len(self.ranks)
+            for pnext, qname in self.deferred.pop(rname, ()):
+                heapq.heappush(self.expected, (self.ranks[rname], pnext, qname))
+        position = (self.rank(rname), pos)
+        if position < self.position:  # Not sorted after all: pair through the spill files instead.
+            self.coordinate_sorted = False
+            self.expected = []
+            self.deferred.clear()
+            return
+        self.position = position
+        expected = self.expected
+        while expected and expected[0][:2] < position:
+            qname = heapq.heappop(expected)[2]
+            if qname in self.pending:  # Already paired otherwise.
+                del self.pending[qname]
+                self.orphans += 1
+
+    def count_pair(self, first, second):
+        self.pairs += 1
+        mapped = (not first[0] & 4) + (not second[0] & 4)
+        if mapped == 0:
+            self.none_mapped += 1
+            return
+        if mapped == 1:
+            self.one_mapped += 1
+            return
+        self.both_mapped += 1
+        if first[0] & second[0] & 2:
+            self.proper += 1
+        else:
+            self.discordant += 1
+        if first[1] != second[1]:
+            self.cross_chromosome += 1
+            return
+        tlen = abs(first[3]) or abs(second[3])
+        if tlen:
+            self.insert_sizes[tlen] += 1
+
+    # ----------------------------------------------------------------------
+    # Spill files (unsorted input)
+    # ----------------------------------------------------------------------
+    def spill(self):
+        # Appends the pending reads to their partition files and empties memory.
+        if self.spill_path is None:
+            self.spill_path = tempfile.mkdtemp(prefix="sam_pairs_", dir=self.spill_dir)
+        lines = defaultdict(list)
+        for qname, (flag, rname, pos, tlen, mate_rname, pnext) in self.pending.items():
+            lines[zlib.crc32(qname.encode()) % self.partitions].append(
+                f"{qname}\t{flag}\t{rname}\t{pos}\t{tlen}\t{mate_rname}\t{pnext}\n")
+        for partition, partition_lines in lines.items():
+            with open(os.path.join(self.spill_path, f"{partition}.tsv"), "a") as file:
+                file.writelines(partition_lines)
+        self.pending = {}
+
+    def iter_spilled(self):
+        # Yields (partition, [(qname, entry), ...]) for every spill file.
+        if self.spill_path is None:
+            return
+        for name in sorted(os.listdir(self.spill_path)):
+            entries = []
+            with open(os.path.join(self.spill_path, name)) as file:
+                for line in file:
+                    qname, flag, rname, pos, tlen, mate_rname, pnext = line.rstrip("\n").split("\t")
+                    entries.append((qname, (int(flag), rname, int(pos), int(tlen), mate_rname, int(pnext))))
+            yield name, entries
+
+    def remove_spill(self):
+        if self.spill_path is not None:
+            shutil.rmtree(self.spill_path, ignore_errors=True)
+            self.spill_path = None
+
+    def finish(self):
+        # Pairs the spilled reads partition by partition; reads still alone are orphans.
+        if self.spill_path is not None:
+            self.spill()  # Reads still in memory may have their mate on disk.
+            for _, entries in self.iter_spilled():
+                waiting = {}
+                for qname, entry in entries:
+                    mate = waiting.pop(qname, None)
+                    if mate is None:
+                        waiting[qname] = entry
+                    else:
+                        self.count_pair(mate, entry)
+                self.orphans += len(waiting)
+            self.remove_spill()
+        self.orphans += len(self.pending)
+        self.pending = {}
+        self.expected = []
+        self.deferred.clear()
+
+    # ----------------------------------------------------------------------
+    # Accumulator interface
+    # ----------------------------------------------------------------------
+    COUNTERS = ("single_end", "pairs", "both_mapped", "one_mapped", "none_mapped", "proper",
+                "discordant", "cross_chromosome", "orphans")
+
+    def pending_entries(self):
+        # Every unpaired read, in memory or spilled.
+        yield from self.pending.items()
+        for _, entries in self.iter_spilled():
+            yield from entries
+
+    def merge(self, other):
+        # Adds the counts of `other` and tries to pair its waiting reads with ours.
+        for counter in self.COUNTERS:
+            setattr(self, counter, getattr(self, counter) + getattr(other, counter))
+        for tlen, count in other.insert_sizes.items():
+            self.insert_sizes[tlen] += count
+        self.peak_pending = max(self.peak_pending, other.peak_pending)
+        self.coordinate_sorted = False  # Waiting reads of another part are not in scan order.
+        self.expected = []
+        for qname, entry in other.pending_entries():
+            self.add_entry(qname, entry)
+        other.remove_spill()
+
+    def result(self):
+        self.finish()
+        paired_reads = 2 * self.pairs + self.orphans
+        return {
+            "paired_reads": paired_reads,
+            "single_end_reads": self.single_end,
+            "pairs": self.pairs,
+            "both_mapped": self.both_mapped,
+            "one_mapped": self.one_mapped,
+            "none_mapped": self.none_mapped,
+            "properly_paired": self.proper,
+            "properly_paired_rate": self.proper / self.pairs if self.pairs else 0.0,
+            "discordant": self.discordant,
+            "cross_chromosome": self.cross_chromosome,
+            "orphans": self.orphans,
+            "peak_pending": self.peak_pending,
+            "insert_sizes": dict(sorted(self.insert_sizes.items())),
+        }
+
+    def to_dict(self):
+        state = {counter: getattr(self, counter) for counter in self.COUNTERS}
+        state.update({"peak_pending": self.peak_pending,
+                      "insert_sizes": {str(tlen): count for tlen, count in self.insert_sizes.items()},
+                      "pending": [[qname] + list(entry) for qname, entry in self.pending_entries()]})
+        return state
+
+    @classmethod
+    def from_dict(cls, state):
+        acc = cls()
+        for counter in cls.COUNTERS:
+            setattr(acc, counter, state[counter])
+        acc.peak_pending = state["peak_pending"]
+        for tlen, count in state["insert_sizes"].items():  # JSON object keys are strings.
+            acc.insert_sizes[int(tlen)] = count
+        for item in state["pending"]:  # Spilled reads may still hold both mates of a pair.
+            acc.add_entry(item[0], tuple(item[1:]))
+        return acc
+
+
+# ==========================================================================
+# Report tables
+# ==========================================================================
+def pair_table(result):
+    # Rows of the "Pair Statistics" table (result of PairStats.result()).
+    pairs = result["pairs"]
+
+    def share(value):
+        return f"{(value / pairs) * 100:.2f}%" if pairs else "0.00%"
+
+    return [
+        ["Pairs", pairs, "100.00%"],
+        ["Both Mates Mapped", result["both_mapped"], share(result["both_mapped"])],
+        ["One Mate Mapped", result["one_mapped"], share(result["one_mapped"])],
+        ["No Mate Mapped", result["none_mapped"], share(result["none_mapped"])],
+        ["Properly Paired", result["properly_paired"], share(result["properly_paired"])],
+        ["Discordant", result["discordant"], share(result["discordant"])],
+        ["Cross-Chromosome", result["cross_chromosome"], share(result["cross_chromosome"])],
+        ["Orphan Reads (mate missing)", result["orphans"], "-"],
+        ["Single-End Reads", result["single_end_reads"], "-"],
+    ]
+
+
+def insert_size_summary(insert_sizes):
+    # (mean, median) of the |TLEN| histogram.
+    total = sum(insert_sizes.values())
+    if not total:
+        return 0, 0
+    mean = sum(tlen * count for tlen, count in insert_sizes.items()) / total
+    seen = 0
+    for tlen, count in sorted(insert_sizes.items()):
+        seen += count
+        if 2 * seen >= total:
+            return round(mean, 2), tlen
+
+
+def insert_size_table(insert_sizes, interval_size=50):
+    # Rows of the "Insert Size Distribution" table, |TLEN| grouped by intervals.
+    grouped = defaultdict(int)
+    for tlen, count in insert_sizes.items():
+        grouped[(tlen // interval_size) * interval_size] += count
+    return [[f"{start}-{start + interval_size - 1}", count] for start, count in sorted(grouped.items())]
+
+
+PAIR_HEADERS = ["Statistic", "Value", "Percentage of Pairs"]
+INSERT_SIZE_HEADERS = ["Insert Size", "Pairs"]
@@ -0,0 +1,93 @@
+import os  # Library to manage files and directories.
+from sam_stats import SamStats  # Single-pass statistics engine.
+
+# ==========================================================================
+# Parallel parsing of one SAM file by byte-range chunking
+#
+# The body of the file (everything after the "@" header) is cut into byte
+# ranges whose boundaries are moved to the next newline, so that every line
+# belongs to exactly one range. Each range is parsed and aggregated by its own
+# process into a SamStats; the partial results are then merged in file order,
+# which gives exactly the same statistics as a serial pass.
+# ==========================================================================
+
+
+def find_body_offset(path):
+    # Returns the byte offset of the first alignment line (just after the header).
+    offset = 0
+    with open(path, "rb") as file:
+        for line in file:
+            if not line.startswith(b"@"):
+                break
+            offset += len(line)
+    return offset
+
+
+def align_to_line(file, offset, size):
+    # Moves offset forward to the start of the next line (or to the end of the file).
+    if offset <= 0 or offset >= size:
+        return min(max(offset, 0), size)
+    file.seek(offset - 1)
+    if file.read(1) == b"\n":  # Already at the start of a line.
+        return offset
+    file.readline()  # Skip the rest of the current line.
+    return file.tell()
+
+
+def complete_lines_end(path):
+    # Returns the offset just after the last newline (ignores a partially written last line).
+    size = os.path.getsize(path)
+    with open(path, "rb") as file:
+        end = size
+        while end > 0:
+            block = max(end - 65536, 0)
+            file.seek(block)
+            newline = file.read(end - block).rfind(b"\n")
+            if newline >= 0:
+                return block + newline + 1
+            end = block
+    return 0
+
+
+def split_byte_ranges(path, chunks, start=None, end=None):
+    # Splits the body of the file (or [start, end)) into at most `chunks` newline-aligned ranges.
+    size = os.path.getsize(path) if end is None else end
+    if start is None:
+        start = find_body_offset(path)
+    step = max((size - start) // max(chunks, 1), 1)
+    bounds = [start]
+    with open(path, "rb") as file:
+        for i in range(1, chunks):
+            bound = align_to_line(file, start + i * step, size)
+            if bound > bounds[-1]:
+                bounds.append(bound)
+    if bounds[-1] < size:
+        bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def analyse_range(path, start, end, accumulator_factory=None):
+    # Worker: parses one byte range and returns its partial statistics.
+    from sam_mmap import mmap_stats  # Loads NumPy: only imported once a range is parsed.
+    accumulators = accumulator_factory() if accumulator_factory is not None else None
+    return mmap_stats(path, accumulators, start, end)
+
+
+def parallel_stats(path, jobs, accumulator_factory=None, start=None, end=None):
+    # Analyses the file (or the byte range [start, end)) with `jobs` processes and
+    # merges the partial results in file order.
+    # accumulator_factory must be a picklable callable (e.g. a module-level function).
+    ranges = split_byte_ranges(path, jobs, start, end)
+    stats = SamStats(accumulator_factory() if accumulator_factory is not None else None)
+    if not ranges:
+        return stats
+    if jobs <= 1 or len(ranges) == 1:
+        for start, end in ranges:
+            stats.merge(analyse_range(path, start, end, accumulator_factory))
+        return stats
+    from concurrent.futures import ProcessPoolExecutor  # Only loaded when a pool is needed.
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(analyse_range, path, start, end, accumulator_factory) for start, end in ranges]
+        for future in futures:  # Merge in submission (file) order for deterministic results.
+            stats.merge(future.result())
+    return stats
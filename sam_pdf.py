@@ -0,0 +1,148 @@
+import hashlib  # Fingerprints of the statistics behind each plot.
+import json  # Plot manifest written next to the images.
+import os  # Library to manage files and directories.
+import pickle  # Serialization of the plotted statistics before hashing.
+
+# ==========================================================================
+# PDF report assembly
+#
+# Plots:
+#   - report_figure() keeps one matplotlib figure per plot type and clears
+#     it for the next report instead of creating a new one, so batch runs
+#     and several filter sets never pile up open figures;
+#   - save_figure() writes the PNG at no more than PAGE_DPI once scaled to
+#     the IMAGE_WIDTH_MM it is given in the PDF (the pixels the page cannot
+#     show are never rendered, compressed or embedded), and without an alpha
+#     channel, which fpdf would otherwise split off pixel by pixel;
+#   - PlotCache records, in <name>_plots.json, a hash of the statistics each
+#     image was drawn from: a plot whose statistics did not change since
+#     the last report on the same prefix is not drawn again.
+# Tables are written by PdfReport in chunks of TABLE_CHUNK_ROWS rows, each
+# one a single monospaced text block that starts on a new page when it does
+# not fit, with the headers repeated: the cost of a table grows with its
+# chunks, not with a cell per row, and long chromosome lists stay readable.
+# ==========================================================================
+
+PAGE_DPI = 150  # Resolution of the plots on the page.
+IMAGE_WIDTH_MM = 190  # Width of the plots in the PDF (A4 minus the margins).
+TABLE_CHUNK_ROWS = 50  # Table rows per text block (and at most per page).
+MAX_CELL_WIDTH = 32  # Characters of a table cell; longer values are cut.
+LINE_HEIGHT_MM = 4.5
+PLOTS_VERSION = 1  # Part of every plot hash: bump when the drawing code changes.
+MANIFEST_SUFFIX = "_plots.json"
+
+
+# ==========================================================================
+# Plots
+# ==========================================================================
+def report_figure(key, figsize):
+    # The figure of a plot type (created on first use, then reused), cleared and sized.
+    import matplotlib.pyplot as plt  # Loaded on first use: stats-only runs never pay for it.
+    figure = plt.figure(num=key, figsize=figsize)
+    figure.clf()
+    figure.set_size_inches(figsize)
+    return figure
+
+
+def save_figure(figure, path):
+    # Writes the figure downsampled to the resolution of the page as an RGB PNG, then drops its artists.
+    # fpdf splits the alpha channel of an RGBA PNG pixel by pixel in Python; an RGB PNG is embedded as is.
+    import io
+    from PIL import Image  # Installed with matplotlib.
+    dpi = min(figure.dpi, PAGE_DPI * IMAGE_WIDTH_MM / 25.4 / figure.get_figwidth())
+    buffer = io.BytesIO()
+    figure.savefig(buffer, dpi=dpi, format="png", facecolor="white")
+    figure.clf()
+    buffer.seek(0)
+    with Image.open(buffer) as image:
+        image.convert("RGB").save(path, format="png")
+    return path
+
+
+def plot_digest(plot, data, name):
+    # Hash of everything a plot image depends on: the drawing function, the statistics and the title.
+    digest = hashlib.sha1(f"{PLOTS_VERSION}:{PAGE_DPI}:{plot.__module__}.{plot.__qualname__}:"
+                          f"{os.path.basename(name)}".encode())
+    digest.update(pickle.dumps(data, protocol=4))
+    return digest.hexdigest()
+
+
+class PlotCache:
+    # {image suffix: hash of its statistics} of the plots drawn for an output prefix.
+    def __init__(self, name):
+        self.path = name + MANIFEST_SUFFIX
+        try:
+            with open(self.path) as file:
+                self.digests = json.load(file)
+        except (OSError, ValueError):
+            self.digests = {}
+
+    def fresh(self, image, suffix, digest):
+        # True when the image on disk was drawn from the same statistics.
+        return self.digests.get(suffix) == digest and os.path.exists(image)
+
+    def record(self, suffix, digest):
+        self.digests[suffix] = digest
+
+    def save(self):
+        with open(self.path, "w") as file:
+            json.dump(self.digests, file, indent=1)
+
+
+# ==========================================================================
+# Tables and pages
+# ==========================================================================
+def format_cell(value):
+    text = str(value)
+    return text if len(text) <= MAX_CELL_WIDTH else text[:MAX_CELL_WIDTH - 1] + "~"
+
+
+def table_chunks(headers, rows, chunk_rows=TABLE_CHUNK_ROWS):
+    # Yields the text blocks of a table: chunk_rows aligned rows under the headers each.
+    cells = [[format_cell(value) for value in row] for row in rows]
+    header_cells = [format_cell(header) for header in headers]
+    widths = [max([len(header)] + [len(row[index]) for row in cells if index < len(row)])
+              for index, header in enumerate(header_cells)]
+    header_line = "  ".join(header.ljust(width) for header, width in zip(header_cells, widths)).rstrip()
+    rule = "  ".join("-" * width for width in widths)
+    for start in range(0, max(len(cells), 1), chunk_rows):
+        lines = [header_line, rule]
+        lines += ["  ".join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip()
+                  for row in cells[start:start + chunk_rows]]
+        yield start, "\n".join(lines)
+
+
+class PdfReport:
+    def __init__(self, title):
+        from fpdf import FPDF  # Loaded on first use: stats-only runs never pay for it.
+        self.pdf = FPDF()
+        self.pdf.set_auto_page_break(True, margin=15)
+        self.pdf.add_page()
+        self.pdf.set_font("Arial", 'B', size=14)
+        self.pdf.cell(0, 10, txt=title, ln=True, align='C')
+        self.pdf.ln(5)
+
+    def heading(self, text):
+        self.pdf.set_font("Arial", 'B', size=12)
+        self.pdf.cell(0, 8, txt=text, ln=True, align='L')
+
+    def table(self, title, headers, rows, chunk_rows=TABLE_CHUNK_ROWS):
+        # Writes a table block by block; a block that does not fit on the page starts a new one.
+        pdf = self.pdf
+        for start, text in table_chunks(headers, rows, chunk_rows):
+            height = (text.count("\n") + 1) * LINE_HEIGHT_MM + 10
+            if pdf.get_y() + height > pdf.page_break_trigger:
+                pdf.add_page()
+            self.heading(title if start == 0 else f"{title} (continued)")
+            pdf.set_font("Courier", size=8)
+            pdf.multi_cell(0, LINE_HEIGHT_MM, txt=text)
+            pdf.ln(4)
+
+    def image(self, path):
+        pdf = self.pdf
+        pdf.image(path, x=(pdf.w - IMAGE_WIDTH_MM) / 2, w=IMAGE_WIDTH_MM)  # New page when it does not fit.
+        pdf.ln(5)
+
+    def output(self, path):
+        self.pdf.output(path)
+        return path
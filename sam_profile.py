@@ -0,0 +1,253 @@
+import importlib  # Loads monitoring hooks given on the command line.
+import json  # The timing report is a JSON file.
+import os  # CPU time of the worker processes.
+import sys  # Progress line on the standard error.
+import time  # Wall-clock and CPU timers.
+from contextlib import contextmanager, nullcontext  # Stage timers.
+
+# ==========================================================================
+# Stage timing, throughput progress and memory instrumentation
+#
+# A Profiler times named stages (wall time, CPU time of this process and of
+# its worker processes, peak RSS, and with trace_memory the peak of Python
+# allocations), shows a live records/s and bytes/s line while the file is
+# parsed, and writes everything as a JSON report. Accumulators can be wrapped
+# in TimedAccumulator to split the single parsing pass into the time spent
+# reading records and the time spent in each statistic.
+#
+# Monitoring systems plug in through hooks: any object with some of the
+# ProfileHook methods, e.g. given as --profile-hook mymodule:MyHook.
+# ==========================================================================
+
+PROGRESS_INTERVAL = 0.5  # Seconds between two progress updates.
+
+
+class ProfileHook:
+    # Base class of the monitoring hooks; override the methods you need.
+    def on_stage_start(self, name):
+        pass
+
+    def on_stage_end(self, stage):
+        # stage: {"name", "wall_seconds", "cpu_seconds", "peak_rss", ...}
+        pass
+
+    def on_progress(self, progress):
+        # progress: {"records", "bytes", "elapsed", "records_per_sec", "bytes_per_sec"}
+        pass
+
+    def on_finish(self, report):
+        # report: the dict written by Profiler.write().
+        pass
+
+
+def load_hook(spec):
+    # "package.module:Name" -> instance of Name (or result of calling it).
+    module_name, _, attribute = spec.partition(":")
+    if not attribute:
+        raise ValueError(f"Invalid hook '{spec}', expected 'module:attribute'.")
+    hook = getattr(importlib.import_module(module_name), attribute)
+    return hook() if callable(hook) else hook
+
+
+def peak_rss():
+    # Peak resident memory of this process in bytes (None where the resource module is missing).
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024  # Kilobytes on Linux.
+
+
+def cpu_time():
+    # CPU time (user + system) of this process and of its finished children.
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def format_bytes(size):
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.1f} {unit}"
+        size /= 1024
+
+
+class Profiler:
+    enabled = True
+
+    def __init__(self, hooks=(), progress_stream=sys.stderr, trace_memory=False):
+        self.hooks = list(hooks)
+        self.progress_stream = progress_stream  # None: no live progress line.
+        self.trace_memory = trace_memory
+        self.stages = []
+        self.started = time.perf_counter()
+        self.started_cpu = cpu_time()
+        if trace_memory:
+            import tracemalloc
+            tracemalloc.start()
+
+    def notify(self, method, *arguments):
+        for hook in self.hooks:
+            callback = getattr(hook, method, None)
+            if callback is not None:
+                callback(*arguments)
+
+    @contextmanager
+    def stage(self, name, **info):
+        # Times the body of the with block as one stage; info is copied into the report.
+        self.notify("on_stage_start", name)
+        if self.trace_memory:
+            import tracemalloc
+            tracemalloc.reset_peak()
+        wall, cpu = time.perf_counter(), cpu_time()
+        entry = {"name": name}
+        entry.update(info)
+        try:
+            yield entry  # The body may add fields (e.g. records).
+        finally:
+            entry["wall_seconds"] = round(time.perf_counter() - wall, 6)
+            entry["cpu_seconds"] = round(cpu_time() - cpu, 6)
+            entry["peak_rss"] = peak_rss()
+            if self.trace_memory:
+                entry["python_peak"] = tracemalloc.get_traced_memory()[1]
+            self.stages.append(entry)
+            self.notify("on_stage_end", entry)
+
+    def add_stage(self, name, wall_seconds, **info):
+        # Records a stage measured elsewhere (e.g. the time spent in one accumulator).
+        entry = {"name": name, "wall_seconds": round(wall_seconds, 6)}
+        entry.update(info)
+        self.stages.append(entry)
+        self.notify("on_stage_end", entry)
+
+    def track(self, records, position=None, total_bytes=None):
+        # Yields the records while showing records/s (and bytes/s when position() gives the bytes read).
+        count = 0
+        started = last = time.perf_counter()
+        for record in records:
+            count += 1
+            yield record
+            if count & 0x3fff == 0:  # Look at the clock every 16384 records only.
+                now = time.perf_counter()
+                if now - last >= PROGRESS_INTERVAL:
+                    last = now
+                    self.progress(count, position() if position else None, now - started, total_bytes)
+        self.progress(count, position() if position else None, time.perf_counter() - started, total_bytes,
+                      final=True)
+
+    def track_blocks(self, blocks, total_bytes=None):
+        # Yields sam_mmap.ColumnBlock objects while showing records/s and bytes/s, as track() does for records.
+        count = read_bytes = 0
+        started = last = time.perf_counter()
+        for block in blocks:
+            count += len(block)
+            read_bytes += len(block.block)
+            yield block
+            now = time.perf_counter()
+            if now - last >= PROGRESS_INTERVAL:
+                last = now
+                self.progress(count, read_bytes, now - started, total_bytes)
+        self.progress(count, read_bytes, time.perf_counter() - started, total_bytes, final=True)
+
+    def progress(self, records, read_bytes, elapsed, total_bytes=None, final=False):
+        elapsed = max(elapsed, 1e-9)
+        progress = {"records": records, "bytes": read_bytes, "elapsed": round(elapsed, 3),
+                    "records_per_sec": round(records / elapsed),
+                    "bytes_per_sec": round(read_bytes / elapsed) if read_bytes is not None else None}
+        self.notify("on_progress", progress)
+        if self.progress_stream is None:
+            return
+        line = f"\rParsing: {records:,} records ({progress['records_per_sec']:,} rec/s)"
+        if read_bytes is not None:
+            line += f", {format_bytes(read_bytes)} ({format_bytes(progress['bytes_per_sec'])}/s)"
+            if total_bytes:
+                line += f", {min(read_bytes / total_bytes, 1) * 100:.0f}%"
+        self.progress_stream.write(line + ("\n" if final else ""))
+        self.progress_stream.flush()
+
+    def report(self):
+        return {
+            "stages": self.stages,
+            "total_wall_seconds": round(time.perf_counter() - self.started, 6),
+            "total_cpu_seconds": round(cpu_time() - self.started_cpu, 6),
+            "peak_rss": peak_rss(),
+        }
+
+    def write(self, path):
+        report = self.report()
+        self.notify("on_finish", report)
+        with open(path, "w") as file:
+            json.dump(report, file, indent=2)
+        return report
+
+
+class NullProfiler:
+    # Stand-in used when profiling is off: stages and tracking cost nothing.
+    enabled = False
+
+    def stage(self, name, **info):
+        return nullcontext({})
+
+    def add_stage(self, name, wall_seconds, **info):
+        pass
+
+    def track(self, records, position=None, total_bytes=None):
+        return records
+
+    def track_blocks(self, blocks, total_bytes=None):
+        return blocks
+
+
+NULL_PROFILER = NullProfiler()
+
+
+# ==========================================================================
+# Time spent in each statistic of the single parsing pass
+# ==========================================================================
+class TimedAccumulator:
+    # Wraps an accumulator and adds up the time spent in its add() method.
+    def __init__(self, accumulator):
+        self.accumulator = accumulator
+        self.name = accumulator.name
+        self.seconds = 0.0
+
+    def add(self, record):
+        started = time.perf_counter()
+        self.accumulator.add(record)
+        self.seconds += time.perf_counter() - started
+
+    @property
+    def add_columns(self):
+        # Timed add_columns() of the wrapped accumulator (sam_mmap.py column blocks), None if it has none.
+        add_columns = getattr(self.accumulator, "add_columns", None)
+        if add_columns is None:
+            return None
+
+        def timed(columns):
+            started = time.perf_counter()
+            add_columns(columns)
+            self.seconds += time.perf_counter() - started
+        return timed
+
+    def merge(self, other):
+        self.accumulator.merge(other.accumulator)
+        self.seconds += other.seconds
+
+    def __getattr__(self, attribute):  # result(), to_dict() and the accumulator fields.
+        if attribute == "accumulator":  # Not set yet (unpickling): avoid infinite recursion.
+            raise AttributeError(attribute)
+        return getattr(self.accumulator, attribute)
+
+
+def timed_accumulators(accumulator_factory):
+    # Picklable factory (use with functools.partial) of timed accumulators.
+    return [TimedAccumulator(acc) for acc in accumulator_factory()]
+
+
+def untime_stats(stats, profiler, stage_name):
+    # Reports the time of each TimedAccumulator of stats as a sub-stage, then unwraps them.
+    for name, acc in list(stats.accumulators.items()):
+        if isinstance(acc, TimedAccumulator):
+            profiler.add_stage(f"{stage_name}:{name}", acc.seconds, parent=stage_name)
+            stats.accumulators[name] = acc.accumulator
+    return stats
@@ -0,0 +1,135 @@
+import json  # Machine-readable output.
+from sam_stats import (default_accumulators, summary_table, chromosome_table, quality_table,
+                       SUMMARY_HEADERS, CHROMOSOME_HEADERS, QUALITY_HEADERS)
+from sam_cigar import (CigarStats, cigar_table, clip_table, aligned_fraction_table,
+                       CIGAR_HEADERS, CLIP_HEADERS, ALIGNED_FRACTION_HEADERS)
+
+# ==========================================================================
+# Report tables shared by analyse_sam.py and the batch mode
+# ==========================================================================
+
+
+def report_accumulators(references, duplicates="exact", bloom_mb=None, duplicate_qnames=None, depth=False,
+                        sequences=False):
+    # Every statistic of the report, computed in the same pass over the file.
+    # references: [(name, length), ...] from the @SQ header lines.
+    # duplicates: "exact", "bloom" or "off" (see sam_duplicates.py); duplicate_qnames: file of duplicate QNAMEs.
+    # depth: also compute the per-base depth (about 4 bytes per covered reference base, see sam_depth.py);
+    # the plots only need the binned coverage.
+    # sequences: also compute the SEQ/QUAL statistics (see sam_sequence.py), which about double the parsing time.
+    from sam_bins import BinnedCoverage
+    accumulators = default_accumulators() + [CigarStats(), BinnedCoverage(references)]
+    if sequences:
+        from sam_sequence import SequenceStats
+        accumulators.append(SequenceStats())
+    if depth:
+        from sam_depth import DepthCoverage  # NumPy is only loaded when the depth is computed.
+        accumulators.append(DepthCoverage(references))
+    if duplicates != "off":
+        from sam_duplicates import DuplicateStats, DEFAULT_BLOOM_MB
+        accumulators.append(DuplicateStats(duplicates, bloom_mb or DEFAULT_BLOOM_MB, duplicate_qnames))
+    return accumulators
+
+
+def depth_section(stats):
+    from sam_depth import depth_table, DEPTH_HEADERS
+    return DEPTH_HEADERS, depth_table(stats)
+
+
+def sequence_section(table, headers):
+    # Builder of a section of sam_sequence.py (NumPy is only loaded when it is rendered).
+    def build(stats):
+        import sam_sequence
+        return getattr(sam_sequence, headers), getattr(sam_sequence, table)(stats)
+    return build
+
+
+def duplicate_section(table, headers):
+    # Builder of a section of sam_duplicates.py.
+    def build(stats):
+        import sam_duplicates
+        return getattr(sam_duplicates, headers), getattr(sam_duplicates, table)(stats)
+    return build
+
+
+# (title, accumulator needed, builder returning (headers, rows)), in display order.
+REPORT_SECTIONS = [
+    ("Summary Statistics", "reads", lambda stats: (SUMMARY_HEADERS, summary_table(stats))),
+    ("Chromosome Coverage Statistics", "chromosomes", lambda stats: (CHROMOSOME_HEADERS, chromosome_table(stats))),
+    ("Depth Coverage Statistics", "depth", depth_section),
+    ("Quality Count Statistics", "quality", lambda stats: (QUALITY_HEADERS, quality_table(stats))),
+    ("CIGAR Statistics", "cigar", lambda stats: (CIGAR_HEADERS, cigar_table(stats))),
+    ("Clip Length Distribution", "cigar", lambda stats: (CLIP_HEADERS, clip_table(stats))),
+    ("Aligned Fraction Distribution", "cigar", lambda stats: (ALIGNED_FRACTION_HEADERS, aligned_fraction_table(stats))),
+    ("Sequence Statistics", "sequence", sequence_section("sequence_table", "SEQUENCE_HEADERS")),
+    ("Per-Cycle Quality", "sequence", sequence_section("cycle_quality_table", "CYCLE_QUALITY_HEADERS")),
+    ("Read Quality Distribution", "sequence", sequence_section("read_quality_table", "READ_QUALITY_HEADERS")),
+    ("GC Content Distribution", "sequence", sequence_section("gc_content_table", "GC_CONTENT_HEADERS")),
+    ("Read Length Distribution", "sequence", sequence_section("read_length_table", "READ_LENGTH_HEADERS")),
+    ("Duplicate Statistics", "duplicates", duplicate_section("duplicate_table", "DUPLICATE_HEADERS")),
+    ("Duplicates per Chromosome", "duplicates",
+     duplicate_section("duplicate_reference_table", "DUPLICATE_REFERENCE_HEADERS")),
+]
+PDF_SECTIONS = ["Filter", "Summary Statistics", "Chromosome Coverage Statistics", "Depth Coverage Statistics",
+                "Sequence Statistics", "Duplicate Statistics"]
+
+
+def report_tables(stats):
+    # Returns {title: (headers, rows)} for every section whose statistics were computed.
+    return {title: builder(stats) for title, needed, builder in REPORT_SECTIONS if needed in stats}
+
+
+def format_report(tables):
+    # Renders the tables as the text printed by analyse_sam.py.
+    from tabulate import tabulate  # Only the text output needs it.
+    parts = []
+    for title, (headers, rows) in tables.items():
+        parts.append(f"\n===== {title} =====")
+        parts.append(tabulate(rows, headers=headers, tablefmt="grid"))
+    return "\n".join(parts)
+
+
+# ==========================================================================
+# Machine-readable output
+# ==========================================================================
+SECTION_KEYS = {
+    "Sampling": "sampling",
+    "Filter": "filter",
+    "Summary Statistics": "summary",
+    "Chromosome Coverage Statistics": "chromosomes",
+    "Depth Coverage Statistics": "depth",
+    "Quality Count Statistics": "quality",
+    "CIGAR Statistics": "cigar",
+    "Clip Length Distribution": "clips",
+    "Aligned Fraction Distribution": "aligned_fraction",
+    "Sequence Statistics": "sequence",
+    "Per-Cycle Quality": "cycle_quality",
+    "Read Quality Distribution": "read_quality",
+    "GC Content Distribution": "gc_content",
+    "Read Length Distribution": "read_length",
+    "Duplicate Statistics": "duplicates",
+    "Duplicates per Chromosome": "duplicate_references",
+}
+
+
+def tables_to_dict(tables):
+    # {"summary": [{header: value, ...}, ...], "chromosomes": [...], ...}
+    return {SECTION_KEYS.get(title, title): [dict(zip(headers, row)) for row in rows]
+            for title, (headers, rows) in tables.items()}
+
+
+def tables_to_json(tables):
+    return json.dumps(tables_to_dict(tables), indent=2)
+
+
+def tables_to_tsv(tables):
+    # One block per table: "# <section>", a header line, then the rows.
+    lines = []
+    for title, (headers, rows) in tables.items():
+        lines.append(f"# {SECTION_KEYS.get(title, title)}")
+        lines.append("\t".join(headers))
+        lines.extend("\t".join(str(value) for value in row) for row in rows)
+    return "\n".join(lines)
+
+
+OUTPUT_FORMATS = {"text": format_report, "json": tables_to_json, "tsv": tables_to_tsv}
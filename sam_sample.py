@@ -0,0 +1,285 @@
+import math  # Reservoir skips and confidence intervals.
+import os  # Library to manage files and directories.
+import random  # Reservoir and stride positions (seeded: same seed, same sample).
+import zlib  # CRC-32 of the QNAME: a hash that is the same in every run.
+from sam_io import is_compressed, iter_sam_records, parse_sam_lines  # Streaming SAM/BAM reader.
+from sam_parallel import align_to_line, find_body_offset  # Newline-aligned offsets, start of the body.
+from sam_stats import SamStats, summary_table, quality_table, percentage  # Single-pass statistics engine.
+
+# ==========================================================================
+# Approximate analysis on a sample of the reads
+#
+# --sample takes a fraction (0.01 or 1%) or a number of reads (100000):
+#   - stride (plain SAM files): a few hundred windows spread over the file
+#     are read through the memory map, the rest is never touched, so a 1%
+#     sample costs about 1% of the I/O and parsing,
+#   - hash (fraction): a read is kept when the CRC-32 of its QNAME falls
+#     under the fraction, so both mates of a pair are kept or dropped
+#     together; the whole input is read but only the kept lines are parsed,
+#   - reservoir (count): uniform sample of that many reads (Algorithm L),
+#     only the kept lines are parsed.
+# The summary and MAPQ tables then give every percentage with its 95%
+# confidence interval, and the totals extrapolated to the whole file.
+# ==========================================================================
+
+SAMPLE_METHODS = ["auto", "stride", "hash", "reservoir"]
+STRIDE_WINDOWS = 256  # Windows read by the stride method.
+MIN_WINDOW = 1 << 16  # Smallest window (bytes) below STRIDE_WINDOWS windows: shorter reads are dominated by the seeks.
+Z_95 = 1.959964  # Normal quantile of a 95% two-sided interval.
+
+
+class SampleInfo:
+    # How a sample was drawn, filled in while it is read.
+    def __init__(self, method):
+        self.method = method
+        self.sampled = 0  # Reads in the sample.
+        self.seen = None  # Reads in the file, when the whole file was read.
+        self.fraction = None  # Share of the file that was sampled.
+        self.windows = []  # Stride method: [(reads, {statistic: reads}), ...] of each window.
+
+    @property
+    def estimated_total(self):
+        if self.seen is not None:
+            return self.seen
+        return round(self.sampled / self.fraction) if self.fraction else 0
+
+
+def parse_sample(text):
+    # "0.01" or "1%" -> (0.01, None); "100000" -> (None, 100000).
+    value = text.strip()
+    try:
+        if value.endswith("%"):
+            fraction, count = float(value[:-1]) / 100, None
+        elif float(value) < 1:
+            fraction, count = float(value), None
+        else:
+            fraction, count = None, int(value)
+    except ValueError:
+        raise ValueError(f"invalid --sample '{text}', expected a fraction (0.01 or 1%) or a number of reads.")
+    if fraction is not None and not 0 < fraction <= 1:
+        raise ValueError(f"invalid --sample '{text}', the fraction must be between 0 and 1.")
+    return fraction, count
+
+
+def choose_method(path, fraction, count, method="auto"):
+    # Resolves "auto" and rejects the combinations a method cannot do.
+    compressed = is_compressed(path)
+    if method == "auto":
+        method = "stride" if not compressed else "hash" if fraction is not None else "reservoir"
+    if method == "stride" and compressed:
+        raise ValueError("stride sampling needs an uncompressed SAM file, use --sample-method hash or reservoir.")
+    if method == "hash" and fraction is None:
+        raise ValueError("hash sampling needs a fraction (e.g. --sample 1%).")
+    if method == "reservoir" and count is None:
+        raise ValueError("reservoir sampling needs a number of reads (e.g. --sample 100000).")
+    return method
+
+
+# ==========================================================================
+# Samplers
+# ==========================================================================
+def hash_sample(lines, fraction, info):
+    # Alignment lines whose QNAME hash is below the fraction (mates share the QNAME).
+    threshold = int(fraction * (1 << 32))
+    crc32 = zlib.crc32
+    seen = 0
+    for line in lines:
+        if line.startswith("@"):
+            continue
+        seen += 1
+        if crc32(line[:line.find("\t")].encode()) < threshold:
+            yield line
+    info.seen = seen
+
+
+def hash_sample_records(records, fraction, info):
+    # Same as hash_sample on SamRecord objects (compressed input).
+    threshold = int(fraction * (1 << 32))
+    crc32 = zlib.crc32
+    seen = 0
+    for record in records:
+        seen += 1
+        if crc32(record.qname.encode()) < threshold:
+            yield record
+    info.seen = seen
+
+
+def reservoir_sample(items, count, info, seed=0):
+    # Uniform sample of `count` items (Algorithm L: a random number per kept item, not per item).
+    rng = random.Random(seed)
+    reservoir = []
+    seen = skip = 0
+    weight = 1.0
+    for item in items:
+        if isinstance(item, str) and item.startswith("@"):
+            continue
+        seen += 1
+        if seen <= count:
+            reservoir.append(item)
+            if seen == count:
+                weight = math.exp(math.log(rng.random()) / count)
+                skip = math.floor(math.log(rng.random()) / math.log(1 - weight))
+            continue
+        if skip:
+            skip -= 1
+            continue
+        reservoir[rng.randrange(count)] = item
+        weight *= math.exp(math.log(rng.random()) / count)
+        skip = math.floor(math.log(rng.random()) / math.log(1 - weight))
+    info.seen = seen
+    return reservoir
+
+
+def stride_windows(path, fraction=None, count=None, windows=STRIDE_WINDOWS, seed=0):
+    # Newline-aligned (start, end) byte ranges covering about `fraction` of the body (or `count` reads),
+    # one at a random position in each of `windows` equal strides. Returns (ranges, body bytes).
+    start, size = find_body_offset(path), os.path.getsize(path)
+    body = size - start
+    if count is not None:  # Reads -> bytes, from the mean line length of the first megabyte.
+        with open(path, "rb") as file:
+            file.seek(start)
+            head = file.read(1 << 20)
+        line_bytes = len(head) / max(head.count(b"\n"), 1)
+        fraction = count * line_bytes / body if body else 1
+    windows = max(min(windows, int(body * fraction) // MIN_WINDOW), 1)  # Fewer windows for small samples.
+    window = max(int(body * fraction / windows), 1)
+    if window * windows >= body:  # The sample is the whole file.
+        return [(start, size)], body
+    rng = random.Random(seed)
+    stride = body / windows
+    ranges = []
+    with open(path, "rb") as file:
+        for i in range(windows):
+            offset = start + int(i * stride + rng.random() * (stride - window))
+            first = align_to_line(file, offset, size)
+            last = align_to_line(file, offset + window, size)
+            if first < last and (not ranges or first >= ranges[-1][1]):
+                ranges.append((first, last))
+    return ranges, body
+
+
+def sample_counts(stats):
+    # {(table, row): reads} of the summary and MAPQ tables, to follow them window by window.
+    counts = {("summary", row[0]): row[1] for row in summary_table(stats)}
+    counts.update({("quality", row[0]): row[1] for row in quality_table(stats)})
+    return counts
+
+
+def stride_stats(path, stats, fraction=None, count=None, info=None, seed=0):
+    # Feeds the stride windows to stats, noting the reads of each window for the confidence intervals.
+    from sam_mmap import iter_column_blocks, iter_mmap_lines  # Memory-mapped reads (NumPy) of the stride windows.
+    ranges, body = stride_windows(path, fraction, count, seed=seed)
+    columns = all(getattr(acc, "add_columns", None) is not None for acc in stats.accumulators.values())
+    before = {}
+    for start, end in ranges:
+        if columns:
+            stats.update_columns(iter_column_blocks(path, start, end))
+        else:
+            stats.update(parse_sam_lines(iter_mmap_lines(path, start, end)))
+        after = sample_counts(stats)
+        info.windows.append((after[("summary", "Total Reads")] - before.get(("summary", "Total Reads"), 0),
+                             {key: value - before.get(key, 0) for key, value in after.items()}))
+        before = after
+    info.fraction = sum(end - start for start, end in ranges) / body if body else 1
+    return stats
+
+
+def sampled_stats(path, accumulators=None, fraction=None, count=None, method="auto", seed=0, threads=None):
+    # Statistics of a sample of the file. Returns (SamStats, SampleInfo).
+    method = choose_method(path, fraction, count, method)
+    info = SampleInfo(method)
+    stats = SamStats(accumulators)
+    if method == "stride":
+        stride_stats(path, stats, fraction, count, info, seed)
+    elif is_compressed(path):
+        records = iter_sam_records(path, threads)
+        if method == "hash":
+            stats.update(hash_sample_records(records, fraction, info))
+        else:
+            stats.update(reservoir_sample(records, count, info, seed))
+    else:
+        with open(path, "r") as file:
+            if method == "hash":
+                stats.update(parse_sam_lines(hash_sample(file, fraction, info)))
+            else:
+                stats.update(parse_sam_lines(reservoir_sample(file, count, info, seed)))
+    info.sampled = stats["reads"].total
+    if info.seen is not None:
+        info.fraction = info.sampled / info.seen if info.seen else 1
+    return stats, info
+
+
+# ==========================================================================
+# Confidence intervals and sampled report tables
+# ==========================================================================
+def wilson_interval(hits, total, z=Z_95):
+    # Wilson score interval of the proportion hits / total (independent reads).
+    if not total:
+        return 0.0, 1.0
+    p = hits / total
+    denominator = 1 + z * z / total
+    centre = (p + z * z / (2 * total)) / denominator
+    margin = z * math.sqrt(p * (1 - p) / total + z * z / (4 * total * total)) / denominator
+    return max(centre - margin, 0.0), min(centre + margin, 1.0)
+
+
+def cluster_interval(windows, key, z=Z_95):
+    # Normal interval of a ratio estimated from clusters of reads (the stride windows): the spread
+    # between windows is used, since reads next to each other in a file are not independent.
+    hits = sum(counts.get(key, 0) for _, counts in windows)
+    total = sum(reads for reads, _ in windows)
+    p = hits / total
+    mean_reads = total / len(windows)
+    variance = sum((counts.get(key, 0) - p * reads) ** 2 for reads, counts in windows) / (
+        len(windows) * (len(windows) - 1) * mean_reads * mean_reads)
+    margin = z * math.sqrt(variance)
+    return max(p - margin, 0.0), min(p + margin, 1.0)
+
+
+def interval_text(info, key, hits, total):
+    if key == ("summary", "Total Reads"):  # 100% by definition.
+        return "-"
+    if info.fraction == 1:  # The whole file was read: the value is exact.
+        return "exact"
+    if len(info.windows) > 1 and total:
+        low, high = cluster_interval(info.windows, key)
+    else:
+        low, high = wilson_interval(hits, total)
+    return f"{low * 100:.2f}% - {high * 100:.2f}%"
+
+
+def sampled_rows(info, table, rows, total):
+    # [name, sampled reads, estimated reads in the file, percentage, 95% CI] for every row.
+    estimated = info.estimated_total
+    return [[name, value, round(value / total * estimated) if total else 0, percentage(value, total),
+             interval_text(info, (table, name), value, total)] for name, value in rows]
+
+
+def sampling_table(info):
+    rows = [["Method", info.method], ["Sampled Reads", info.sampled],
+            ["Reads in File" if info.seen is not None else "Reads in File (estimated)", info.estimated_total],
+            ["Sampled Fraction", percentage(info.fraction or 0, 1)]]
+    if info.windows:
+        rows.append(["Windows", len(info.windows)])
+    return rows
+
+
+SAMPLING_HEADERS = ["Sampling", "Value"]
+SAMPLED_SUMMARY_HEADERS = ["Statistic", "Sample", "Estimated Total", "Percentage", "95% CI"]
+SAMPLED_QUALITY_HEADERS = ["Interval", "Sample", "Estimated Total", "Percentage", "95% CI"]
+
+
+def sampled_tables(tables, stats, info):
+    # Report tables of a sample: the sampling details first, then the summary and MAPQ tables with
+    # extrapolated totals and confidence intervals; the other tables describe the sample as is.
+    total = stats["reads"].total
+    summary = [row[:2] for row in summary_table(stats)]
+    quality = [[row[0], row[1]] for row in quality_table(stats)]
+    result = {"Sampling": (SAMPLING_HEADERS, sampling_table(info))}
+    for title, section in tables.items():
+        if title == "Summary Statistics":
+            section = (SAMPLED_SUMMARY_HEADERS, sampled_rows(info, "summary", summary, total))
+        elif title == "Quality Count Statistics":
+            section = (SAMPLED_QUALITY_HEADERS, sampled_rows(info, "quality", quality, total))
+        result[title] = section
+    return result
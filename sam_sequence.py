@@ -0,0 +1,309 @@
+import numpy as np  # Whole blocks of SEQ/QUAL bytes are processed as arrays.
+
+# ==========================================================================
+# Per-cycle base quality and sequence composition
+#
+# SEQ and QUAL are never split into characters in Python: the bytes of a
+# block of reads are viewed as a uint8 array (np.frombuffer), gathered into
+# a (reads x cycles) matrix, and every statistic is a NumPy reduction over
+# that matrix. Reverse-strand reads are read right to left, so a column of
+# the matrix is a sequencing cycle. Reads of very different lengths get
+# separate matrices (the longest read of a matrix is at most twice the
+# shortest), so one long read does not widen the matrix of every short read
+# of its block: memory grows with the bases, not reads x longest read. Only
+# primary alignments are counted (secondary and supplementary lines repeat
+# the same read).
+#
+# Everything is kept as histograms (quality per cycle, mean quality per
+# read, GC%, read length), so the accumulator merges by adding arrays and
+# quantiles are read off the cumulative counts.
+# ==========================================================================
+
+PHRED_OFFSET = 33  # QUAL is Phred + 33.
+QUALITY_BINS = 94  # Phred 0-93, the range of printable QUAL characters.
+BATCH_SIZE = 8192  # Records buffered by add() before a NumPy pass.
+SECONDARY_OR_SUPPLEMENTARY = 256 | 2048
+REVERSE = 16
+QUANTILES = (0.10, 0.25, 0.50, 0.75, 0.90)
+STAR = ord("*")
+BASE_G, BASE_C, BASE_N = ord("g"), ord("c"), ord("n")
+
+
+def grow(histogram, length):
+    # histogram padded with zero rows up to `length` entries along the first axis.
+    if len(histogram) >= length:
+        return histogram
+    padding = [(0, length - len(histogram))] + [(0, 0)] * (histogram.ndim - 1)
+    return np.pad(histogram, padding)
+
+
+def cycle_matrix(windows, pad, width, starts, lengths, reverse):
+    # (reads x width) uint8 matrix: row r, column c is cycle c of read r; columns past the end of a read
+    # hold neighbouring bytes. windows: sliding window view (width bytes) of the data with `pad` bytes
+    # added on both sides, so a row is one slice copied by NumPy; reverse-strand rows are then flipped.
+    matrix = windows[np.where(reverse, starts + lengths - width, starts) + pad]
+    matrix[reverse] = matrix[reverse, ::-1]
+    return matrix
+
+
+class SequenceStats:
+    name = "sequence"
+
+    def __init__(self):
+        self.reads = 0  # Primary reads with a SEQ.
+        self.bases = 0
+        self.n_bases = 0
+        self.gc_bases = 0
+        self.cycle_quality = np.zeros((0, QUALITY_BINS), dtype=np.int64)  # [cycle, Phred] -> bases.
+        self.cycle_n = np.zeros(0, dtype=np.int64)  # [cycle] -> N bases.
+        self.read_quality = np.zeros(QUALITY_BINS, dtype=np.int64)  # [mean Phred of the read] -> reads.
+        self.gc_content = np.zeros(101, dtype=np.int64)  # [GC% of the read] -> reads.
+        self.lengths = np.zeros(0, dtype=np.int64)  # [read length] -> reads.
+        self._pending = ([], [], [])  # SEQ, QUAL and reverse flags buffered by add().
+
+    def add(self, record):
+        if record.flag & SECONDARY_OR_SUPPLEMENTARY or record.seq == "*":
+            return
+        seqs, quals, reverse = self._pending
+        seqs.append(record.seq)
+        quals.append(record.qual)
+        reverse.append(record.flag & REVERSE)
+        if len(seqs) >= BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        # NumPy pass over the records buffered by add().
+        seqs, quals, reverse = self._pending
+        if not seqs:
+            return
+        self._pending = ([], [], [])
+        seq_lengths = np.fromiter(map(len, seqs), dtype=np.int64, count=len(seqs))
+        qual_lengths = np.fromiter(map(len, quals), dtype=np.int64, count=len(quals))
+        seq_bytes = "".join(seqs).encode("latin-1")
+        data = np.frombuffer(seq_bytes + "".join(quals).encode("latin-1"), dtype=np.uint8)
+        seq_starts = np.cumsum(seq_lengths) - seq_lengths
+        qual_starts = np.cumsum(qual_lengths) - qual_lengths + len(seq_bytes)
+        self.add_reads(data, seq_starts, seq_lengths, qual_starts, qual_lengths,
+                       np.array(reverse, dtype=bool))
+
+    def add_columns(self, columns):
+        keep = (columns["flag"] & SECONDARY_OR_SUPPLEMENTARY) == 0
+        seq_starts, seq_ends = columns.bounds(9)
+        qual_starts, qual_ends = columns.bounds(10)
+        self.add_reads(columns.data, seq_starts[keep], (seq_ends - seq_starts)[keep],
+                       qual_starts[keep], (qual_ends - qual_starts)[keep], (columns["flag"][keep] & REVERSE) != 0)
+
+    def add_reads(self, data, seq_starts, seq_lengths, qual_starts, qual_lengths, reverse):
+        # data: uint8 array holding the SEQ and QUAL bytes at the given offsets.
+        has_seq = ~((seq_lengths == 1) & (data[np.minimum(seq_starts, len(data) - 1)] == STAR))
+        if not has_seq.all():
+            seq_starts, seq_lengths = seq_starts[has_seq], seq_lengths[has_seq]
+            qual_starts, qual_lengths, reverse = qual_starts[has_seq], qual_lengths[has_seq], reverse[has_seq]
+        if not len(seq_lengths):
+            return
+        width = int(seq_lengths.max())
+        self.reads += len(seq_lengths)
+        self.bases += int(seq_lengths.sum())
+        self.lengths = grow(self.lengths, width + 1)
+        self.lengths[:width + 1] += np.bincount(seq_lengths, minlength=width + 1)
+        if (seq_lengths == width).all():  # Usual case: every window lies inside the data, no copy.
+            self.add_length_group(data, 0, seq_starts, seq_lengths, qual_starts, qual_lengths, reverse)
+            return
+        # Mixed lengths: reads are taken in groups whose longest read is at most twice the shortest, so the
+        # matrices of a group hold at most about twice its bases, however long the longest read of the block.
+        data = np.concatenate([np.zeros(width, dtype=np.uint8), data, np.zeros(width, dtype=np.uint8)])
+        order = np.argsort(seq_lengths, kind="stable")
+        sorted_lengths = seq_lengths[order]
+        start = 0
+        while start < len(order):
+            end = int(np.searchsorted(sorted_lengths, max(2 * int(sorted_lengths[start]), 1), side="right"))
+            group = order[start:end]
+            self.add_length_group(data, width, seq_starts[group], seq_lengths[group], qual_starts[group],
+                                  qual_lengths[group], reverse[group])
+            start = end
+
+    def add_length_group(self, data, pad, seq_starts, seq_lengths, qual_starts, qual_lengths, reverse):
+        # Composition and quality of reads of similar lengths; data holds `pad` zero bytes on both sides
+        # (at least the longest read of the group when the lengths differ).
+        width = int(seq_lengths.max())
+        has_qual = qual_lengths == seq_lengths  # QUAL is "*" otherwise.
+        past_end = None if (seq_lengths == width).all() else np.arange(width) >= seq_lengths[:, None]
+        windows = np.lib.stride_tricks.sliding_window_view(data, width)
+
+        # Composition: GC% per read and N per cycle (bases lower-cased in place).
+        bases = cycle_matrix(windows, pad, width, seq_starts, seq_lengths, reverse)
+        if past_end is not None:
+            bases[past_end] = 0
+        bases |= 0x20
+        gc_per_read = np.count_nonzero((bases == BASE_G) | (bases == BASE_C), axis=1)
+        called = seq_lengths
+        n = bases == BASE_N
+        if n.any():
+            n_per_cycle = n.sum(axis=0, dtype=np.int64)
+            called = seq_lengths - np.count_nonzero(n, axis=1)
+            self.n_bases += int(n_per_cycle.sum())
+            self.cycle_n = grow(self.cycle_n, width)
+            self.cycle_n[:width] += n_per_cycle
+        self.gc_bases += int(gc_per_read.sum())
+        percent = np.rint(100 * gc_per_read[called > 0] / called[called > 0]).astype(np.int64)
+        self.gc_content += np.bincount(percent, minlength=101)
+
+        # Quality: one histogram bin per (cycle, Phred) pair.
+        if not has_qual.any():
+            return
+        if not has_qual.all():
+            qual_starts, qual_lengths, reverse = qual_starts[has_qual], qual_lengths[has_qual], reverse[has_qual]
+            past_end = None if past_end is None else past_end[has_qual]
+        quality = cycle_matrix(windows, pad, width, qual_starts, qual_lengths, reverse)
+        np.clip(quality, PHRED_OFFSET, PHRED_OFFSET + QUALITY_BINS - 1, out=quality)
+        quality -= PHRED_OFFSET
+        keys = quality + np.arange(width, dtype=np.int32) * QUALITY_BINS
+        if past_end is not None:
+            keys[past_end] = width * QUALITY_BINS  # Extra bin, dropped below.
+            quality[past_end] = 0
+        self.cycle_quality = grow(self.cycle_quality, width)
+        self.cycle_quality[:width] += np.bincount(keys.ravel(), minlength=width * QUALITY_BINS + 1)[
+            :width * QUALITY_BINS].reshape(width, QUALITY_BINS)
+        mean_quality = quality.sum(axis=1, dtype=np.int64) // qual_lengths
+        self.read_quality += np.bincount(mean_quality, minlength=QUALITY_BINS)
+
+    def merge(self, other):
+        self.flush()
+        other.flush()
+        self.reads += other.reads
+        self.bases += other.bases
+        self.n_bases += other.n_bases
+        self.gc_bases += other.gc_bases
+        for name in ("cycle_quality", "cycle_n", "lengths"):
+            mine = grow(getattr(self, name), len(getattr(other, name)))
+            mine[:len(getattr(other, name))] += getattr(other, name)
+            setattr(self, name, mine)
+        self.read_quality += other.read_quality
+        self.gc_content += other.gc_content
+
+    def result(self):
+        self.flush()
+        return {
+            "reads": self.reads,
+            "bases": self.bases,
+            "n_rate": self.n_bases / self.bases if self.bases else 0.0,
+            "gc_percent": self.gc_bases / (self.bases - self.n_bases) * 100 if self.bases > self.n_bases else 0.0,
+            "cycle_quality": self.cycle_quality,
+            "cycle_n": self.cycle_n,
+            "read_quality": self.read_quality,
+            "gc_content": self.gc_content,
+            "lengths": self.lengths,
+        }
+
+    def to_dict(self):
+        self.flush()
+        return {"reads": self.reads, "bases": self.bases, "n_bases": self.n_bases, "gc_bases": self.gc_bases,
+                "cycle_quality": self.cycle_quality.tolist(), "cycle_n": self.cycle_n.tolist(),
+                "read_quality": self.read_quality.tolist(), "gc_content": self.gc_content.tolist(),
+                "lengths": self.lengths.tolist()}
+
+    @classmethod
+    def from_dict(cls, state):
+        acc = cls()
+        acc.reads, acc.bases, acc.n_bases, acc.gc_bases = (state["reads"], state["bases"], state["n_bases"],
+                                                           state["gc_bases"])
+        acc.cycle_quality = np.array(state["cycle_quality"], dtype=np.int64).reshape(-1, QUALITY_BINS)
+        for name in ("cycle_n", "read_quality", "gc_content", "lengths"):
+            setattr(acc, name, np.array(state[name], dtype=np.int64))
+        return acc
+
+
+# ==========================================================================
+# Report tables
+# ==========================================================================
+def histogram_mean(histogram):
+    total = histogram.sum(axis=-1)
+    return (histogram * np.arange(histogram.shape[-1])).sum(axis=-1) / np.maximum(total, 1)
+
+
+def histogram_quantiles(histogram, quantiles=QUANTILES):
+    # Quantiles of each row of a histogram (value = column index), as a (rows x quantiles) array.
+    cumulative = np.cumsum(histogram, axis=-1)
+    targets = cumulative[..., -1:] * np.array(quantiles)
+    return np.stack([(cumulative < targets[..., [i]]).sum(axis=-1) for i in range(len(quantiles))], axis=-1)
+
+
+def sequence_table(stats):
+    # Rows of the "Sequence Statistics" table.
+    result = stats["sequence"].result()
+    lengths = result["lengths"]
+    observed = np.flatnonzero(lengths)
+    read_quality = result["read_quality"]
+    return [
+        ["Reads With Sequence", result["reads"]],
+        ["Total Bases", result["bases"]],
+        ["Mean Read Length", round(result["bases"] / result["reads"], 2) if result["reads"] else 0],
+        ["Min Read Length", int(observed[0]) if len(observed) else 0],
+        ["Max Read Length", int(observed[-1]) if len(observed) else 0],
+        ["Mean Read Quality", round(float(histogram_mean(read_quality)), 2)],
+        ["Reads With Mean Quality >= 30", int(read_quality[30:].sum())],
+        ["GC Content", f"{result['gc_percent']:.2f}%"],
+        ["N Rate", f"{result['n_rate'] * 100:.4f}%"],
+    ]
+
+
+def cycle_quality_table(stats, interval_size=10):
+    # Rows of the "Per-Cycle Quality" table: cycles grouped by intervals (1-based).
+    cycle_quality = stats["sequence"].result()["cycle_quality"]
+    rows = []
+    for start in range(0, len(cycle_quality), interval_size):
+        histogram = cycle_quality[start:start + interval_size].sum(axis=0)
+        if not histogram.sum():
+            continue
+        end = min(start + interval_size, len(cycle_quality))
+        rows.append([f"{start + 1}-{end}", round(float(histogram_mean(histogram)), 2)] +
+                    histogram_quantiles(histogram).tolist())
+    return rows
+
+
+def read_quality_table(stats, interval_size=5):
+    # Rows of the "Read Quality Distribution" table (mean Phred of each read, grouped by intervals).
+    from sam_stats import percentage
+    result = stats["sequence"].result()
+    histogram = result["read_quality"]
+    total = int(histogram.sum())
+    return [[f"{start}-{start + interval_size - 1}", count, percentage(count, total)]
+            for start, count in ((start, int(histogram[start:start + interval_size].sum()))
+                                 for start in range(0, QUALITY_BINS, interval_size)) if count]
+
+
+def gc_content_table(stats, interval_size=10):
+    # Rows of the "GC Content Distribution" table.
+    from sam_stats import percentage
+    histogram = stats["sequence"].result()["gc_content"]
+    total = int(histogram.sum())
+    rows = []
+    for start in range(0, 101, interval_size):
+        count = int(histogram[start:start + interval_size].sum())
+        label = "100%" if start == 100 else f"{start}-{start + interval_size - 1}%"
+        rows.append([label, count, percentage(count, total)])
+    return rows
+
+
+def read_length_table(stats, max_rows=20, interval_size=10):
+    # Rows of the "Read Length Distribution" table: every length, or intervals when there are many.
+    from sam_stats import percentage
+    lengths = stats["sequence"].result()["lengths"]
+    total = int(lengths.sum())
+    observed = np.flatnonzero(lengths)
+    if len(observed) <= max_rows:
+        return [[str(length), int(lengths[length]), percentage(int(lengths[length]), total)] for length in observed]
+    rows = []
+    for start in range(0, len(lengths), interval_size):
+        count = int(lengths[start:start + interval_size].sum())
+        if count:
+            rows.append([f"{start}-{start + interval_size - 1}", count, percentage(count, total)])
+    return rows
+
+
+SEQUENCE_HEADERS = ["Statistic", "Value"]
+CYCLE_QUALITY_HEADERS = ["Cycles", "Mean", "10th Percentile", "Lower Quartile", "Median", "Upper Quartile",
+                         "90th Percentile"]
+READ_QUALITY_HEADERS = ["Mean Quality", "Reads", "Percentage"]
+GC_CONTENT_HEADERS = ["GC Content", "Reads", "Percentage"]
+READ_LENGTH_HEADERS = ["Read Length", "Reads", "Percentage"]
@@ -0,0 +1,327 @@
+import sys  # Library to access command-line arguments.
+import argparse  # Parses the command-line options.
+import json  # Tables and validation errors are stored as JSON text.
+import os  # Library to manage files and directories.
+import sqlite3  # Local results store, no server needed.
+import time  # Polling interval and timestamps.
+from collections import deque  # Stable files waiting for a free worker.
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED  # Warm worker pool.
+from concurrent.futures.process import BrokenProcessPool  # A worker was killed: the pool is recreated.
+from sam_batch import is_alignment_file  # Extensions of the files picked up.
+
+# ==========================================================================
+# Watch-folder analysis service
+#
+# `python sam_service.py watch DIR` polls DIR (and its subdirectories) for
+# SAM/BAM files. A file is picked up once its size and modification time have
+# not changed for --settle seconds, so files still being written by the
+# sequencer are left alone. Each file is validated (sam_validate.py, text SAM
+# only) then analysed by a worker of a process pool created once: the
+# workers import NumPy, matplotlib and fpdf at start-up and keep them loaded
+# for every later file. At most --queue files are submitted to the pool at a
+# time; further stable files wait in order (back-pressure), so a burst of
+# files never piles up work, memory or open files in the pool. A worker killed
+# by the OS breaks the pool: it is recreated and the files it was running
+# are retried one at a time; the one that kills its worker alone is stored
+# with the "error" status, so it cannot crash the service again after a
+# restart.
+#
+# Results go to a SQLite database written by the service process only:
+#   files   one row per analysed file (path, size, mtime, status, times,
+#           validation counts, error message);
+#   tables  one row per report table (section key, headers, rows as JSON).
+# A file whose path, size and mtime are already in the database is not
+# analysed again, so the service can be restarted at any time.
+# `python sam_service.py query` prints stored results without re-parsing.
+# ==========================================================================
+
+DEFAULT_DATABASE = "sam_results.sqlite"
+DEFAULT_INTERVAL = 2.0  # Seconds between two scans of the directory.
+DEFAULT_SETTLE = 5.0  # Seconds a file must stay unchanged before it is analysed.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    status TEXT NOT NULL,
+    lines_checked INTEGER,
+    validation_errors INTEGER,
+    error TEXT,
+    started REAL,
+    finished REAL,
+    UNIQUE (path, size, mtime)
+);
+CREATE TABLE IF NOT EXISTS tables (
+    file_id INTEGER NOT NULL REFERENCES files (id) ON DELETE CASCADE,
+    section TEXT NOT NULL,
+    title TEXT NOT NULL,
+    headers TEXT NOT NULL,
+    rows TEXT NOT NULL,
+    PRIMARY KEY (file_id, section)
+);
+CREATE INDEX IF NOT EXISTS files_path ON files (path);
+"""
+
+
+# ==========================================================================
+# Results store
+# ==========================================================================
+class ResultStore:
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")  # Readers are never blocked by the service.
+        self.connection.execute("PRAGMA foreign_keys=ON")
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def is_known(self, path, size, mtime):
+        return self.connection.execute("SELECT 1 FROM files WHERE path = ? AND size = ? AND mtime = ?",
+                                       (path, size, mtime)).fetchone() is not None
+
+    def save(self, result):
+        # Stores the result of process_file() with its tables, in one transaction.
+        from sam_report import SECTION_KEYS
+        with self.connection:
+            cursor = self.connection.execute(
+                "INSERT OR REPLACE INTO files (path, size, mtime, status, lines_checked, validation_errors, error,"
+                " started, finished) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (result["path"], result["size"], result["mtime"], result["status"], result.get("lines_checked"),
+                 result.get("validation_errors"), result.get("error"), result["started"], result["finished"]))
+            file_id = cursor.lastrowid
+            self.connection.executemany(
+                "INSERT INTO tables (file_id, section, title, headers, rows) VALUES (?, ?, ?, ?, ?)",
+                [(file_id, SECTION_KEYS.get(title, title), title, json.dumps(headers), json.dumps(rows))
+                 for title, (headers, rows) in result.get("tables", {}).items()])
+        return file_id
+
+    def files(self, path=None):
+        # Rows of the files table (latest first), optionally of one path.
+        query = "SELECT id, path, size, mtime, status, lines_checked, validation_errors, error, started, finished " \
+                "FROM files" + (" WHERE path = ?" if path else "") + " ORDER BY finished DESC"
+        columns = ["id", "path", "size", "mtime", "status", "lines_checked", "validation_errors", "error",
+                   "started", "finished"]
+        return [dict(zip(columns, row)) for row in self.connection.execute(query, (path,) if path else ())]
+
+    def tables(self, file_id, sections=None):
+        # {title: (headers, rows)} of one file, in the order of the report.
+        rows = self.connection.execute("SELECT section, title, headers, rows FROM tables WHERE file_id = ? "
+                                       "ORDER BY rowid", (file_id,))
+        return {title: (json.loads(headers), json.loads(table_rows)) for section, title, headers, table_rows in rows
+                if not sections or section in sections}
+
+
+# ==========================================================================
+# Workers
+# ==========================================================================
+def warm_up():
+    # Pool initializer: pays the imports once per worker instead of once per file.
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot  # noqa: F401
+    import fpdf  # noqa: F401
+    import sam_mmap, sam_report, sam_validate  # noqa: F401
+
+
+def process_file(path, size, mtime, output_dir=None, validate=True):
+    # Worker: validates and analyses one file. Returns a picklable result for ResultStore.save().
+    from sam_io import read_references
+    from sam_mmap import file_stats
+    from sam_report import report_accumulators, report_tables
+    from sam_validate import validate_file, ValidationError
+    result = {"path": path, "size": size, "mtime": mtime, "started": time.time()}
+    try:
+        if validate and not path.endswith(".bam"):
+            validation = validate_file(path, fail_fast=True)
+            result["lines_checked"] = validation["lines_checked"]
+            result["validation_errors"] = validation["error_count"]
+            if validation["error_count"]:
+                number, message = validation["errors"][0]
+                result.update(status="invalid", error=f"line {number}: {message}", finished=time.time())
+                return result
+        stats = file_stats(path, report_accumulators(read_references(path)))
+        tables = report_tables(stats)
+        if output_dir is not None:
+            from analyse_sam import write_pdf_report
+            prefix = os.path.join(output_dir, os.path.basename(path).split('.')[0])
+            write_pdf_report(stats, prefix, tables, plot_jobs=1)  # The pool already runs one file per CPU.
+        result.update(status="done", tables=tables)
+    except (OSError, ValueError, ValidationError) as error:
+        result.update(status="error", error=str(error))
+    result["finished"] = time.time()
+    return result
+
+
+# ==========================================================================
+# Directory watcher
+# ==========================================================================
+def scan(directory):
+    # {path: (size, mtime)} of the alignment files under directory.
+    found = {}
+    for root, _, names in os.walk(directory):
+        for name in names:
+            if is_alignment_file(name) and not name.startswith("."):
+                path = os.path.join(root, name)
+                try:
+                    status = os.stat(path)
+                except OSError:  # Removed between the listing and the stat.
+                    continue
+                found[path] = (status.st_size, status.st_mtime)
+    return found
+
+
+class Watcher:
+    # Reports the files whose size and mtime have not changed for `settle` seconds.
+    def __init__(self, directory, settle=DEFAULT_SETTLE):
+        self.directory = os.path.abspath(directory)  # Paths are stored absolute.
+        self.settle = settle
+        self.seen = {}  # path -> (size, mtime, time of the first scan with these values)
+        self.reported = set()  # (path, size, mtime) already returned by stable_files().
+
+    def stable_files(self, now=None):
+        now = time.time() if now is None else now
+        stable = []
+        for path, (size, mtime) in sorted(scan(self.directory).items()):
+            previous = self.seen.get(path)
+            if previous is None or previous[:2] != (size, mtime):
+                self.seen[path] = (size, mtime, now)
+                continue
+            if size and now - previous[2] >= self.settle and (path, size, mtime) not in self.reported:
+                self.reported.add((path, size, mtime))
+                stable.append((path, size, mtime))
+        return stable
+
+    def settling(self):
+        # True while a non-empty file seen by the last scan has not been reported yet.
+        return any(size and (path, size, mtime) not in self.reported
+                   for path, (size, mtime, _) in self.seen.items())
+
+
+def worker_died(path, size, mtime, started):
+    # files row of a file whose worker process was killed (crash, out of memory): stored so that the file
+    # is not analysed again, and crashes again, after a restart.
+    return {"path": path, "size": size, "mtime": mtime, "status": "error", "started": started,
+            "finished": time.time(), "error": "the worker process died while analysing the file"}
+
+
+def run_service(directory, store, jobs=1, queue=None, interval=DEFAULT_INTERVAL, settle=DEFAULT_SETTLE,
+                output_dir=None, validate=True, once=False):
+    # Watches directory until interrupted (or, with once, until every file present is stored).
+    # A worker killed by the OS breaks the whole pool: it is recreated, and the files that were running are
+    # analysed again one at a time, so the file that kills its worker alone is stored as an error.
+    queue = queue or 2 * jobs  # Files submitted to the pool at a time.
+    watcher = Watcher(directory, settle)
+    waiting, isolated, running = deque(), deque(), {}  # running: future -> (path, size, mtime, started, alone)
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+    pool = ProcessPoolExecutor(max_workers=jobs, initializer=warm_up)
+    try:
+        while True:
+            for path, size, mtime in watcher.stable_files():
+                if not store.is_known(path, size, mtime):
+                    waiting.append((path, size, mtime))
+            broken = []
+            while (isolated and not running) or (not isolated and waiting and len(running) < queue):
+                alone = bool(isolated)
+                path, size, mtime = (isolated if alone else waiting).popleft()
+                try:
+                    future = pool.submit(process_file, path, size, mtime, output_dir, validate)
+                except BrokenProcessPool:
+                    (isolated if alone else waiting).appendleft((path, size, mtime))
+                    broken.append(None)
+                    break
+                running[future] = (path, size, mtime, time.time(), alone)
+                if alone:
+                    break
+            if once and not waiting and not isolated and not running and not watcher.settling():
+                return
+            if not running and not broken:
+                time.sleep(interval)
+                continue
+            done, _ = wait(running, timeout=interval, return_when=FIRST_COMPLETED) if running else ((), ())
+            for future in done:
+                path, size, mtime, started, alone = running.pop(future)
+                try:
+                    result = future.result()
+                except BrokenProcessPool:
+                    broken.append((path, size, mtime, started, alone))
+                    continue
+                except Exception as error:  # Any other failure of a worker must not stop the service.
+                    print(f"Error: {path}: {error}", file=sys.stderr)
+                    continue
+                store.save(result)
+                print(f"{result['status']}: {path} ({result['finished'] - result['started']:.1f} s)"
+                      + (f" - {result['error']}" if result.get("error") else ""))
+            if broken:
+                # Every file still running failed with the pool: retry them alone in a new pool.
+                broken += running.values()
+                running.clear()
+                pool.shutdown(wait=False)
+                pool = ProcessPoolExecutor(max_workers=jobs, initializer=warm_up)
+                for path, size, mtime, started, alone in filter(None, broken):
+                    if alone:
+                        store.save(worker_died(path, size, mtime, started))
+                        print(f"error: {path} - the worker process died", file=sys.stderr)
+                    else:
+                        isolated.append((path, size, mtime))
+    finally:
+        pool.shutdown(cancel_futures=True)
+
+
+# ==========================================================================
+#                                  Main program execution
+# ==========================================================================
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Watch a directory and analyse the SAM files dropped in it.")
+    parser.add_argument("--database", "-d", default=DEFAULT_DATABASE,
+                        help=f"SQLite database of the results (default: {DEFAULT_DATABASE}).")
+    commands = parser.add_subparsers(dest="command", required=True)
+    watch = commands.add_parser("watch", help="Analyse the files of a directory as they arrive.")
+    watch.add_argument("directory", help="Directory watched (subdirectories included).")
+    watch.add_argument("--jobs", "-j", type=int, default=os.cpu_count() or 1,
+                       help="Number of worker processes (default: number of CPUs).")
+    watch.add_argument("--queue", type=int, metavar="N",
+                       help="Files submitted to the workers at a time; the others wait (default: 2 x jobs).")
+    watch.add_argument("--interval", type=float, default=DEFAULT_INTERVAL,
+                       help="Seconds between two scans of the directory (default: %(default)s).")
+    watch.add_argument("--settle", type=float, default=DEFAULT_SETTLE,
+                       help="Seconds a file must stay unchanged before it is analysed (default: %(default)s).")
+    watch.add_argument("--pdf", metavar="DIR", help="Also write the PDF report of each file to DIR.")
+    watch.add_argument("--no-validate", action="store_true", help="Analyse the files without validating them.")
+    watch.add_argument("--once", action="store_true",
+                       help="Exit once every file present has been analysed instead of watching forever.")
+    query = commands.add_parser("query", help="Print stored results without re-parsing the files.")
+    query.add_argument("path", nargs="?", help="File whose latest tables are printed (default: list the files).")
+    query.add_argument("--section", action="append", metavar="KEY",
+                       help="Only print this table (summary, chromosomes, depth, ...; may be repeated).")
+    query.add_argument("--format", choices=["text", "json", "tsv"], default="text",
+                       help="Output format of the tables (default: text).")
+    args = parser.parse_args()
+
+    store = ResultStore(args.database)
+    if args.command == "watch":
+        if not os.path.isdir(args.directory):
+            print(f"Error: '{args.directory}' is not a directory.")
+            sys.exit(1)
+        try:
+            run_service(args.directory, store, max(args.jobs, 1), args.queue, args.interval, args.settle,
+                        args.pdf, not args.no_validate, args.once)
+        except KeyboardInterrupt:
+            print("Stopped.")
+        store.close()
+        sys.exit(0)
+
+    from sam_report import OUTPUT_FORMATS
+    if args.path is None:
+        from tabulate import tabulate
+        columns = ["path", "status", "size", "lines_checked", "validation_errors", "error"]
+        print(tabulate([[entry[column] for column in columns] for entry in store.files()], headers=columns,
+                       tablefmt="grid"))
+        sys.exit(0)
+    entries = store.files(os.path.abspath(args.path)) or store.files(args.path)
+    if not entries:
+        print(f"Error: no stored results for '{args.path}'.")
+        sys.exit(1)
+    print(OUTPUT_FORMATS[args.format](store.tables(entries[0]["id"], args.section)))
@@ -0,0 +1,383 @@
+import json  # Footer of the snapshot file.
+import os  # Library to manage files and directories.
+import struct  # Fixed-size preamble of the snapshot file.
+import numpy as np  # Columns are written and mapped as NumPy arrays.
+from sam_cigar import parse_cigar  # Memoized CIGAR parser.
+from sam_io import (KEYS, SNAPSHOT_MAGIC, SamRecord, is_compressed, iter_sam_records,  # Streaming SAM/BAM reader.
+                    read_references)
+from sam_mmap import ColumnBlock, FIELD_INDEX, INTEGER_FIELDS, iter_column_blocks  # Memory-mapped column parser.
+from sam_stats import SamStats  # Single-pass statistics engine.
+
+# ==========================================================================
+# Binary columnar snapshots (.samcol)
+#
+# `analyse_sam.py export file.sam file.samcol` parses the SAM text once and
+# writes its core columns to a chunked binary file; `analyse_sam.py
+# file.samcol` then runs the analysis from it without reading any text.
+#
+# Layout: an 8-byte magic and the uint64 offset of the footer, the chunks,
+# then the footer (JSON). Each chunk holds the columns of a block of reads
+# as raw little-endian arrays aligned to 64 bytes:
+#   flag uint16, rname int32, pos int32, mapq uint8, cigar uint32,
+#   rnext int32, pnext int32, tlen int32,
+# RNAME/RNEXT being codes into the footer's `names` and CIGAR ids into its
+# `cigars`. With --sequences, QNAME, SEQ and QUAL are stored as well: their
+# bytes concatenated in one uint8 array with one int64 offset array each.
+# The footer lists, for every chunk, the offset of each column, its rows,
+# its min POS / max alignment end and, per reference, [reads, min POS, max
+# end], so --region and reference queries only touch the chunks that can
+# hold matching reads.
+#
+# Loading maps the file once (np.memmap); the columns of a chunk are views
+# of the map, so nothing is read or copied until a statistic touches them.
+# SnapshotBlock gives a chunk the interface of sam_mmap.ColumnBlock, so every
+# accumulator with add_columns() runs on it unchanged.
+# ==========================================================================
+
+PREAMBLE = struct.Struct("<8sQ")  # Magic, footer offset.
+ALIGNMENT = 64  # Byte alignment of every column.
+CHUNK_ROWS = 1 << 16  # Reads per chunk when exporting records (column blocks keep their size).
+SNAPSHOT_VERSION = 1
+SNAPSHOT_SUFFIX = ".samcol"  # Default extension of "analyse_sam.py export".
+CORE_COLUMNS = [("flag", "<u2"), ("rname", "<i4"), ("pos", "<i4"), ("mapq", "u1"), ("cigar", "<u4"),
+                ("rnext", "<i4"), ("pnext", "<i4"), ("tlen", "<i4")]
+TEXT_FIELDS = ["qname", "seq", "qual"]  # Optional columns, stored as bytes + offsets.
+CODED_FIELDS = {"rname", "rnext", "cigar"}  # Stored as codes into the footer's names/cigars.
+
+
+# ==========================================================================
+# Export
+# ==========================================================================
+class Interner:
+    # Global codes of text values (reference names or CIGAR strings), in order of first appearance.
+    def __init__(self):
+        self.values, self.ids = [], {}
+
+    def codes(self, values):
+        ids = self.ids
+        for value in values:
+            if value not in ids:
+                ids[value] = len(self.values)
+                self.values.append(value)
+        return np.array([ids[value] for value in values], dtype=np.int64)
+
+
+def local_codes(values):
+    # Values of a column -> (distinct values in order of first appearance, int64 array of value indexes).
+    ids = {}
+    codes = np.array([ids.setdefault(value, len(ids)) for value in values], dtype=np.int64)
+    return list(ids), codes
+
+
+def gather_text(values):
+    # bytes values -> (concatenated uint8 array, int64 offsets with a final end).
+    offsets = np.zeros(len(values) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in values], out=offsets[1:])
+    return np.frombuffer(b"".join(values), dtype=np.uint8), offsets
+
+
+def gather_bounds(data, start, end):
+    # Bytes [start, end) of every line of a block -> (concatenated uint8 array, int64 offsets).
+    lengths = end - start
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    index = np.arange(offsets[-1], dtype=np.int64) + np.repeat(start - offsets[:-1], lengths)
+    return data[index], offsets
+
+
+class SnapshotWriter:
+    def __init__(self, path, references, sequences=False):
+        self.file = open(path, "wb")
+        self.file.write(PREAMBLE.pack(SNAPSHOT_MAGIC, 0))
+        self.references = references
+        self.sequences = sequences
+        self.names = Interner()
+        self.names.codes(["*"])  # Code 0: no reference.
+        self.cigars = Interner()
+        self.spans = np.zeros(0, dtype=np.int64)  # Reference span of each CIGAR id.
+        self.chunks = []
+
+    def write_array(self, array):
+        # Writes an array at the next aligned offset; returns [offset, dtype, length].
+        self.file.write(b"\0" * (-self.file.tell() % ALIGNMENT))
+        offset = self.file.tell()
+        array = np.ascontiguousarray(array)
+        self.file.write(array.tobytes())
+        return [offset, array.dtype.str, len(array)]
+
+    def add_chunk(self, columns, text=None):
+        # columns: {name: int64 array} of CORE_COLUMNS, rname/rnext/cigar as (str values, local codes);
+        # text: {field: (uint8 bytes, int64 offsets)} of QNAME, SEQ and QUAL when sequences are stored.
+        rows = len(columns["flag"])
+        if not rows:
+            return
+        columns = dict(columns)
+        for name, interner in (("rname", self.names), ("rnext", self.names), ("cigar", self.cigars)):
+            values, codes = columns[name]
+            columns[name] = interner.codes(values)[codes]
+        if len(self.spans) < len(self.cigars.values):
+            spans = [parse_cigar(cigar).ref_span for cigar in self.cigars.values[len(self.spans):]]
+            self.spans = np.append(self.spans, np.array(spans, dtype=np.int64))
+        chunk = {"rows": rows, "columns": {}, "references": {}}
+        for name, dtype in CORE_COLUMNS:
+            chunk["columns"][name] = self.write_array(columns[name].astype(dtype))
+        if self.sequences:  # One bytes array for the three fields, offsets per field.
+            base = 0
+            for field in TEXT_FIELDS:
+                data, offsets = text[field]
+                chunk["columns"][field + "_offsets"] = self.write_array(offsets + base)
+                base += len(data)
+            chunk["columns"]["text"] = self.write_array(np.concatenate([text[field][0] for field in TEXT_FIELDS]))
+        # Reads, first POS and last alignment end of every reference, for region and reference queries.
+        codes, pos = columns["rname"], columns["pos"]
+        ends = pos + np.maximum(self.spans[columns["cigar"]], 1) - 1
+        order = np.argsort(codes, kind="stable")
+        starts = np.flatnonzero(np.r_[True, codes[order][1:] != codes[order][:-1]])
+        counts = np.diff(np.r_[starts, rows]).tolist()
+        mins = np.minimum.reduceat(pos[order], starts).tolist()
+        maxs = np.maximum.reduceat(ends[order], starts).tolist()
+        for code, count, min_pos, max_end in zip(codes[order][starts].tolist(), counts, mins, maxs):
+            chunk["references"][str(code)] = [count, min_pos, max_end]
+        mapped = codes != 0
+        chunk["min_pos"] = int(pos[mapped].min()) if mapped.any() else 0
+        chunk["max_end"] = int(ends[mapped].max()) if mapped.any() else 0
+        self.chunks.append(chunk)
+
+    def add_block(self, block):
+        # Chunk of one sam_mmap.ColumnBlock, every column converted for the whole block at once.
+        columns = {name: block[name] for name in ("flag", "pos", "mapq", "pnext", "tlen")}
+        for name in ("rname", "rnext", "cigar"):
+            values, codes = block.codes(name)
+            columns[name] = ([value.decode() for value in values], codes)
+        text = None
+        if self.sequences:
+            text = {field: gather_bounds(block.data, *block.bounds(FIELD_INDEX[field])) for field in TEXT_FIELDS}
+        self.add_chunk(columns, text)
+
+    def add_records(self, records):
+        # Chunks of CHUNK_ROWS SamRecord objects.
+        batch = []
+        for record in records:
+            batch.append(record)
+            if len(batch) >= CHUNK_ROWS:
+                self.add_record_chunk(batch)
+                batch = []
+        self.add_record_chunk(batch)
+
+    def add_record_chunk(self, records):
+        columns = {name: np.array([getattr(record, name) for record in records], dtype=np.int64)
+                   for name in ("flag", "pos", "mapq", "pnext", "tlen")}
+        for name in ("rname", "rnext", "cigar"):
+            columns[name] = local_codes([getattr(record, name) for record in records])
+        text = None
+        if self.sequences:
+            text = {field: gather_text([getattr(record, field).encode() for record in records])
+                    for field in TEXT_FIELDS}
+        self.add_chunk(columns, text)
+
+    def close(self, source=None):
+        footer_offset = self.file.tell()
+        footer = {"version": SNAPSHOT_VERSION, "source": source, "references": self.references,
+                  "names": self.names.values, "cigars": self.cigars.values, "sequences": self.sequences,
+                  "rows": sum(chunk["rows"] for chunk in self.chunks), "chunks": self.chunks}
+        self.file.write(json.dumps(footer).encode())
+        self.file.seek(0)
+        self.file.write(PREAMBLE.pack(SNAPSHOT_MAGIC, footer_offset))
+        self.file.close()
+
+
+def export_snapshot(path, output, sequences=False):
+    # Parses a SAM, .sam.gz or BAM file once and writes its columns to a .samcol snapshot.
+    status = os.stat(path)
+    writer = SnapshotWriter(output, read_references(path), sequences)
+    try:
+        if is_compressed(path):
+            writer.add_records(iter_sam_records(path))
+        else:
+            for block in iter_column_blocks(path):
+                writer.add_block(block)
+    except BaseException:
+        writer.file.close()
+        os.remove(output)
+        raise
+    writer.close({"path": os.path.abspath(path), "size": status.st_size, "mtime": status.st_mtime})
+    return output
+
+
+# ==========================================================================
+# Import
+# ==========================================================================
+class SnapshotBlock(ColumnBlock):
+    # One chunk of a snapshot (or the reads of it selected by a mask), read like a sam_mmap.ColumnBlock.
+    def __init__(self, snapshot, arrays, rows=None):
+        self.snapshot = snapshot
+        self.arrays = arrays  # Column name -> view of the memory map.
+        self.rows = rows  # Indexes of the selected reads of the chunk, None for all of them.
+        self.columns = {}
+
+    def __len__(self):
+        return len(self.arrays["flag"]) if self.rows is None else len(self.rows)
+
+    def raw(self, name):
+        # Stored column (uint16/int32/... view of the map, or a copy of the selected reads).
+        array = self.arrays[name]
+        return array if self.rows is None else array[self.rows]
+
+    def __getitem__(self, field):
+        column = self.columns.get(field)
+        if column is None:
+            if field in INTEGER_FIELDS:
+                column = self.raw(field).astype(np.int64)
+            elif field in CODED_FIELDS:
+                values, codes = self.codes(field)
+                column = [values[code] for code in codes.tolist()]
+            else:
+                column = self.strings(FIELD_INDEX[field])
+            self.columns[field] = column
+        return column
+
+    def codes(self, field):
+        # Values present in this block, in order of first appearance (as ColumnBlock.codes does).
+        key = field + ":codes"
+        if key not in self.columns:
+            pool = self.snapshot.cigar_bytes if field == "cigar" else self.snapshot.name_bytes
+            present, first, inverse = np.unique(self.raw(field), return_index=True, return_inverse=True)
+            order = np.argsort(first)
+            rank = np.empty_like(order)
+            rank[order] = np.arange(len(order))
+            self.columns[key] = ([pool[code] for code in present[order].tolist()],
+                                 rank[inverse.ravel()].astype(np.int64))
+        return self.columns[key]
+
+    @property
+    def data(self):
+        # QNAME, SEQ and QUAL bytes of the chunk.
+        if "text" not in self.arrays:
+            raise KeyError("the snapshot has no QNAME/SEQ/QUAL columns (export it with --sequences)")
+        return self.arrays["text"]
+
+    def bounds(self, index):
+        # (start, end) offsets of QNAME, SEQ or QUAL of every read in self.data.
+        offsets = self.arrays.get(KEYS[index].lower() + "_offsets")
+        if offsets is None:
+            raise KeyError(f"the snapshot has no {KEYS[index]} column (export it with --sequences)")
+        rows = np.arange(len(self.arrays["flag"])) if self.rows is None else self.rows
+        return offsets[rows], offsets[rows + 1]
+
+    def strings(self, index):
+        data = self.data
+        start, end = self.bounds(index)
+        return [data[s:e].tobytes() for s, e in zip(start.tolist(), end.tolist())]
+
+    def select(self, mask):
+        # View of the reads where mask is True (converted columns are subset, not recomputed).
+        rows = np.flatnonzero(mask) if self.rows is None else self.rows[mask]
+        view = SnapshotBlock(self.snapshot, self.arrays, rows)
+        for key, column in self.columns.items():
+            if key.endswith(":codes"):
+                view.columns[key] = (column[0], column[1][mask])
+            elif isinstance(column, list):
+                view.columns[key] = [value for value, kept in zip(column, mask.tolist()) if kept]
+            else:
+                view.columns[key] = column[mask]
+        return view
+
+
+class Snapshot:
+    def __init__(self, path):
+        with open(path, "rb") as file:
+            magic, footer_offset = PREAMBLE.unpack(file.read(PREAMBLE.size))
+            if magic != SNAPSHOT_MAGIC:
+                raise ValueError(f"'{path}' is not a .samcol snapshot.")
+            file.seek(footer_offset)
+            self.footer = json.loads(file.read())
+        if self.footer["version"] != SNAPSHOT_VERSION:
+            raise ValueError(f"'{path}': unsupported snapshot version {self.footer['version']}.")
+        self.path = path
+        self.map = np.memmap(path, dtype=np.uint8, mode="r")  # Pages are only read when touched.
+        self.names = self.footer["names"]
+        self.name_bytes = [name.encode() for name in self.names]
+        self.cigars = self.footer["cigars"]
+        self.cigar_bytes = [cigar.encode() for cigar in self.cigars]
+        self.spans = np.array([parse_cigar(cigar).ref_span for cigar in self.cigars] or [0], dtype=np.int64)
+        self.references = [tuple(reference) for reference in self.footer["references"]]
+        self.sequences = self.footer["sequences"]
+
+    def __len__(self):
+        return self.footer["rows"]
+
+    def block(self, chunk):
+        # SnapshotBlock of a chunk, every column a zero-copy view of the memory map.
+        arrays = {name: np.frombuffer(self.map, dtype=np.dtype(dtype), count=length, offset=offset)
+                  for name, (offset, dtype, length) in chunk["columns"].items()}
+        return SnapshotBlock(self, arrays)
+
+    def iter_blocks(self, region=None, references=None):
+        # Yields a SnapshotBlock per chunk. With a region ("chrom:start-end", 1-based, inclusive) or
+        # references (names), chunks without matching reads are skipped and the others masked.
+        from sam_index import parse_region  # Same region syntax as --region on an indexed SAM file.
+        chrom, start, end = parse_region(region) if region else (None, 1, None)
+        wanted = {chrom} if chrom else set(references or ())
+        if chrom and references is not None:
+            wanted &= set(references)
+        codes = [code for code, name in enumerate(self.names) if name in wanted]
+        for chunk in self.footer["chunks"]:
+            if region or references is not None:
+                present = [chunk["references"][str(code)] for code in codes if str(code) in chunk["references"]]
+                if not any(max_end >= start and (end is None or min_pos <= end) for _, min_pos, max_end in present):
+                    continue
+            block = self.block(chunk)
+            if region or references is not None:
+                mask = np.isin(block.raw("rname"), codes)
+                if chrom:  # Same overlap test as sam_index.iter_region_records().
+                    pos = block.raw("pos").astype(np.int64)
+                    mask &= pos + np.maximum(self.spans[block.raw("cigar")], 1) - 1 >= start
+                    if end is not None:
+                        mask &= pos <= end
+                if not mask.all():
+                    block = block.select(mask)
+            if len(block):
+                yield block
+
+    def iter_records(self, region=None):
+        # SamRecord objects, for consumers without add_columns() (QNAME, SEQ and QUAL are "*" if not stored).
+        for block in self.iter_blocks(region):
+            rname, rnext, cigar = block["rname"], block["rnext"], block["cigar"]
+            flag, pos, mapq = block["flag"].tolist(), block["pos"].tolist(), block["mapq"].tolist()
+            pnext, tlen = block["pnext"].tolist(), block["tlen"].tolist()
+            if self.sequences:
+                qname, seq, qual = ([value.decode() for value in block[field]] for field in TEXT_FIELDS)
+            else:
+                qname = seq = qual = ["*"] * len(flag)
+            for i in range(len(flag)):
+                yield SamRecord(qname[i], flag[i], rname[i].decode(), pos[i], mapq[i], cigar[i].decode(),
+                                rnext[i].decode(), pnext[i], tlen[i], seq[i], qual[i])
+
+    def to_sam_table(self):
+        # SamTable of the whole snapshot, for the vectorized analysis functions (sam_table.py).
+        from sam_table import SamTable
+        blocks = [self.block(chunk) for chunk in self.footer["chunks"]]
+
+        def column(name, dtype):
+            return np.concatenate([block.raw(name) for block in blocks]) if blocks else np.zeros(0, dtype=dtype)
+        return SamTable(*(column(name, dtype) for name, dtype in CORE_COLUMNS), list(self.names), list(self.cigars))
+
+
+def snapshot_stats(path, accumulators=None, region=None, snapshot=None):
+    # Statistics of a .samcol snapshot: column blocks for accumulators with add_columns(), records otherwise.
+    snapshot = snapshot or Snapshot(path)
+    stats = SamStats(accumulators)
+    if all(getattr(acc, "add_columns", None) is not None for acc in stats.accumulators.values()):
+        return stats.update_columns(snapshot.iter_blocks(region))
+    return stats.update(snapshot.iter_records(region))
+
+
+SEQUENCE_ACCUMULATORS = {"sequence"}  # Statistics of SEQ/QUAL, only computed from snapshots holding them.
+
+
+def snapshot_accumulators(snapshot, accumulator_factory):
+    # Picklable factory (use with functools.partial): the statistics a snapshot has the columns for.
+    accumulators = accumulator_factory()
+    if snapshot.sequences:
+        return accumulators
+    return [acc for acc in accumulators if acc.name not in SEQUENCE_ACCUMULATORS]
@@ -0,0 +1,421 @@
+from collections import defaultdict  # Simplifies the handling of dictionaries.
+import importlib  # Loads the modules of the registered accumulator classes when loading saved statistics.
+import json  # Saved partial statistics are JSON files.
+from sam_cigar import parse_cigar  # Memoized CIGAR parser.
+
+# ==========================================================================
+# Streaming statistics engine
+#
+# Every statistic is an accumulator object exposing:
+#   - name          : key used to retrieve it from a SamStats container,
+#   - add(record)   : consumes one SamRecord,
+#   - merge(other)  : folds in the state of another accumulator of the same type,
+#   - result()      : returns the value the analysis functions used to return,
+#   - to_dict() / from_dict(state) : JSON-compatible state, so partial
+#     statistics can be saved, shipped to another node and merged there,
+# and optionally:
+#   - add_columns(columns) : consumes a whole block of reads at once, given as
+#     a sam_mmap.ColumnBlock (integer columns as NumPy arrays).
+# A SamStats container feeds each record to all of its accumulators, so the
+# whole file is analysed in a single pass with constant memory.
+# ==========================================================================
+
+# ==========================================================================
+# Accumulator: mapped and unmapped reads
+# ==========================================================================
+class ReadCounter:
+    name = "reads"
+
+    def __init__(self):
+        self.total = 0  # Total number of reads.
+        self.mapped = 0  # Reads whose FLAG bit 4 is not set.
+
+    def add(self, record):
+        self.total += 1
+        if not record.flag & 4:
+            self.mapped += 1
+
+    def add_columns(self, columns):
+        flags = columns["flag"]
+        self.total += len(flags)
+        self.mapped += int(((flags & 4) == 0).sum())
+
+    def merge(self, other):
+        self.total += other.total
+        self.mapped += other.mapped
+
+    def result(self):
+        return self.mapped, self.total - self.mapped  # Same shape as count_reads().
+
+    def to_dict(self):
+        return {"total": self.total, "mapped": self.mapped}
+
+    @classmethod
+    def from_dict(cls, state):
+        acc = cls()
+        acc.total, acc.mapped = state["total"], state["mapped"]
+        return acc
+
+
+# ==========================================================================
+# Accumulator: first and second mapped reads
+# ==========================================================================
+class PairOrderCounter:
+    name = "pair_order"
+
+    def __init__(self):
+        self.first = 0  # Mapped reads with FLAG bit 64.
+        self.second = 0  # Mapped reads with FLAG bit 128.
+
+    def add(self, record):
+        flag = record.flag
+        if flag & 4:  # Skip unmapped reads.
+            return
+        if flag & 64:
+            self.first += 1
+        if flag & 128:
+            self.second += 1
+
+    def add_columns(self, columns):
+        flags = columns["flag"]
+        mapped = (flags & 4) == 0
+        self.first += int((mapped & ((flags & 64) != 0)).sum())
+        self.second += int((mapped & ((flags & 128) != 0)).sum())
+
+    def merge(self, other):
+        self.first += other.first
+        self.second += other.second
+
+    def result(self):
+        return {"first_reads_mapped": self.first, "second_reads_mapped": self.second}
+
+    def to_dict(self):
+        return {"first": self.first, "second": self.second}
+
+    @classmethod
+    def from_dict(cls, state):
+        acc = cls()
+        acc.first, acc.second = state["first"], state["second"]
+        return acc
+
+
+# ==========================================================================
+# Accumulator: chromosome extents and read counts
+# ==========================================================================
+def summarize_chromosome(min_pos, max_pos, read_count):
+    # Builds the per-chromosome statistics reported by analyze_chromosome_coverage().
+    coverage_length = max_pos - min_pos + 1  # Total covered region length.
+    coverage = read_count / coverage_length  # Average coverage of reads.
+    coverage_percentage = (coverage_length / max_pos) * 100  # Coverage percentage.
+    return {
+        "min_position": min_pos,
+        "max_position": max_pos,
+        "coverage_length": coverage_length,
+        "read_count": read_count,
+        "coverage": round(coverage, 2),
+        "coverage_percentage": round(coverage_percentage, 2)
+    }
+
+
+class ChromosomeCoverage:
+    name = "chromosomes"
+
+    def __init__(self):
+        # Only [min position, max position, read count] is kept per chromosome,
+        # instead of the list of every read position.
+        self.extents = {}
+
+    def add(self, record):
+        chrom = record.rname
+        if chrom == "*":  # Skip unmapped reads with RNAME == "*".
+            return
+        pos = record.pos
+        extent = self.extents.get(chrom)
+        if extent is None:
+            self.extents[chrom] = [pos, pos, 1]
+            return
+        if pos < extent[0]:
+            extent[0] = pos
+        elif pos > extent[1]:
+            extent[1] = pos
+        extent[2] += 1
+
+    def add_columns(self, columns):
+        import numpy as np  # Only called with the NumPy columns of sam_mmap.py.
+        names, codes = columns.codes("rname")  # Codes follow the order of first appearance.
+        order = np.argsort(codes, kind="stable")  # Group the reads of each chromosome together.
+        codes = codes[order]
+        positions = columns["pos"][order]
+        starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+        mins = np.minimum.reduceat(positions, starts).tolist()
+        maxs = np.maximum.reduceat(positions, starts).tolist()
+        counts = np.diff(np.r_[starts, len(codes)]).tolist()
+        for code, min_pos, max_pos, count in zip(codes[starts].tolist(), mins, maxs, counts):
+            if names[code] != b"*":  # Skip unmapped reads with RNAME == "*".
+                self.add_extent(names[code].decode(), min_pos, max_pos, count)
+
+    def add_extent(self, chrom, min_pos, max_pos, count):
+        extent = self.extents.get(chrom)
+        if extent is None:
+            self.extents[chrom] = [min_pos, max_pos, count]
+            return
+        extent[0] = min(extent[0], min_pos)
+        extent[1] = max(extent[1], max_pos)
+        extent[2] += count
+
+    def merge(self, other):
+        for chrom, (min_pos, max_pos, count) in other.extents.items():
+            self.add_extent(chrom, min_pos, max_pos, count)
+
+    def result(self):
+        return {chrom: summarize_chromosome(*extent) for chrom, extent in self.extents.items()}
+
+    def to_dict(self):
+        return {"extents": self.extents}
+
+    @classmethod
+    def from_dict(cls, state):
+        acc = cls()
+        acc.extents = {chrom: list(extent) for chrom, extent in state["extents"].items()}
+        return acc
+
+
+# ==========================================================================
+# Accumulator: reads per MAPQ quality score
+# ==========================================================================
+class QualityCounter:
+    name = "quality"
+
+    def __init__(self):
+        self.counts = defaultdict(int)  # MAPQ score -> number of reads.
+
+    def add(self, record):
+        self.counts[record.mapq] += 1
+
+    def add_columns(self, columns):
+        for quality, count in columns.counts("mapq").items():
+            self.counts[quality] += count
+
+    def merge(self, other):
+        for quality, count in other.counts.items():
+            self.counts[quality] += count
+
+    def result(self):
+        return self.counts
+
+    def to_dict(self):
+        return {"counts": {str(quality): count for quality, count in self.counts.items()}}
+
+    @classmethod
+    def from_dict(cls, state):
+        acc = cls()
+        for quality, count in state["counts"].items():  # JSON object keys are strings.
+            acc.counts[int(quality)] = count
+        return acc
+
+
+# ==========================================================================
+# Accumulator: partially mapped reads
+# ==========================================================================
+class PartialMappingCounter:
+    name = "partial"
+
+    def __init__(self):
+        self.count = 0  # Reads whose CIGAR contains S, H, I, N or D.
+
+    def add(self, record):
+        if parse_cigar(record.cigar).partial:  # "*" parses to no operation: never partial.
+            self.count += 1
+
+    def add_columns(self, columns):
+        for cigar, count in columns.counts("cigar").items():  # Each distinct CIGAR decoded once.
+            if parse_cigar(cigar.decode()).partial:
+                self.count += count
+
+    def merge(self, other):
+        self.count += other.count
+
+    def result(self):
+        return self.count
+
+    def to_dict(self):
+        return {"count": self.count}
+
+    @classmethod
+    def from_dict(cls, state):
+        acc = cls()
+        acc.count = state["count"]
+        return acc
+
+
+def default_accumulators():
+    # Accumulators computing every statistic of the analysis report.
+    return [ReadCounter(), PairOrderCounter(), ChromosomeCoverage(), QualityCounter(), PartialMappingCounter()]
+
+
+# ==========================================================================
+# SamStats: container feeding records to a set of accumulators
+# ==========================================================================
+class SamStats:
+    def __init__(self, accumulators=None):
+        if accumulators is None:
+            accumulators = default_accumulators()
+        self.accumulators = {acc.name: acc for acc in accumulators}
+
+    def __getitem__(self, name):
+        return self.accumulators[name]
+
+    def __contains__(self, name):
+        return name in self.accumulators
+
+    def add(self, record):
+        for acc in self.accumulators.values():
+            acc.add(record)
+
+    def update(self, records):
+        # Consumes an iterable of records in a single pass.
+        adders = [acc.add for acc in self.accumulators.values()]  # Bound methods, looked up once.
+        for record in records:
+            for add in adders:
+                add(record)
+        return self
+
+    def update_columns(self, blocks):
+        # Consumes column blocks of sam_mmap.py (every accumulator must have add_columns).
+        adders = [acc.add_columns for acc in self.accumulators.values()]
+        for columns in blocks:
+            for add in adders:
+                add(columns)
+        return self
+
+    def merge(self, other):
+        # Folds another SamStats into this one, accumulator by accumulator.
+        for name, acc in other.accumulators.items():
+            if name in self.accumulators:
+                self.accumulators[name].merge(acc)
+        return self
+
+
+    def to_dict(self):
+        # JSON-compatible state of every accumulator, tagged with its class.
+        return {
+            "version": STATS_FORMAT_VERSION,
+            "accumulators": [{"type": f"{type(acc).__module__}.{type(acc).__name__}", "state": acc.to_dict()}
+                             for acc in self.accumulators.values()],
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        # Rebuilds a SamStats from to_dict() output.
+        if data.get("version") != STATS_FORMAT_VERSION:
+            raise ValueError(f"Unsupported statistics format version: {data.get('version')}.")
+        accumulators = []
+        for item in data["accumulators"]:
+            if item.get("type") not in ACCUMULATOR_TYPES.values():  # Never import a module named by the file.
+                raise ValueError(f"Unknown accumulator type in saved statistics: {item.get('type')!r}.")
+            module_name, class_name = item["type"].rsplit(".", 1)
+            acc_class = getattr(importlib.import_module(module_name), class_name)
+            accumulators.append(acc_class.from_dict(item["state"]))
+        return cls(accumulators)
+
+
+STATS_FORMAT_VERSION = 1  # Version of the SamStats.to_dict() format.
+ACCUMULATOR_TYPES = {  # Accumulator name -> "module.Class" that SamStats.from_dict() may rebuild.
+    "reads": "sam_stats.ReadCounter",
+    "pair_order": "sam_stats.PairOrderCounter",
+    "chromosomes": "sam_stats.ChromosomeCoverage",
+    "quality": "sam_stats.QualityCounter",
+    "partial": "sam_stats.PartialMappingCounter",
+    "cigar": "sam_cigar.CigarStats",
+    "pairs": "sam_pairs.PairStats",
+    "depth": "sam_depth.DepthCoverage",
+    "sequence": "sam_sequence.SequenceStats",
+    "bins": "sam_bins.BinnedCoverage",
+    "duplicates": "sam_duplicates.DuplicateStats",
+}
+
+
+def merge_stats(stats_list):
+    # Merges partial statistics (in order) into a new SamStats.
+    merged = None
+    for stats in stats_list:
+        if merged is None:
+            merged = SamStats.from_dict(stats.to_dict())  # Copy: the inputs are left untouched.
+        else:
+            merged.merge(stats)
+    return merged if merged is not None else SamStats()
+
+
+def save_stats(stats, path):
+    # Writes partial statistics as JSON.
+    with open(path, "w") as file:
+        json.dump(stats.to_dict(), file)
+
+
+def load_stats(path):
+    # Reads partial statistics written by save_stats().
+    with open(path) as file:
+        return SamStats.from_dict(json.load(file))
+
+
+def compute_stats(records, accumulators=None):
+    # Runs one pass over the records and returns the filled SamStats.
+    return SamStats(accumulators).update(records)
+
+
+# ==========================================================================
+# Report tables built from the accumulated statistics
+# ==========================================================================
+def group_quality_by_intervals(quality_counts, interval_size=10):
+    # Groups quality scores into intervals for better visualization.
+    grouped_counts = defaultdict(int)
+    for quality, count in quality_counts.items():
+        interval = (quality // interval_size) * interval_size  # Group by interval.
+        grouped_counts[interval] += count  # Increment the interval count.
+    return dict(sorted(grouped_counts.items()))  # Return sorted grouped counts.
+
+
+def percentage(value, total):
+    # Formats value / total as a percentage string (0.00% for an empty file).
+    return f"{(value / total) * 100:.2f}%" if total else "0.00%"
+
+
+def summary_table(stats):
+    # Rows of the "Summary Statistics" table.
+    mapped_reads, unmapped_reads = stats["reads"].result()
+    read_pairs_stats = stats["pair_order"].result()
+    partially_mapped_reads = stats["partial"].result()
+    total_reads = stats["reads"].total
+    return [
+        ["Total Reads", total_reads, "100.00%"],
+        ["Mapped Reads", mapped_reads, percentage(mapped_reads, total_reads)],
+        ["Unmapped Reads", unmapped_reads, percentage(unmapped_reads, total_reads)],
+        ["First Reads Mapped", read_pairs_stats['first_reads_mapped'],
+         percentage(read_pairs_stats['first_reads_mapped'], total_reads)],
+        ["Second Reads Mapped", read_pairs_stats['second_reads_mapped'],
+         percentage(read_pairs_stats['second_reads_mapped'], total_reads)],
+        ["Partially Mapped Reads", partially_mapped_reads, percentage(partially_mapped_reads, total_reads)],
+    ]
+
+
+def chromosome_table(stats):
+    # Rows of the "Chromosome Coverage Statistics" table.
+    # The Read Count column reports the number of mapped reads, as the report always has.
+    mapped_reads = stats["reads"].mapped
+    return [
+        [chrom, chrom_stats["min_position"], chrom_stats["max_position"], chrom_stats["coverage_length"],
+         mapped_reads, chrom_stats["coverage"], chrom_stats["coverage_percentage"]]
+        for chrom, chrom_stats in stats["chromosomes"].result().items()
+    ]
+
+
+def quality_table(stats):
+    # Rows of the "Quality Count Statistics" table.
+    grouped_quality_count = group_quality_by_intervals(stats["quality"].result())
+    return [[str(key), val] for key, val in grouped_quality_count.items()]
+
+
+SUMMARY_HEADERS = ["Statistic", "Value", "Percentage"]
+CHROMOSOME_HEADERS = ["Chromosome", "Min Position", "Max Position", "Region Length",
+                      "Read Count", "Average Coverage", "% Coverage"]
+QUALITY_HEADERS = ["Interval", "Number", ]
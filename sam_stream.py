@@ -0,0 +1,107 @@
+import itertools  # Puts the first alignment line back in front of the stream.
+import json  # Snapshots are JSON files.
+import os  # Atomic replacement of the snapshot file.
+import sys  # Standard input and the terminal.
+import time  # Refresh timer.
+from sam_report import REPORT_SECTIONS, format_report, tables_to_dict  # Report tables.
+
+# ==========================================================================
+# Standard input streaming with live statistics
+#
+# `analyse_sam.py -` reads the alignments from a pipe (e.g. straight from
+# `bwa mem`) through a fixed-size buffer, so nothing is written to disk and
+# memory does not grow with the input. The header is read first for the @SQ
+# lengths, then the records flow through the accumulators as usual. Every
+# --refresh-records records or --refresh-seconds seconds, the summary and
+# MAPQ tables of the records seen so far are shown on the terminal or
+# written to a JSON snapshot; the full report is produced at end of input.
+# ==========================================================================
+
+STREAM_BUFFER = 1 << 20  # Bytes read from the pipe at a time.
+DEFAULT_REFRESH_RECORDS = 100_000
+DEFAULT_REFRESH_SECONDS = 5.0
+CLOCK_CHECK = 0xff  # Look at the clock every 256 records only.
+LIVE_SECTIONS = ["Summary Statistics", "Quality Count Statistics"]
+CLEAR_SCREEN = "\x1b[H\x1b[J"
+
+
+def open_stdin(buffer_size=STREAM_BUFFER):
+    # Standard input as a text stream with a bounded read buffer. Compressed input is refused:
+    # the gzip/BGZF readers of sam_bam.py need a seekable file.
+    stream = open(sys.stdin.fileno(), "r", buffering=buffer_size, closefd=False)
+    if stream.buffer.peek(2)[:2] == b"\x1f\x8b":
+        raise ValueError("compressed input cannot be read from standard input, pipe plain SAM "
+                         "(e.g. 'samtools view -h file.bam | analyse_sam.py -').")
+    return stream
+
+
+def read_stream_header(lines):
+    # Reads the "@" header of a stream. Returns (header lines, iterator over the rest of the stream).
+    lines = iter(lines)
+    header = []
+    for line in lines:
+        if not line.startswith("@"):
+            return header, itertools.chain([line], lines)
+        header.append(line.rstrip("\r\n"))
+    return header, iter(())
+
+
+def live_tables(stats):
+    # Summary and MAPQ tables of the records seen so far (cheap enough to rebuild at every refresh).
+    return {title: builder(stats) for title, needed, builder in REPORT_SECTIONS
+            if title in LIVE_SECTIONS and needed in stats}
+
+
+def write_snapshot(path, tables, records, elapsed, final=False):
+    # Written to a temporary file then renamed, so a reader never sees a half-written snapshot.
+    snapshot = {"records": records, "elapsed_seconds": round(elapsed, 3), "final": final}
+    snapshot.update(tables_to_dict(tables))
+    temporary = f"{path}.tmp"
+    with open(temporary, "w") as file:
+        json.dump(snapshot, file, indent=2)
+    os.replace(temporary, path)
+
+
+class LiveReport:
+    # Refreshes the live tables of `stats` while its records stream in.
+    def __init__(self, stats, snapshot=None, every_records=DEFAULT_REFRESH_RECORDS,
+                 every_seconds=DEFAULT_REFRESH_SECONDS, stream=sys.stderr):
+        self.stats = stats
+        self.snapshot = snapshot  # JSON file, or None for the terminal.
+        self.every_records = every_records  # 0: no refresh on the record count.
+        self.every_seconds = every_seconds  # 0: no refresh on time.
+        self.stream = stream
+        self.records = 0
+        self.started = time.perf_counter()
+
+    def track(self, records):
+        # Yields the records; once a record has gone through the accumulators, refreshes when due.
+        next_refresh = self.every_records or float("inf")
+        last = time.perf_counter()
+        count = 0
+        for record in records:
+            yield record
+            count += 1
+            if count >= next_refresh or (self.every_seconds and count & CLOCK_CHECK == 0
+                                         and time.perf_counter() - last >= self.every_seconds):
+                self.records = count
+                self.refresh()
+                next_refresh = count + (self.every_records or float("inf"))
+                last = time.perf_counter()
+        self.records = count
+
+    def refresh(self):
+        elapsed = time.perf_counter() - self.started
+        tables = live_tables(self.stats)
+        if self.snapshot:
+            write_snapshot(self.snapshot, tables, self.records, elapsed)
+            return
+        clear = CLEAR_SCREEN if self.stream.isatty() else ""
+        self.stream.write(f"{clear}--- {self.records:,} records after {elapsed:.1f} s ---"
+                          f"{format_report(tables)}\n")
+        self.stream.flush()
+
+    def finish(self, tables):
+        # End of input: the snapshot receives the full report.
+        if self.snapshot:
+            write_snapshot(self.snapshot, tables, self.records, time.perf_counter() - self.started, final=True)
@@ -0,0 +1,166 @@
+from array import array  # Compact typed buffers used while parsing.
+from collections import defaultdict  # Simplifies the handling of dictionaries.
+import numpy as np  # Vectorized operations on the columns.
+from sam_io import iter_sam_records  # Streaming SAM reader.
+from sam_cigar import parse_cigar  # Memoized CIGAR parser.
+from sam_stats import SamStats, summarize_chromosome
+
+# ==========================================================================
+# SamTable: columnar, typed storage of the alignments of a SAM file
+#
+# Instead of one dict per read, every numeric column is one NumPy array:
+#   flag (uint16), pos (int32), mapq (uint8), pnext (int32), tlen (int32).
+# RNAME and RNEXT are stored as integer codes into the shared `names` list,
+# CIGAR as ids into the deduplicated `cigars` pool. QNAME, SEQ and QUAL are
+# only kept when explicitly requested.
+# ==========================================================================
+class SamTable:
+    def __init__(self, flag, rname, pos, mapq, cigar, rnext, pnext, tlen, names, cigars,
+                 qname=None, seq=None, qual=None):
+        self.flag = flag
+        self.rname = rname
+        self.pos = pos
+        self.mapq = mapq
+        self.cigar = cigar
+        self.rnext = rnext
+        self.pnext = pnext
+        self.tlen = tlen
+        self.names = names  # Reference name for each RNAME/RNEXT code.
+        self.cigars = cigars  # CIGAR string for each CIGAR id.
+        self.qname = qname  # Optional list of read names.
+        self.seq = seq  # Optional list of sequences.
+        self.qual = qual  # Optional list of quality strings.
+
+    def __len__(self):
+        return len(self.flag)
+
+    @property
+    def nbytes(self):
+        # Memory used by the numeric columns.
+        return sum(column.nbytes for column in (self.flag, self.rname, self.pos, self.mapq,
+                                                self.cigar, self.rnext, self.pnext, self.tlen))
+
+    def code(self, name):
+        # Returns the integer code of a reference name, or -1 if it never occurs.
+        try:
+            return self.names.index(name)
+        except ValueError:
+            return -1
+
+    # ======================================================================
+    # Vectorized versions of the analysis functions of analyse_sam.py
+    # ======================================================================
+    def mapped_mask(self):
+        return (self.flag & 4) == 0  # Reads are mapped if FLAG bit 4 is not set.
+
+    def count_reads(self):
+        mapped_reads = int(np.count_nonzero(self.mapped_mask()))
+        return mapped_reads, len(self) - mapped_reads
+
+    def count_mapped_first_and_second(self):
+        mapped = self.mapped_mask()
+        return {
+            "first_reads_mapped": int(np.count_nonzero(mapped & ((self.flag & 64) != 0))),
+            "second_reads_mapped": int(np.count_nonzero(mapped & ((self.flag & 128) != 0))),
+        }
+
+    def chromosome_extents(self):
+        # Returns {chrom: [min position, max position, read count]} in order of first appearance.
+        star = self.code("*")
+        keep = self.rname != star  # Skip unmapped reads with RNAME == "*".
+        codes = self.rname[keep]
+        positions = self.pos[keep]
+        if len(codes) == 0:
+            return {}
+        order = np.argsort(codes, kind="stable")  # Group the reads of each chromosome together.
+        codes = codes[order]
+        positions = positions[order]
+        starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+        mins = np.minimum.reduceat(positions, starts)
+        maxs = np.maximum.reduceat(positions, starts)
+        counts = np.diff(np.r_[starts, len(codes)])
+        first_seen = order[starts]  # Stable sort: index of the first read of each chromosome.
+        extents = {}
+        for i in np.argsort(first_seen):  # Report chromosomes in order of first appearance.
+            extents[self.names[codes[starts[i]]]] = [int(mins[i]), int(maxs[i]), int(counts[i])]
+        return extents
+
+    def analyze_chromosome_coverage(self):
+        return {chrom: summarize_chromosome(*extent) for chrom, extent in self.chromosome_extents().items()}
+
+    def count_reads_by_quality(self):
+        quality_counts = defaultdict(int)
+        for quality, count in enumerate(np.bincount(self.mapq)):
+            if count:
+                quality_counts[quality] = int(count)
+        return quality_counts
+
+    def count_partially_mapped_reads(self):
+        # Each distinct CIGAR is parsed once; reads are then counted per CIGAR id.
+        partial = np.array([parse_cigar(cigar).partial for cigar in self.cigars], dtype=bool)
+        if not len(partial):
+            return 0
+        per_cigar = np.bincount(self.cigar, minlength=len(self.cigars))
+        return int(per_cigar[partial].sum())
+
+    def to_stats(self):
+        # Fills a SamStats container from the columns, without a pass over the records.
+        stats = SamStats()
+        mapped_reads, _ = self.count_reads()
+        stats["reads"].total = len(self)
+        stats["reads"].mapped = mapped_reads
+        pair_order = self.count_mapped_first_and_second()
+        stats["pair_order"].first = pair_order["first_reads_mapped"]
+        stats["pair_order"].second = pair_order["second_reads_mapped"]
+        stats["chromosomes"].extents = self.chromosome_extents()
+        stats["quality"].counts = self.count_reads_by_quality()
+        stats["partial"].count = self.count_partially_mapped_reads()
+        return stats
+
+
+# ==========================================================================
+# Function to build a SamTable from a stream of records
+# ==========================================================================
+def build_sam_table(records, with_sequences=False):
+    # Appends each record to typed array buffers, then wraps them as NumPy arrays.
+    flag, rname, pos, mapq, cigar = array('H'), array('i'), array('i'), array('B'), array('I')
+    rnext, pnext, tlen = array('i'), array('i'), array('i')
+    names, name_codes = [], {}  # Interned reference names.
+    cigars, cigar_ids = [], {}  # Deduplicated CIGAR pool.
+    qname, seq, qual = ([], [], []) if with_sequences else (None, None, None)
+
+    def intern(value, pool, ids):
+        code = ids.get(value)
+        if code is None:
+            code = ids[value] = len(pool)
+            pool.append(value)
+        return code
+
+    for record in records:
+        flag.append(record.flag)
+        rname.append(intern(record.rname, names, name_codes))
+        pos.append(record.pos)
+        mapq.append(record.mapq)
+        cigar.append(intern(record.cigar, cigars, cigar_ids))
+        rnext.append(intern(record.rnext, names, name_codes))
+        pnext.append(record.pnext)
+        tlen.append(record.tlen)
+        if with_sequences:
+            qname.append(record.qname)
+            seq.append(record.seq)
+            qual.append(record.qual)
+
+    return SamTable(np.frombuffer(flag, dtype=np.uint16), np.frombuffer(rname, dtype=np.int32),
+                    np.frombuffer(pos, dtype=np.int32), np.frombuffer(mapq, dtype=np.uint8),
+                    np.frombuffer(cigar, dtype=np.uint32), np.frombuffer(rnext, dtype=np.int32),
+                    np.frombuffer(pnext, dtype=np.int32), np.frombuffer(tlen, dtype=np.int32),
+                    names, cigars, qname, seq, qual)
+
+
+def load_sam_table(path, with_sequences=False, read_filter=None):
+    # Reads a SAM file into a SamTable. SEQ/QUAL/QNAME are only kept if asked.
+    # read_filter: sam_filter.ReadFilter; only the reads it keeps are stored.
+    records = iter_sam_records(path)
+    if read_filter:
+        records = filter(read_filter.matches, records)
+    return build_sam_table(records, with_sequences)
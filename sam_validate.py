@@ -0,0 +1,333 @@
+import sys  # Library to access command-line arguments.
+import argparse  # Parses the command-line options.
+import gzip  # Plain gzip-compressed SAM files.
+import mmap  # Line numbers of sampled errors are counted on a memory map.
+import os  # Library to manage files and directories.
+import re  # For working with regular expressions.
+from functools import lru_cache  # Query length of each distinct CIGAR computed once.
+from sam_cigar import parse_cigar  # Memoized CIGAR parser.
+from sam_parallel import align_to_line, split_byte_ranges  # Newline-aligned byte ranges.
+
+# ==========================================================================
+# Streaming SAM validator
+#
+# Checks the header (@SQ SN/LN) and every alignment line against the SAM
+# specification: 11 mandatory fields, field syntax, FLAG/POS/MAPQ/PNEXT/TLEN
+# ranges, CIGAR syntax, CIGAR query length == SEQ length, QUAL length == SEQ
+# length, and RNAME/RNEXT declared in @SQ. A valid line is recognized by a
+# single compiled regex over the raw bytes; the fields are only examined one
+# by one to explain why a line does not match.
+# Modes:
+#   - full (default)    every line, errors reported by line number;
+#   - --fail-fast       stops at the first error;
+#   - --sample N        the first lines and N-line blocks spread over the file;
+#   - --jobs N          full mode on N newline-aligned byte ranges in parallel.
+# ==========================================================================
+
+READ_BUFFER = 1 << 20  # Bytes per buffered read.
+DEFAULT_MAX_ERRORS = 100  # Errors kept (and printed); the others are only counted.
+SAMPLE_BLOCKS = 32  # Blocks read in sampled mode (plus the head of the file).
+MAX_POSITION = (1 << 31) - 1
+NAME = rb"[0-9A-Za-z!#$%&+./:;?@^_|~-][0-9A-Za-z!#$%&*+./:;=?@^_|~-]*"  # RNAME syntax of the specification.
+
+LINE_PATTERN = re.compile(
+    rb"([!-?A-~]{1,254}|\*)\t([0-9]{1,5})\t(\*|" + NAME + rb")\t([0-9]{1,10})\t([0-9]{1,3})\t"
+    rb"(\*|(?:[0-9]+[MIDNSHP=X])+)\t(\*|=|" + NAME + rb")\t([0-9]{1,10})\t(-?[0-9]{1,10})\t"
+    rb"(\*|[A-Za-z=.]+)\t([!-~]+)(?:\t.*)?\r?\n?")
+FIELD_PATTERNS = [  # (name, pattern) of the 11 mandatory fields, to explain a line that does not match.
+    ("QNAME", re.compile(rb"[!-?A-~]{1,254}|\*")),
+    ("FLAG", re.compile(rb"[0-9]+")),
+    ("RNAME", re.compile(rb"\*|" + NAME)),
+    ("POS", re.compile(rb"[0-9]+")),
+    ("MAPQ", re.compile(rb"[0-9]+")),
+    ("CIGAR", re.compile(rb"\*|(?:[0-9]+[MIDNSHP=X])+")),
+    ("RNEXT", re.compile(rb"\*|=|" + NAME)),
+    ("PNEXT", re.compile(rb"[0-9]+")),
+    ("TLEN", re.compile(rb"-?[0-9]+")),
+    ("SEQ", re.compile(rb"\*|[A-Za-z=.]+")),
+    ("QUAL", re.compile(rb"[!-~]+")),
+]
+RANGES = {"FLAG": (0, 65535), "POS": (0, MAX_POSITION), "MAPQ": (0, 255), "PNEXT": (0, MAX_POSITION),
+          "TLEN": (-MAX_POSITION, MAX_POSITION)}
+
+
+class ValidationError(Exception):
+    pass
+
+
+@lru_cache(maxsize=1 << 16)
+def cigar_query_length(cigar):
+    return parse_cigar(cigar.decode()).query_length
+
+
+# ==========================================================================
+# Header
+# ==========================================================================
+def parse_header(lines):
+    # Returns (set of @SQ names, [(line number, message), ...]) for the header lines.
+    names, errors = set(), []
+    for number, line in enumerate(lines, 1):
+        text = line.rstrip(b"\r\n")
+        if not re.match(rb"@[A-Za-z][A-Za-z](\t|$)", text) and not text.startswith(b"@CO"):
+            errors.append((number, f"invalid header line '{text[:40].decode(errors='replace')}'"))
+            continue
+        if not text.startswith(b"@SQ"):
+            continue
+        fields = dict(field.split(b":", 1) for field in text.split(b"\t")[1:] if b":" in field)
+        name, length = fields.get(b"SN"), fields.get(b"LN")
+        if name is None or length is None:
+            errors.append((number, "@SQ line without SN or LN"))
+            continue
+        if not length.isdigit() or not 1 <= int(length) <= MAX_POSITION:
+            errors.append((number, f"@SQ LN out of range [1, {MAX_POSITION}]"))
+        if name in names:
+            errors.append((number, f"@SQ SN '{name.decode()}' declared twice"))
+        names.add(name)
+    return names, errors
+
+
+# ==========================================================================
+# Alignment lines
+# ==========================================================================
+def explain_line(line, references):
+    # Returns the errors of a line that does not match LINE_PATTERN.
+    fields = line.rstrip(b"\r\n").split(b"\t")
+    if len(fields) < 11:
+        return [f"{len(fields)} fields, the 11 mandatory fields are required"]
+    errors = []
+    for (name, pattern), value in zip(FIELD_PATTERNS, fields):
+        if not pattern.fullmatch(value):
+            errors.append(f"invalid {name} '{value[:40].decode(errors='replace')}'")
+    return errors or check_values(fields[:11], references)
+
+
+def check_values(fields, references):
+    # Range, length and @SQ checks of the 11 syntactically valid fields (bytes).
+    qname, flag, rname, pos, mapq, cigar, rnext, pnext, tlen, seq, qual = fields
+    errors = []
+    for name, value in (("FLAG", flag), ("POS", pos), ("MAPQ", mapq), ("PNEXT", pnext), ("TLEN", tlen)):
+        low, high = RANGES[name]
+        if not low <= int(value) <= high:
+            errors.append(f"{name} {int(value)} out of range [{low}, {high}]")
+    if rname != b"*" and rname not in references:
+        errors.append(f"RNAME '{rname.decode()}' is not declared in @SQ")
+    if rnext not in (b"*", b"=") and rnext not in references:
+        errors.append(f"RNEXT '{rnext.decode()}' is not declared in @SQ")
+    if seq != b"*":
+        if cigar != b"*" and cigar_query_length(cigar) != len(seq):
+            errors.append(f"CIGAR query length {cigar_query_length(cigar)} does not match SEQ length {len(seq)}")
+        if qual != b"*" and len(qual) != len(seq):
+            errors.append(f"QUAL length {len(qual)} does not match SEQ length {len(seq)}")
+    elif qual != b"*":
+        errors.append("QUAL given without SEQ")
+    return errors
+
+
+def check_line(line, references, match=LINE_PATTERN.fullmatch):
+    # Returns the list of errors of one alignment line (empty when valid).
+    found = match(line)
+    if found is None:
+        return explain_line(line, references)
+    flag, pos, mapq, pnext, tlen = found.group(2, 4, 5, 8, 9)
+    in_range = True
+    if len(flag) == 5 and int(flag) > 65535 or len(pos) == 10 and int(pos) > MAX_POSITION \
+            or len(mapq) == 3 and int(mapq) > 255 or len(pnext) == 10 and int(pnext) > MAX_POSITION \
+            or len(tlen) >= 10 and abs(int(tlen)) > MAX_POSITION:
+        in_range = False  # Only numbers as long as the limits need to be converted.
+    rname, cigar, rnext, seq, qual = found.group(3, 6, 7, 10, 11)
+    if in_range and (rname == b"*" or rname in references) \
+            and (rnext == b"*" or rnext == b"=" or rnext in references):
+        if seq == b"*":
+            if qual == b"*":
+                return []
+        elif (cigar == b"*" or cigar_query_length(cigar) == len(seq)) and (qual == b"*" or len(qual) == len(seq)):
+            return []
+    return check_values(found.groups(), references)
+
+
+def validate_lines(lines, references, first_line=1, fail_fast=False, max_errors=DEFAULT_MAX_ERRORS):
+    # Validates alignment lines; returns (lines checked, error count, [(line number, message), ...]).
+    errors, error_count, checked = [], 0, 0
+    for checked, line in enumerate(lines, 1):
+        problems = check_line(line, references)
+        if not problems:
+            continue
+        error_count += len(problems)
+        for problem in problems:
+            if len(errors) < max_errors:
+                errors.append((first_line + checked - 1, problem))
+        if fail_fast:
+            break
+    return checked, error_count, errors
+
+
+# ==========================================================================
+# Reading the file
+# ==========================================================================
+def open_sam(path):
+    # Opens a text SAM file (plain or gzip) for binary reading; BAM files are refused.
+    with open(path, "rb") as file:
+        compressed = file.read(2) == b"\x1f\x8b"
+    if not compressed:
+        return open(path, "rb", buffering=READ_BUFFER)
+    file = gzip.open(path, "rb")
+    if file.peek(4)[:4] == b"BAM\x01":
+        file.close()
+        raise ValidationError(f"'{path}' is a BAM file: only text SAM (plain or gzip) is validated.")
+    return file
+
+
+def read_header(file):
+    # Reads the header lines; returns (header lines, first alignment line or b"").
+    header = []
+    for line in file:
+        if not line.startswith(b"@"):
+            return header, line
+        header.append(line)
+    return header, b""
+
+
+class LineCounter:
+    # 1-based numbers of the lines starting at increasing byte offsets of a memory map: the newlines
+    # before each offset are counted from the previous one, so the file is scanned at most once.
+    def __init__(self, mapped):
+        self.mapped = mapped
+        self.position = 0
+        self.count = 0
+
+    def line_number_at(self, offset):
+        while self.position < offset:
+            end = min(self.position + READ_BUFFER, offset)
+            self.count += self.mapped[self.position:end].count(b"\n")
+            self.position = end
+        return self.count + 1
+
+
+def validate_range(path, start, end, references, fail_fast=False, max_errors=DEFAULT_MAX_ERRORS):
+    # Worker: validates the lines of [start, end); error line numbers are relative to the range (1-based).
+    with open(path, "rb", buffering=READ_BUFFER) as file:
+        file.seek(start)
+        remaining = [end - start]
+
+        def lines():
+            for line in file:
+                yield line
+                remaining[0] -= len(line)
+                if remaining[0] <= 0:
+                    return
+        return validate_lines(lines(), references, 1, fail_fast, max_errors)
+
+
+def sample_offsets(path, start, blocks):
+    # Offsets of `blocks` line-aligned positions spread over the body (after the head block).
+    size = os.path.getsize(path)
+    step = (size - start) // (blocks + 1)
+    offsets = []
+    with open(path, "rb") as file:
+        for i in range(1, blocks + 1):
+            offset = align_to_line(file, start + i * step, size)
+            if offset < size and (not offsets or offset > offsets[-1]):
+                offsets.append(offset)
+    return offsets
+
+
+def validate_file(path, fail_fast=False, sample=None, jobs=1, max_errors=DEFAULT_MAX_ERRORS):
+    # Returns {"lines_checked", "error_count", "errors": [(line number, message), ...], "sampled"}.
+    with open_sam(path) as file:
+        header, first = read_header(file)
+        references, errors = parse_header(header)
+        if not header:
+            errors.append((1, "no header: the file does not start with '@' lines"))
+        if errors and fail_fast:
+            return {"lines_checked": 0, "error_count": len(errors), "errors": errors[:1],
+                    "sampled": sample is not None}
+        body_start = sum(len(line) for line in header)
+        first_line = len(header) + 1
+        if isinstance(file, gzip.GzipFile) or (jobs <= 1 and sample is None):
+            lines = _prepend_line(first, file) if first else file
+            if sample is not None:  # Compressed input cannot be sampled by offset: check the head only.
+                lines = (line for _, line in zip(range(sample), lines))
+            checked, count, found = validate_lines(lines, references, first_line, fail_fast,
+                                                   max_errors - len(errors))
+            return {"lines_checked": checked, "error_count": len(errors) + count, "errors": errors + found,
+                    "sampled": sample is not None}
+
+    if sample is not None:
+        # Head of the file, then blocks spread over the rest; line numbers are computed for errors only.
+        block_lines = max(sample // (SAMPLE_BLOCKS + 1), 1)
+        starts = [body_start] + sample_offsets(path, body_start, SAMPLE_BLOCKS)
+        total_checked, error_count = 0, len(errors)
+        with open(path, "rb", buffering=READ_BUFFER) as file, \
+                mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            counter = LineCounter(mapped)
+            for start in starts:
+                file.seek(start)
+                lines = (line for _, line in zip(range(block_lines), file))
+                checked, count, found = validate_lines(lines, references, 1, fail_fast, max_errors - len(errors))
+                total_checked += checked
+                error_count += count
+                if found:
+                    base = first_line if start == body_start else counter.line_number_at(start)
+                    errors.extend((base + number - 1, message) for number, message in found)
+                    if fail_fast:
+                        break
+        return {"lines_checked": total_checked, "error_count": error_count, "errors": errors, "sampled": True}
+
+    # Parallel full mode: newline-aligned byte ranges, line numbers rebuilt from the per-range line counts.
+    from concurrent.futures import ProcessPoolExecutor  # Only loaded when a pool is needed.
+    ranges = split_byte_ranges(path, jobs, body_start)
+    total_checked, error_count = 0, len(errors)
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(validate_range, path, start, end, references, fail_fast, max_errors)
+                   for start, end in ranges]
+        for future in futures:  # In file order, so that line numbers add up.
+            checked, count, found = future.result()
+            errors.extend((first_line + total_checked + number - 1, message) for number, message in found)
+            total_checked += checked
+            error_count += count
+            if fail_fast and found:
+                for other in futures:
+                    other.cancel()
+                break
+    return {"lines_checked": total_checked, "error_count": error_count, "errors": errors[:max_errors],
+            "sampled": False}
+
+
+def _prepend_line(first, lines):
+    yield first
+    yield from lines
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Validate a SAM file against the SAM specification.")
+    parser.add_argument("sam_file", help="SAM file to validate (plain or gzip-compressed text).")
+    parser.add_argument("--fail-fast", action="store_true", help="Stop at the first error.")
+    parser.add_argument("--sample", type=float, metavar="LINES",
+                        help="Quick mode: check about LINES lines, from the head and blocks spread over the file.")
+    parser.add_argument("--jobs", "-j", type=int, default=1,
+                        help="Validate the whole file with this many processes (default: 1).")
+    parser.add_argument("--max-errors", type=int, default=DEFAULT_MAX_ERRORS,
+                        help="Number of errors printed (default: %(default)s).")
+    args = parser.parse_args()
+
+    sam_file = args.sam_file
+    if not os.path.isfile(sam_file):
+        print(f"Error: '{sam_file}' is not a valid file.")
+        sys.exit(1)
+    if os.path.getsize(sam_file) == 0:
+        print(f"Error: The file '{sam_file}' is empty.")
+        sys.exit(1)
+    try:
+        result = validate_file(sam_file, args.fail_fast, int(args.sample) if args.sample else None,
+                               args.jobs, args.max_errors)
+    except (OSError, ValidationError) as error:
+        print(f"Error: {error}")
+        sys.exit(1)
+
+    for number, message in sorted(result["errors"]):
+        print(f"line {number}: {message}")
+    checked = f"{result['lines_checked']:,} alignment lines checked" + (", sampled" if result["sampled"] else "")
+    if result["error_count"]:
+        print(f"Error: The file '{sam_file}' is not a valid SAM file: {result['error_count']:,} errors, {checked}.")
+        sys.exit(1)
+    print(f"The file '{sam_file}' is valid and ready for analysis ({checked}).")
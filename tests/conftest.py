@@ -0,0 +1,78 @@
+import functools  # Accumulator factories of the report.
+import json  # Reports are compared as JSON.
+import os  # Library to manage files and directories.
+import subprocess  # Runs analyse_sam.py as a command.
+import sys  # The modules live at the root of the repository.
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sam_generate import generate_sam  # Deterministic synthetic SAM files.
+from sam_io import iter_sam_records, read_references  # Streaming SAM reader, @SQ lines.
+from sam_report import report_accumulators, report_tables, tables_to_dict  # Statistics of the report.
+from sam_stats import SamStats  # Single-pass statistics engine.
+
+TEST_MAPPING = os.path.join(ROOT, "test_mapping.sam")
+
+
+def report_json(stats):
+    # The JSON report of the statistics, the form compared between input formats and code paths.
+    return json.dumps(tables_to_dict(report_tables(stats)), sort_keys=True)
+
+
+def record_stats(path, factory):
+    # Reference: the streaming record parser.
+    return SamStats(factory()).update(iter_sam_records(path))
+
+
+def analyse_json(path, *options):
+    # The JSON report printed by analyse_sam.py, in the form of report_json().
+    output = subprocess.run([sys.executable, os.path.join(ROOT, "analyse_sam.py"), path, "--format", "json"]
+                            + list(options), capture_output=True, text=True, check=True).stdout
+    return json.dumps(json.loads(output), sort_keys=True)
+
+
+def add_fixture_reads(path):
+    # Appends reads the generator never writes: exact duplicates of every 40th mapped read (under a new
+    # QNAME) and secondary/supplementary copies of a few others.
+    with open(path) as file:
+        lines = file.read().splitlines()
+    body = [line.split("\t") for line in lines if not line.startswith("@")]
+    mapped = [fields for fields in body if not int(fields[1]) & 4]
+    extra = []
+    for index, fields in enumerate(mapped[::40]):
+        extra.append("\t".join([f"dup{index}"] + fields[1:]))
+    for index, fields in enumerate(mapped[7::97]):
+        flag = int(fields[1]) | (256 if index % 2 else 2048)
+        extra.append("\t".join([f"alt{index}", str(flag)] + fields[2:]))
+    with open(path, "a") as file:
+        file.writelines(line + "\n" for line in extra)
+    return path
+
+
+@pytest.fixture(scope="session")
+def synthetic_sam(tmp_path_factory):
+    # Paired and single reads on three references, with duplicates and secondary alignments.
+    path = str(tmp_path_factory.mktemp("data") / "synthetic.sam")
+    generate_sam(path, 3000, seed=7, paired=0.8, references=3, reference_length=200_000)
+    return add_fixture_reads(path)
+
+
+@pytest.fixture(scope="session")
+def sorted_sam(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("data") / "sorted.sam")
+    generate_sam(path, 2000, seed=3, references=2, reference_length=100_000, coordinate_sorted=True)
+    return path
+
+
+@pytest.fixture(scope="session")
+def factory(synthetic_sam):
+    # Accumulators of the full report of synthetic_sam (depth and sequence statistics included).
+    return functools.partial(report_accumulators, read_references(synthetic_sam), depth=True, sequences=True)
+
+
+@pytest.fixture(scope="session")
+def expected(synthetic_sam, factory):
+    # JSON report of synthetic_sam by the record parser.
+    return report_json(record_stats(synthetic_sam, factory))
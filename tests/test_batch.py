@@ -0,0 +1,25 @@
+import shutil
+
+import analyse_sam
+from sam_batch import analyse_file, run_batch
+from sam_io import iter_sam_records
+from sam_stats import SamStats
+
+
+def test_run_batch_merges_results_and_keeps_errors(synthetic_sam, tmp_path):
+    paths = []
+    for index in range(5):
+        paths.append(shutil.copy(synthetic_sam, tmp_path / f"sample{index}.sam"))
+    paths.insert(2, str(tmp_path / "missing.sam"))
+    combined, errors = run_batch([str(path) for path in paths], str(tmp_path / "reports"), jobs=2)
+    assert list(errors) == [str(tmp_path / "missing.sam")]
+    single = SamStats().update(iter_sam_records(synthetic_sam))
+    assert combined["reads"].total == 5 * single["reads"].total
+    assert (tmp_path / "reports" / "sample4_stats.json").exists()
+
+
+def test_batch_worker_draws_its_plots_itself(synthetic_sam, tmp_path, monkeypatch):
+    calls = []
+    monkeypatch.setattr(analyse_sam, "write_pdf_report", lambda *args, **options: calls.append(options))
+    analyse_file(synthetic_sam, str(tmp_path / "synthetic"), pdf=True)
+    assert calls == [{"plot_jobs": 1}]  # No plot pool inside a batch worker.
@@ -0,0 +1,62 @@
+import functools
+import os
+import shutil
+import sys
+import types
+
+import pytest
+
+from sam_cache import StatsCache, cached_stats
+from sam_duplicates import DuplicateStats
+from sam_io import iter_sam_records, read_references
+from sam_report import report_accumulators
+from sam_stats import SamStats
+
+
+def test_cache_key_includes_the_duplicate_mode(synthetic_sam, tmp_path):
+    path = shutil.copy(synthetic_sam, tmp_path / "growing.sam")
+    cache = StatsCache(str(tmp_path / "cache"))
+    references = read_references(path)
+    exact = functools.partial(report_accumulators, references, "exact")
+    bloom = functools.partial(report_accumulators, references, "bloom", 1)
+    assert cached_stats(path, exact, cache)[1] == "miss"
+    stats, status = cached_stats(path, bloom, cache)
+    assert status == "miss" and stats["duplicates"].result()["mode"] == "bloom"
+    assert cached_stats(path, functools.partial(report_accumulators, references, "bloom", 2), cache)[1] == "miss"
+    with open(synthetic_sam) as source, open(path, "a") as file:  # The file grows: each entry is extended.
+        file.writelines(line for line in source if not line.startswith("@"))
+    for factory, mode in ((exact, "exact"), (bloom, "bloom")):
+        stats, status = cached_stats(path, factory, cache)
+        assert status == "append" and stats["duplicates"].result()["mode"] == mode
+
+
+def test_merging_different_duplicate_modes_is_rejected(synthetic_sam):
+    exact = SamStats([DuplicateStats("exact")]).update(iter_sam_records(synthetic_sam))
+    bloom = SamStats([DuplicateStats("bloom", bloom_mb=1)]).update(iter_sam_records(synthetic_sam))
+    with pytest.raises(ValueError, match="bloom mode"):
+        exact.merge(bloom)
+    with pytest.raises(ValueError, match="different sizes"):
+        bloom.merge(SamStats([DuplicateStats("bloom", bloom_mb=2)]))
+
+
+def test_entry_of_a_renamed_class_is_a_miss(synthetic_sam, tmp_path, monkeypatch):
+    module = types.ModuleType("renamed_stats")
+    exec("class OldStats:\n    pass", module.__dict__)
+    module.OldStats.__module__ = "renamed_stats"
+    monkeypatch.setitem(sys.modules, "renamed_stats", module)
+    cache = StatsCache(str(tmp_path / "cache"))
+    cache.store(synthetic_sam, "config", {"stats": module.OldStats()})
+    assert cache.load(synthetic_sam, "config") is not None
+    monkeypatch.delitem(sys.modules, "renamed_stats")  # The module is gone: ModuleNotFoundError.
+    assert cache.load(synthetic_sam, "config") is None
+
+
+def test_evict_skips_entries_removed_by_another_process(synthetic_sam, tmp_path, monkeypatch):
+    cache = StatsCache(str(tmp_path / "cache"), max_bytes=0)
+    for config in ("a", "b"):
+        cache.store(synthetic_sam, config, {"stats": config})
+    listdir, remove = os.listdir, os.remove
+    monkeypatch.setattr(os, "listdir", lambda path: listdir(path) + ["gone.pkl"])
+    monkeypatch.setattr(os, "remove", lambda path: (remove(path), remove(path)))  # Removed twice: a race.
+    cache.store(synthetic_sam, "c", {"stats": "c"})
+    assert listdir(cache.directory) == []
@@ -0,0 +1,103 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from conftest import ROOT
+from sam_io import iter_sam_records, parse_sam_line, reference_span
+
+
+def imports_numpy(code):
+    # True when running code in a fresh interpreter loads NumPy.
+    code += "\nimport sys\nprint('numpy' in sys.modules)"
+    return subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True,
+                          check=True).stdout.split()[-1] == "True"
+
+
+def analyse(*arguments):
+    return subprocess.run([sys.executable, os.path.join(ROOT, "analyse_sam.py")] + [str(arg) for arg in arguments],
+                          capture_output=True, text=True)
+
+
+@pytest.mark.parametrize("option", [["--cache"], ["--jobs", "2"]])
+def test_region_rejects_unsupported_options(sorted_sam, tmp_path, option):
+    assert analyse("index", sorted_sam).returncode == 0
+    result = analyse(sorted_sam, "--region", "chr1:1000-5000", "--format", "json", "--cache-dir", tmp_path, *option)
+    assert result.returncode == 1
+    assert "--region cannot be used with --cache or --jobs" in result.stdout
+    assert analyse(sorted_sam, "--region", "chr1:1000-5000", "--format", "json").returncode == 0
+
+
+def overlaps(record, chrom, start, end):
+    # Brute force: the CIGAR span of the record overlaps chrom:start-end.
+    last = record.pos + max(reference_span(record.cigar), 1) - 1
+    return record.rname == chrom and record.pos <= end and last >= start
+
+
+def uncovered_interval(path, chrom):
+    # Longest stretch of chrom that no alignment covers.
+    spans = sorted((record.pos, record.pos + max(reference_span(record.cigar), 1) - 1)
+                   for record in iter_sam_records(path) if record.rname == chrom)
+    covered, gaps = 0, []
+    for start, end in spans:
+        if start > covered + 1:
+            gaps.append((covered + 1, start - 1))
+        covered = max(covered, end)
+    return max(gaps, key=lambda gap: gap[1] - gap[0])
+
+
+def test_region_matches_a_brute_force_overlap_filter(sorted_sam, tmp_path):
+    assert analyse("index", sorted_sam).returncode == 0
+    gap_start, gap_end = uncovered_interval(sorted_sam, "chr1")
+    empty = (gap_start + 10, gap_end - 10)  # No read there.
+    for region, chrom, start, end in (("chr1:10,000-60,000", "chr1", 10000, 60000),  # 16 kb windows 0 to 3.
+                                      (f"chr1:{empty[0]}-{empty[1]}", "chr1") + empty):
+        expected = tmp_path / "region.sam"
+        with open(sorted_sam) as file, open(expected, "w") as out:
+            for line in file:
+                record = parse_sam_line(line) if not line.startswith("@") else None
+                if record is None or overlaps(record, chrom, start, end):
+                    out.write(line)
+        result = analyse(sorted_sam, "--region", region, "--format", "json")
+        assert result.returncode == 0, result.stdout
+        report = json.loads(result.stdout)
+        assert report == json.loads(analyse(expected, "--format", "json").stdout), region
+        assert (report["summary"][0]["Value"] > 0) == (start == 10000), region
+
+
+def test_profile_uses_the_column_parser(synthetic_sam, tmp_path):
+    profile = tmp_path / "profile.json"
+    profiled = analyse(synthetic_sam, "--format", "json", "--profile", profile)
+    assert profiled.returncode == 0
+    assert json.loads(profiled.stdout) == json.loads(analyse(synthetic_sam, "--format", "json").stdout)
+    stages = {stage["name"] for stage in json.loads(profile.read_text())["stages"]}
+    assert {"parse", "parse:reads", "parse:duplicates"} <= stages
+
+
+@pytest.mark.parametrize("option", [["--min-mapq", "250"], ["--filter", "none:--min-mapq 250"]])
+def test_pdf_of_a_set_without_reads(synthetic_sam, tmp_path, option):
+    result = subprocess.run([sys.executable, os.path.join(ROOT, "analyse_sam.py"), synthetic_sam, *option],
+                            capture_output=True, text=True, cwd=tmp_path)
+    assert result.returncode == 0, result.stderr
+    reports = sorted(path.name for path in tmp_path.glob("*_analysis_report.pdf"))
+    assert reports == (["synthetic_analysis_report.pdf"] if option[0] == "--min-mapq"
+                       else ["synthetic_analysis_report.pdf", "synthetic_none_analysis_report.pdf"])
+
+
+def test_record_binning_of_a_small_file_does_not_import_numpy():
+    binned = ("from sam_bins import BinnedCoverage\nfrom sam_io import iter_sam_records\n"
+              "from sam_stats import SamStats\n"
+              "stats = SamStats([BinnedCoverage()]).update(iter_sam_records('test_mapping.sam'))")
+    assert not imports_numpy(binned)
+    assert imports_numpy(binned + "\nstats['bins'].result()")  # The bins themselves are NumPy arrays.
+
+
+@pytest.mark.parametrize("output_format", ["text", "json"])
+def test_stats_only_run_of_a_small_file_does_not_import_numpy(output_format):
+    assert not imports_numpy("import runpy, sys\n"
+                             f"sys.argv = ['analyse_sam.py', 'test_mapping.sam', '--stats-only', '--format', "
+                             f"'{output_format}']\n"
+                             "try:\n    runpy.run_path('analyse_sam.py', run_name='__main__')\n"
+                             "except SystemExit:\n    pass")
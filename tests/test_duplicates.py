@@ -0,0 +1,96 @@
+import numpy as np  # Random filter contents.
+import pytest
+
+from sam_cache import stats_config  # Cache key of a SamStats.
+from sam_duplicates import (DuplicateStats, clip_offsets, count_set_bits, fingerprint_int,
+                            fingerprints)  # Duplicate reads and their fingerprints.
+from sam_io import iter_sam_records  # Streaming SAM reader.
+from sam_mmap import mmap_stats  # Memory-mapped column parser.
+from sam_parallel import parallel_stats  # Byte ranges parsed by a process pool, then merged.
+from sam_stats import SamStats  # Single-pass statistics engine.
+
+
+# ==========================================================================
+# Bloom filter memory
+# ==========================================================================
+def test_count_set_bits_matches_unpackbits():
+    bits = np.random.default_rng(3).integers(0, 256, (3 << 20) + 17, dtype=np.uint8)
+    assert count_set_bits(bits) == int(np.unpackbits(bits).sum())
+    assert count_set_bits(np.zeros(0, dtype=np.uint8)) == 0
+
+
+def test_filter_is_allocated_on_first_insert(synthetic_sam):
+    duplicates = DuplicateStats("bloom", bloom_mb=2)
+    assert stats_config(SamStats([duplicates])) == "duplicates=bloom:2097152"
+    assert duplicates.bits is None and duplicates.estimated_size() == 0
+    expected = SamStats([duplicates]).update(iter_sam_records(synthetic_sam))["duplicates"].result()
+    assert len(duplicates.bits) == 2 << 20
+    empty = SamStats([DuplicateStats("bloom", bloom_mb=2)])  # Merging a range without reads.
+    assert SamStats([duplicates]).merge(empty)["duplicates"].result() == expected
+    assert empty.merge(SamStats([duplicates]))["duplicates"].result() == expected
+
+
+# ==========================================================================
+# Small inputs are counted without NumPy
+# ==========================================================================
+def test_fingerprint_int_matches_fingerprints():
+    rng = np.random.default_rng(5)
+    five_prime = rng.integers(-500, 1 << 31, 1000)
+    reverse = rng.integers(0, 2, 1000).astype(bool)
+    mate_references = rng.integers(0, 1 << 32, 1000)
+    mate_positions = rng.integers(0, 1 << 31, 1000)
+    expected = fingerprints(five_prime, reverse, mate_references, mate_positions).tolist()
+    assert [fingerprint_int(*values) for values in zip(five_prime.tolist(), reverse.tolist(),
+                                                       mate_references.tolist(), mate_positions.tolist())] == expected
+
+
+def test_buffered_counts_match_the_numpy_pass(synthetic_sam):
+    buffered = SamStats([DuplicateStats("exact")]).update(iter_sam_records(synthetic_sam))["duplicates"]
+    result = buffered.result()
+    assert result["duplicates"] > 0 and not buffered.reads  # Counted without a NumPy pass.
+    buffered.flush()
+    assert buffered.result() == result
+
+
+# ==========================================================================
+# Duplicates match a brute-force count
+# ==========================================================================
+def brute_force_duplicates(path):
+    # {reference: (mapped primary reads, duplicates)}: the first read of each key is the original.
+    seen, counts = set(), {}
+    for record in iter_sam_records(path):
+        if record.flag & (4 | 256 | 2048) or record.rname == "*" or record.cigar == "*":
+            continue
+        leading, trailing = clip_offsets(record.cigar)
+        reverse = bool(record.flag & 16)
+        five_prime = record.pos - 1 + trailing if reverse else record.pos - leading
+        mate = record.rname if record.rnext == "=" else record.rnext
+        key = (record.rname, five_prime, reverse, mate, record.pnext)
+        reads, duplicates = counts.get(record.rname, (0, 0))
+        counts[record.rname] = (reads + 1, duplicates + (key in seen))
+        seen.add(key)
+    return counts
+
+
+def duplicate_counts(accumulator):
+    result = accumulator.result()
+    return {name: (counts["reads"], counts["duplicates"]) for name, counts in result["references"].items()}
+
+
+@pytest.mark.parametrize("mode", ["exact", "bloom"])
+def test_duplicates_brute_force(synthetic_sam, mode):
+    expected = brute_force_duplicates(synthetic_sam)
+    assert sum(duplicates for _, duplicates in expected.values()) > 0
+    by_records = SamStats([DuplicateStats(mode, bloom_mb=1)]).update(iter_sam_records(synthetic_sam))
+    by_columns = mmap_stats(synthetic_sam, [DuplicateStats(mode, bloom_mb=1)])
+    assert duplicate_counts(by_records["duplicates"]) == expected
+    assert duplicate_counts(by_columns["duplicates"]) == expected
+
+
+def exact_duplicates():
+    return [DuplicateStats("exact")]
+
+
+def test_duplicates_merged_ranges(synthetic_sam):
+    stats = parallel_stats(synthetic_sam, 4, exact_duplicates)
+    assert duplicate_counts(stats["duplicates"]) == brute_force_duplicates(synthetic_sam)
@@ -0,0 +1,37 @@
+import pytest
+
+from conftest import record_stats, report_json  # Reference statistics and their JSON report.
+from sam_filter import ReadFilter, filtered_stats  # Filter push-down.
+
+
+# ==========================================================================
+# Helpers
+# ==========================================================================
+def write_copy(source, output, keep=lambda fields: True):
+    # Copy of a SAM file with the header and the alignment lines accepted by keep(fields).
+    with open(source) as file, open(output, "w") as out:
+        for line in file:
+            if line.startswith("@") or keep(line.rstrip("\n").split("\t")):
+                out.write(line)
+    return output
+
+
+# ==========================================================================
+# Filters match files filtered beforehand
+# ==========================================================================
+FILTER_SETS = {
+    "proper": (ReadFilter(require_flags=2), lambda flag, mapq, rname: flag & 2),
+    "mapq30": (ReadFilter(min_mapq=30), lambda flag, mapq, rname: mapq >= 30),
+    "primary": (ReadFilter(exclude_flags=4 | 256 | 2048), lambda flag, mapq, rname: not flag & (4 | 256 | 2048)),
+    "chr2": (ReadFilter(references={"chr2"}), lambda flag, mapq, rname: rname == "chr2"),
+}
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_filters_match_prefiltered_files(synthetic_sam, factory, tmp_path, jobs):
+    filters = {name: read_filter for name, (read_filter, _) in FILTER_SETS.items()}
+    results = filtered_stats(synthetic_sam, filters, factory, jobs=jobs)
+    for name, (_, keep) in FILTER_SETS.items():
+        prefiltered = write_copy(synthetic_sam, str(tmp_path / f"{name}.sam"),
+                                 lambda fields: keep(int(fields[1]), int(fields[4]), fields[2]))
+        assert report_json(results[name][1]) == report_json(record_stats(prefiltered, factory)), name
@@ -0,0 +1,129 @@
+import random  # Positions of the pair fixture, shuffled record order.
+
+from analyse_sam2 import (analyse_stream, analyze_chromosome_positions, count_reads_by_quality,
+                          read_sam_file)  # Read pair script.
+from sam_generate import generate_sam  # Deterministic synthetic SAM files.
+from sam_io import iter_sam_records, read_header_lines  # Streaming SAM reader.
+from sam_pairs import PairStats, insert_size_table, is_coordinate_sorted, pair_table  # Mate pairing.
+from sam_stats import SamStats  # Single-pass statistics engine.
+
+
+# ==========================================================================
+# Helpers
+# ==========================================================================
+def add_secondary_alignments(source, output):
+    # Copy of a SAM file with a secondary alignment (MAPQ 3, 200 bases before the primary) after the first
+    # mapped mate of every pair.
+    with open(source) as file, open(output, "w") as out:
+        for line in file:
+            out.write(line)
+            fields = line.split("\t")
+            if line.startswith("@") or int(fields[1]) & (4 | 128) or not int(fields[1]) & 1:
+                continue
+            fields[1], fields[3], fields[4] = str(int(fields[1]) | 256), str(max(int(fields[3]) - 200, 1)), "3"
+            out.write("\t".join(fields))
+    return output
+
+
+# ==========================================================================
+# analyse_sam2.py: one record per read of a pair
+# ==========================================================================
+def test_secondary_alignments_are_not_counted(tmp_path):
+    primary = str(tmp_path / "primary.sam")
+    generate_sam(primary, 1000, seed=11, paired=1.0, references=2, reference_length=50_000)
+    secondary = add_secondary_alignments(primary, str(tmp_path / "secondary.sam"))
+    expected, results = analyse_stream(primary), analyse_stream(secondary)
+    assert results["pair_order"].result() != expected["pair_order"].result()  # Every mapped record.
+    for name in ("chromosomes", "quality"):
+        assert results[name].result() == expected[name].result(), name
+    assert 3 not in results["quality"].result()
+    data, expected_data = read_sam_file(secondary), read_sam_file(primary)
+    assert analyze_chromosome_positions(data) == analyze_chromosome_positions(expected_data)
+    assert count_reads_by_quality(data) == count_reads_by_quality(expected_data)
+
+
+# ==========================================================================
+# sam_pairs.PairStats: same tables in memory, through the spill files and by sorted eviction
+# ==========================================================================
+REFERENCES = [("chr1", 100_000), ("chr2", 80_000), ("chr3", 60_000)]
+
+
+def pair_records(seed=13):
+    # (qname, flag, rname, pos, rnext, pnext, tlen) of proper, discordant, cross-chromosome, one-mapped and
+    # unmapped pairs, orphans (mate missing), single-end reads and secondary alignments.
+    rng = random.Random(seed)
+    names = [name for name, _ in REFERENCES]
+    records = []
+
+    def place():
+        return rng.choice(names), rng.randint(1, 50_000)
+
+    for number in range(300):  # Proper pairs (FLAG 99/147), and discordant ones (97/145) with a long insert.
+        rname, pos = place()
+        proper = number % 8 != 0
+        insert = rng.randint(150, 400) if proper else rng.randint(5_000, 20_000)
+        mate_pos = pos + insert - 100
+        flags = (99, 147) if proper else (97, 145)
+        records += [(f"pair{number}", flags[0], rname, pos, "=", mate_pos, insert),
+                    (f"pair{number}", flags[1], rname, mate_pos, "=", pos, -insert)]
+        if number % 15 == 0:  # Secondary alignment of the first mate.
+            records.append((f"pair{number}", 256 | 65, rname, max(pos - 300, 1), "=", mate_pos, 0))
+    for number in range(30):  # Mates on two references.
+        (rname, pos), (mate_rname, mate_pos) = rng.sample([(name, rng.randint(1, 50_000)) for name in names], 2)
+        records += [(f"cross{number}", 65, rname, pos, mate_rname, mate_pos, 0),
+                    (f"cross{number}", 129, mate_rname, mate_pos, rname, pos, 0)]
+    for number in range(20):  # One mate mapped, the other placed at its position.
+        rname, pos = place()
+        records += [(f"half{number}", 73, rname, pos, "=", pos, 0), (f"half{number}", 133, rname, pos, "=", pos, 0)]
+    for number in range(10):
+        records += [(f"unmapped{number}", 77, "*", 0, "*", 0, 0), (f"unmapped{number}", 141, "*", 0, "*", 0, 0)]
+    for number in range(25):  # The mate never shows up, on the same reference or another one.
+        (rname, pos), (mate_rname, mate_pos) = place(), place()
+        records.append((f"orphan{number}", 65 if number % 2 else 129, rname, pos,
+                        "=" if mate_rname == rname else mate_rname, mate_pos, 0))
+    for number in range(30):
+        rname, pos = place()
+        records.append((f"single{number}", 0, rname, pos, "*", 0, 0))
+    return records
+
+
+def write_pair_file(path, records, coordinate_sorted):
+    ranks = {name: rank for rank, (name, _) in enumerate(REFERENCES)}
+    if coordinate_sorted:
+        records = sorted(records, key=lambda record: (ranks.get(record[2], len(ranks)), record[3]))
+    else:
+        records = random.Random(1).sample(records, len(records))
+    with open(path, "w") as file:
+        file.write(f"@HD\tVN:1.6\tSO:{'coordinate' if coordinate_sorted else 'unsorted'}\n")
+        file.writelines(f"@SQ\tSN:{name}\tLN:{length}\n" for name, length in REFERENCES)
+        for qname, flag, rname, pos, rnext, pnext, tlen in records:
+            cigar = "*" if flag & 4 else "100M"
+            file.write(f"{qname}\t{flag}\t{rname}\t{pos}\t{0 if flag & 4 else 60}\t{cigar}\t{rnext}\t{pnext}\t"
+                       f"{tlen}\t{'A' * 100}\t{'I' * 100}\n")
+    return path
+
+
+def pair_tables(path, pairs):
+    result = SamStats([pairs]).update(iter_sam_records(path))["pairs"].result()
+    return pair_table(result), insert_size_table(result["insert_sizes"])
+
+
+def test_pairing_modes_give_the_same_tables(tmp_path):
+    records = pair_records()
+    unsorted = write_pair_file(str(tmp_path / "unsorted.sam"), records, coordinate_sorted=False)
+    sorted_path = write_pair_file(str(tmp_path / "sorted.sam"), records, coordinate_sorted=True)
+    in_memory = PairStats(False, REFERENCES)
+    expected = pair_tables(unsorted, in_memory)
+    rows = {row[0]: row[1] for row in expected[0]}
+    assert (rows["Pairs"], rows["Cross-Chromosome"], rows["One Mate Mapped"], rows["No Mate Mapped"],
+            rows["Orphan Reads (mate missing)"], rows["Single-End Reads"]) == (360, 30, 20, 10, 25, 30)
+
+    spilled = PairStats(False, REFERENCES, max_pending=8, partitions=3, spill_dir=str(tmp_path))
+    assert pair_tables(unsorted, spilled) == expected
+    assert spilled.peak_pending <= 8 < in_memory.peak_pending
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["sorted.sam", "unsorted.sam"]  # Spill removed.
+
+    evicting = PairStats(is_coordinate_sorted(read_header_lines(sorted_path)), REFERENCES)
+    assert pair_tables(sorted_path, evicting) == expected
+    assert evicting.coordinate_sorted  # No fallback to the spill files.
+    assert evicting.peak_pending < in_memory.peak_pending
@@ -0,0 +1,53 @@
+import gzip
+
+import pytest
+
+from conftest import analyse_json, report_json
+from sam_bam import write_bam, write_bgzf
+from sam_io import iter_sam_records, read_header_lines, read_references
+from sam_mmap import file_stats, mmap_stats
+from sam_parallel import parallel_stats
+
+
+# ==========================================================================
+# Input formats give the same report
+# ==========================================================================
+def test_bam_roundtrip(synthetic_sam, factory, expected, tmp_path):
+    bam = str(tmp_path / "synthetic.bam")
+    header = "".join(line + "\n" for line in read_header_lines(synthetic_sam))
+    write_bam(bam, iter_sam_records(synthetic_sam), read_references(synthetic_sam), header)
+    assert read_references(bam) == read_references(synthetic_sam)
+    assert report_json(file_stats(bam, factory())) == expected
+
+
+def test_gzip_and_bgzf(synthetic_sam, factory, expected, tmp_path):
+    with open(synthetic_sam, "rb") as file:
+        data = file.read()
+    plain_gzip = str(tmp_path / "synthetic.sam.gz")
+    with gzip.open(plain_gzip, "wb") as file:
+        file.write(data)
+    bgzf = str(tmp_path / "synthetic.bgzf.sam.gz")
+    write_bgzf(bgzf, data)
+    for path in (plain_gzip, bgzf):
+        assert report_json(file_stats(path, factory())) == expected
+        assert report_json(file_stats(path, factory(), threads=2)) == expected
+
+
+def test_mmap_columns(synthetic_sam, factory, expected):
+    assert report_json(mmap_stats(synthetic_sam, factory())) == expected
+
+
+def test_parallel_jobs(synthetic_sam, factory, expected):
+    assert report_json(parallel_stats(synthetic_sam, 3, factory)) == expected
+
+
+@pytest.mark.parametrize("suffix", ["", ".gz", ".jobs"])
+def test_cli_json(synthetic_sam, expected, tmp_path, suffix):
+    path, options = synthetic_sam, []
+    if suffix == ".gz":
+        path = str(tmp_path / "cli.sam.gz")
+        with open(synthetic_sam, "rb") as file, gzip.open(path, "wb") as out:
+            out.write(file.read())
+    elif suffix == ".jobs":
+        options = ["--jobs", "2"]
+    assert analyse_json(path, "--depth", "--sequence-stats", *options) == expected
@@ -0,0 +1,83 @@
+from collections import Counter  # Records per QNAME.
+import pytest
+
+from conftest import TEST_MAPPING  # Small SAM file of the repository.
+from sam_io import iter_sam_records, read_references  # Streaming SAM reader.
+from sam_report import report_accumulators, report_tables  # Accumulators and tables of the report.
+from sam_sample import (SampleInfo, cluster_interval, hash_sample, hash_sample_records, sample_counts,
+                        sampled_stats, sampled_tables, wilson_interval)  # --sample.
+from sam_stats import SamStats  # Single-pass statistics engine.
+
+
+# ==========================================================================
+# Helpers
+# ==========================================================================
+def qname_counts(lines):
+    return Counter(line.split("\t", 1)[0] for line in lines if not line.startswith("@"))
+
+
+@pytest.fixture(scope="module")
+def full_counts(synthetic_sam):
+    # ({(table, row): reads} of the summary and MAPQ tables, total reads) of the whole file.
+    stats = SamStats().update(iter_sam_records(synthetic_sam))
+    return sample_counts(stats), stats["reads"].total
+
+
+# ==========================================================================
+# Hash sampling keeps the mates together
+# ==========================================================================
+def test_hash_sample_keeps_or_drops_both_mates(synthetic_sam):
+    with open(synthetic_sam) as file:
+        lines = file.readlines()
+    full = qname_counts(lines)
+    info = SampleInfo("hash")
+    kept = qname_counts(hash_sample(lines, 0.3, info))
+    assert 0 < len(kept) < len(full) and info.seen == sum(full.values())
+    assert max(full.values()) > 1  # Pairs are present.
+    assert all(count == full[qname] for qname, count in kept.items())
+    records = hash_sample_records(iter_sam_records(synthetic_sam), 0.3, SampleInfo("hash"))
+    assert Counter(record.qname for record in records) == kept
+
+
+# ==========================================================================
+# A fixed seed gives the same sample
+# ==========================================================================
+@pytest.mark.parametrize("method, sample", [("stride", (0.3, None)), ("reservoir", (None, 500))])
+def test_fixed_seed_is_reproducible(synthetic_sam, method, sample):
+    def tables(seed):
+        stats, info = sampled_stats(synthetic_sam, None, *sample, method=method, seed=seed)
+        return sampled_tables(report_tables(stats), stats, info)
+    assert tables(3) == tables(3)
+    assert tables(3) != tables(4)
+
+
+# ==========================================================================
+# Confidence intervals contain the proportions of the whole file
+# ==========================================================================
+@pytest.mark.parametrize("method, fraction", [("hash", 0.3), ("stride", 0.3), ("stride", 0.5)])
+def test_intervals_contain_the_full_file_proportions(synthetic_sam, full_counts, method, fraction):
+    counts, total = full_counts
+    stats, info = sampled_stats(synthetic_sam, None, fraction, method=method)
+    sampled = sample_counts(stats)
+    assert (len(info.windows) > 1) == (method == "stride")  # Stride: cluster intervals over the windows.
+    for key, hits in sampled.items():
+        if key == ("summary", "Total Reads"):
+            continue
+        if info.windows:
+            low, high = cluster_interval(info.windows, key)
+        else:
+            low, high = wilson_interval(hits, stats["reads"].total)
+        assert low <= counts.get(key, 0) / total <= high, key
+
+
+# ==========================================================================
+# A sample covering the whole file is the full analysis
+# ==========================================================================
+def test_stride_sample_of_a_small_file_is_the_full_analysis():
+    references = read_references(TEST_MAPPING)
+    stats, info = sampled_stats(TEST_MAPPING, report_accumulators(references), None, 100000, method="stride")
+    full = SamStats(report_accumulators(references)).update(iter_sam_records(TEST_MAPPING))
+    assert info.fraction == 1 and info.estimated_total == full["reads"].total
+    assert report_tables(stats) == report_tables(full)
+    summary = sampled_tables(report_tables(stats), stats, info)["Summary Statistics"][1]
+    assert {row[-1] for row in summary} == {"-", "exact"}
@@ -0,0 +1,66 @@
+import random  # Read lengths, bases and qualities of the fixture.
+import numpy as np  # Non-zero cells of the result matrices.
+
+from sam_io import iter_sam_records  # Streaming SAM reader.
+from sam_mmap import mmap_stats  # Memory-mapped column parser.
+from sam_sequence import QUALITY_BINS, SequenceStats  # SEQ/QUAL statistics.
+from sam_stats import SamStats  # Single-pass statistics engine.
+
+
+# ==========================================================================
+# Helpers
+# ==========================================================================
+def write_mixed_lengths(path, reads=3000, seed=5):
+    # Reads of very different lengths (one of 5 kb) on both strands, some with N bases or without QUAL.
+    rng = random.Random(seed)
+    with open(path, "w") as file:
+        file.write("@HD\tVN:1.6\n@SQ\tSN:chr1\tLN:1000000\n")
+        for index in range(reads):
+            length = 5000 if index == reads // 2 else rng.choice([100, 100, 100, 36, 51, 150, 250])
+            seq = "".join(rng.choice("ACGTN" if index % 7 == 0 else "ACGT") for _ in range(length))
+            qual = "".join(chr(33 + rng.randint(2, 40)) for _ in range(length)) if index % 11 else "*"
+            flag = (16 if index % 2 else 0) | (256 if index % 13 == 0 else 0)
+            file.write(f"r{index}\t{flag}\tchr1\t{1 + index}\t60\t{length}M\t*\t0\t0\t{seq}\t{qual}\n")
+    return path
+
+
+def brute_force(path):
+    # Per-cycle quality, mean read quality, GC% and length histograms, one base at a time.
+    cycle_quality, read_quality = {}, [0] * QUALITY_BINS
+    gc_content, lengths = [0] * 101, {}
+    for record in iter_sam_records(path):
+        if record.flag & (256 | 2048) or record.seq == "*":
+            continue
+        seq, qual = record.seq, record.qual
+        if record.flag & 16:
+            seq, qual = seq[::-1], qual[::-1]
+        lengths[len(seq)] = lengths.get(len(seq), 0) + 1
+        called = sum(base not in "Nn" for base in seq)
+        if called:
+            gc_content[round(100 * sum(base in "GCgc" for base in seq) / called)] += 1
+        if qual != "*":
+            scores = [ord(char) - 33 for char in qual]
+            for cycle, score in enumerate(scores):
+                cycle_quality[cycle, score] = cycle_quality.get((cycle, score), 0) + 1
+            read_quality[sum(scores) // len(scores)] += 1
+    return cycle_quality, read_quality, gc_content, lengths
+
+
+def nonzero_cells(matrix):
+    # {(row, column): count} of the non-zero cells of a matrix.
+    return {tuple(cell): int(matrix[tuple(cell)]) for cell in np.argwhere(matrix).tolist()}
+
+
+# ==========================================================================
+# Reads of very different lengths
+# ==========================================================================
+def test_mixed_read_lengths(tmp_path):
+    path = write_mixed_lengths(str(tmp_path / "mixed.sam"))
+    cycle_quality, read_quality, gc_content, lengths = brute_force(path)
+    by_columns = mmap_stats(path, [SequenceStats()])["sequence"].result()
+    by_records = SamStats([SequenceStats()]).update(iter_sam_records(path))["sequence"].result()
+    for result in (by_columns, by_records):
+        assert nonzero_cells(result["cycle_quality"]) == cycle_quality
+        assert result["read_quality"].tolist() == read_quality
+        assert result["gc_content"].tolist() == gc_content
+        assert {length: int(count) for length, count in enumerate(result["lengths"]) if count} == lengths
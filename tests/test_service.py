@@ -0,0 +1,30 @@
+import os
+import shutil
+
+import sam_service
+from sam_service import ResultStore, run_service
+
+REAL_PROCESS_FILE = sam_service.process_file
+
+
+def crashing_process_file(path, size, mtime, output_dir=None, validate=True):
+    # Worker killed by the OS (e.g. out of memory) on the files named crash*.
+    if os.path.basename(path).startswith("crash"):
+        os._exit(9)
+    return REAL_PROCESS_FILE(path, size, mtime, output_dir, validate)
+
+
+def test_killed_worker_is_stored_as_error(synthetic_sam, tmp_path, monkeypatch):
+    monkeypatch.setattr(sam_service, "process_file", crashing_process_file)
+    watched = tmp_path / "watched"
+    watched.mkdir()
+    for name in ("a.sam", "crash.sam", "b.sam", "c.sam"):
+        shutil.copy(synthetic_sam, watched / name)
+    store = ResultStore(str(tmp_path / "results.sqlite"))
+    run_service(str(watched), store, jobs=2, interval=0.05, settle=0, once=True)
+    status = {os.path.basename(entry["path"]): entry["status"] for entry in store.files()}
+    assert status == {"a.sam": "done", "b.sam": "done", "c.sam": "done", "crash.sam": "error"}
+    # After a restart, the crashing file is known and not analysed again.
+    run_service(str(watched), store, jobs=2, interval=0.05, settle=0, once=True)
+    assert len(store.files()) == 4
+    store.close()
@@ -0,0 +1,24 @@
+import json  # Reports are compared section by section.
+
+from conftest import analyse_json, report_json  # JSON reports of the command line and of the statistics.
+from sam_snapshot import Snapshot, export_snapshot, snapshot_accumulators, snapshot_stats  # .samcol files.
+
+
+# ==========================================================================
+# A snapshot gives the report of the SAM file it was exported from
+# ==========================================================================
+def test_snapshot(synthetic_sam, factory, expected, tmp_path):
+    output = export_snapshot(synthetic_sam, str(tmp_path / "synthetic.samcol"), sequences=True)
+    assert report_json(snapshot_stats(output, factory())) == expected
+    # Without SEQ/QUAL, every other section is unchanged.
+    bare = export_snapshot(synthetic_sam, str(tmp_path / "bare.samcol"))
+    snapshot = Snapshot(bare)
+    accumulators = snapshot_accumulators(snapshot, factory)
+    tables = json.loads(report_json(snapshot_stats(bare, accumulators, snapshot=snapshot)))
+    full = json.loads(expected)
+    assert tables == {title: table for title, table in full.items() if title in tables}
+
+
+def test_cli_json(synthetic_sam, expected, tmp_path):
+    path = export_snapshot(synthetic_sam, str(tmp_path / "cli.samcol"), sequences=True)
+    assert analyse_json(path, "--depth", "--sequence-stats") == expected
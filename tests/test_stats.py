@@ -0,0 +1,24 @@
+import json
+
+import pytest
+
+from sam_io import iter_sam_records, read_references
+from sam_pairs import PairStats
+from sam_report import report_accumulators, report_tables, tables_to_dict
+from sam_stats import ACCUMULATOR_TYPES, SamStats, STATS_FORMAT_VERSION
+
+
+def test_saved_stats_roundtrip(synthetic_sam):
+    accumulators = report_accumulators(read_references(synthetic_sam), depth=True, sequences=True) + [PairStats()]
+    stats = SamStats(accumulators).update(iter_sam_records(synthetic_sam))
+    data = json.loads(json.dumps(stats.to_dict()))
+    assert {item["type"] for item in data["accumulators"]} <= set(ACCUMULATOR_TYPES.values())
+    loaded = SamStats.from_dict(data)
+    assert tables_to_dict(report_tables(loaded)) == tables_to_dict(report_tables(stats))
+
+
+@pytest.mark.parametrize("type_name", ["os.ReadCounter", "sam_stats.SamStats", "subprocess.Popen", None])
+def test_unknown_accumulator_type_is_rejected(type_name):
+    data = {"version": STATS_FORMAT_VERSION, "accumulators": [{"type": type_name, "state": {}}]}
+    with pytest.raises(ValueError, match="Unknown accumulator type"):
+        SamStats.from_dict(data)
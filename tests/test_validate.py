@@ -0,0 +1,26 @@
+from sam_validate import validate_file
+
+
+def corrupt_copy(source, output, every=50):
+    # Copy of a SAM file with the MAPQ of every `every`-th alignment line out of range.
+    with open(source) as file, open(output, "w") as out:
+        number = 0
+        for line in file:
+            if not line.startswith("@"):
+                number += 1
+                if number % every == 0:
+                    fields = line.split("\t")
+                    fields[4] = "300"
+                    line = "\t".join(fields)
+            out.write(line)
+    return output
+
+
+def test_sampled_errors_have_the_line_numbers_of_full_mode(synthetic_sam, tmp_path):
+    path = corrupt_copy(synthetic_sam, tmp_path / "corrupt.sam")
+    full = validate_file(str(path), max_errors=10 ** 6)
+    sampled = validate_file(str(path), sample=1000, max_errors=10 ** 6)
+    assert full["error_count"] > 0 and sampled["error_count"] > 0
+    assert len({number for number, _ in sampled["errors"]}) > 2  # Errors found in several sampled blocks.
+    assert set(sampled["errors"]) <= set(full["errors"])
+    assert validate_file(synthetic_sam)["error_count"] == 0